@@ -0,0 +1,174 @@
+import numpy as np
+from pandas import DataFrame, MultiIndex, Timedelta, concat
+
+from . import results, segments
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# PRE-AGGREGATED LEVELS OF PIVOTS
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Absolute values saved as pivots in '<...>-<subsystem>.hdf' files are also aggregated in time bins of different widths,
+# saved as '<key>_agg<level>' (e.g. 'IsPulser_Baseline_agg1h') in the same file, with one row per channel and bin:
+#   channel, datetime (start of the bin), count, mean, m2 (sum of squared deviations from the mean), min, max
+# Bins of appended data are combined with the saved ones when reading (see the segments module), so that long time ranges
+# can be shown without reading all values.
+
+# name of the level (used in keys): width of its bins
+LEVELS = {
+    "1min": Timedelta("1min"),
+    "10min": Timedelta("10min"),
+    "1h": Timedelta("1h"),
+    "1d": Timedelta("1D"),
+}
+
+COLUMNS = ["channel", "datetime", "count", "mean", "m2", "min", "max"]
+
+
+def get_key(key_name: str, level: str) -> str:
+    """Get the key of a level of aggregated values of a pivot key."""
+    return f"{key_name}_agg{level}"
+
+
+def get_rows(df_pivot: DataFrame) -> DataFrame:
+    """Convert a pivot (datetimes vs channels) to single values to aggregate; None if values are not numeric."""
+    if not all(np.issubdtype(dtype, np.number) for dtype in df_pivot.dtypes):
+        return None
+    rows = (
+        df_pivot.rename_axis(index="datetime", columns="channel")
+        .melt(ignore_index=False, value_name="mean")
+        .reset_index()
+        .dropna(subset=["mean"])
+    )
+    rows["mean"] = rows["mean"].astype("float64")
+    rows["count"] = 1
+    rows["m2"] = 0.0
+    rows["min"] = rows["mean"]
+    rows["max"] = rows["mean"]
+    return rows[COLUMNS]
+
+
+def aggregate(df: DataFrame, level: str) -> DataFrame:
+    """Aggregate values (or already aggregated values of a finer level) in the bins of a level."""
+    return combine(df.assign(datetime=df["datetime"].dt.floor(LEVELS[level])))
+
+
+def combine(df: DataFrame) -> DataFrame:
+    """Combine aggregated values of the same channel and bin (pairwise update of mean and sum of squared deviations)."""
+    keys = ["channel", "datetime"]
+    df = df.assign(total=df["count"] * df["mean"])
+    out = df.groupby(keys, sort=True).agg(
+        count=("count", "sum"),
+        total=("total", "sum"),
+        min=("min", "min"),
+        max=("max", "max"),
+    )
+    out["mean"] = out["total"] / out["count"]
+    # squared deviations wrt the mean of the bin: m2 + count * (mean - bin mean)^2
+    bin_mean = out["mean"].reindex(MultiIndex.from_frame(df[keys])).to_numpy()
+    df["m2"] = df["m2"] + df["count"] * (df["mean"] - bin_mean) ** 2
+    out["m2"] = df.groupby(keys, sort=True)["m2"].sum()
+    return out.reset_index()[COLUMNS]
+
+
+def get_levels(rows: DataFrame) -> dict:
+    """Aggregate single values in all levels, each level being built from the finer one."""
+    levels = {}
+    df = rows
+    for level in LEVELS:
+        df = aggregate(df, level)
+        levels[level] = df
+    return levels
+
+
+def is_level_key(key_name: str) -> bool:
+    """Check if a key holds a level of aggregated values."""
+    return any(key_name.endswith(get_key("", level)) for level in LEVELS)
+
+
+def merge(dfs: list) -> DataFrame:
+    """Merge parts of a level (e.g. saved in different segments), combining values of the same channel and bin."""
+    df = concat(dfs, ignore_index=True)
+    if df.duplicated(["channel", "datetime"]).any():
+        df = combine(df)
+    return df
+
+
+# -------------------------------------------------------------------------------
+# reading
+# -------------------------------------------------------------------------------
+
+
+def select_level(start, end, n_points: int) -> str:
+    """Get the coarsest level with at least n_points bins in the time range [start, end) (the finest level if none)."""
+    width = (
+        results.get_utc_timestamp(end) - results.get_utc_timestamp(start)
+    ) / n_points
+    selected = list(LEVELS)[0]
+    for level, level_width in LEVELS.items():
+        if level_width <= width:
+            selected = level
+    return selected
+
+
+def read_aggregates(
+    file_path: str,
+    key_name: str,
+    start=None,
+    end=None,
+    channels: list = None,
+    n_points: int = None,
+    level: str = None,
+) -> DataFrame:
+    """
+    Read aggregated values of a pivot key (e.g. 'IsPulser_Baseline'): channel, datetime (start of the bin), mean, std, min, max, count.
+
+    start, end: time range [start, end) to read, as datetime, pandas Timestamp or string 'YYYY-MM-DD hh:mm:ss' (UTC if no timezone is given);
+        default: whole saved range
+    channels: list of channels to read (default: all)
+    n_points: number of points (e.g. pixels) needed over the time range; the coarsest level giving at least as many bins is read
+    level: level to read (see LEVELS), instead of choosing it from n_points (default: finest level)
+    Returns None if no aggregated values were saved for this key.
+    """
+    with segments.open_files(file_path) as stores:
+        if not segments.get_key_stores(stores, get_key(key_name, list(LEVELS)[0])):
+            return None
+
+        if level is None and n_points is not None:
+            if start is None or end is None:
+                # saved time range, from the coarsest level
+                times = concat(
+                    segments.read_parts(
+                        stores,
+                        get_key(key_name, list(LEVELS)[-1]),
+                        lambda store, key: store.select_column(key, "datetime"),
+                    )
+                )
+                start = times.min() if start is None else start
+                end = times.max() + LEVELS[list(LEVELS)[-1]] if end is None else end
+            level = select_level(start, end, n_points)
+        elif level is None:
+            level = list(LEVELS)[0]
+
+        conditions = results.get_time_conditions(
+            "datetime",
+            # include the bin containing the start time
+            results.get_utc_timestamp(start).floor(LEVELS[level])
+            if start is not None
+            else None,
+            end,
+        )
+        if channels is not None:
+            conditions.append("channel in {}".format([int(ch) for ch in channels]))
+        df = merge(
+            segments.read_parts(
+                stores,
+                get_key(key_name, level),
+                lambda store, key: store.select(key, where=conditions or None),
+            )
+        )
+
+    df["std"] = np.sqrt(df["m2"] / (df["count"] - 1).where(df["count"] > 1))
+    return (
+        df[["channel", "datetime", "mean", "std", "min", "max", "count"]]
+        .sort_values(["channel", "datetime"])
+        .reset_index(drop=True)
+    )
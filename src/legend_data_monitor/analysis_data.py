@@ -1,14 +1,12 @@
-import os
-import shelve
+import copy
 import sys
 
 import numpy as np
 import pandas as pd
-from legendmeta import LegendMetadata
 
 # needed to know which parameters are not in DataLoader
 # but need to be calculated, such as event rate
-from . import utils
+from . import binning, jagged, metadata, results, utils
 
 # -------------------------------------------------------------------------
 
@@ -34,6 +32,10 @@ class AnalysisData:
             str that has info regarding pulser operations (as difference or ratio wrt geds (spms?) data). Available options are:
                 - "pulser01anaRatio"
                 - "pulser01anaDiff"
+        channel_map=
+            DataFrame with channel map info (name, location, position, ...) of each channel, e.g. Subsystem.channel_map.
+            Data only keep channel, datetime and parameters; channel map info are looked up here.
+            Default: taken from sub_data, if it has channel map columns
         Or input kwargs directly parameters=, event_type=, cuts=, variation=, time_window=
     """
 
@@ -45,6 +47,7 @@ class AnalysisData:
             kwargs["selection"].copy() if "selection" in kwargs else kwargs.copy()
         )
         aux_info = kwargs["aux_info"] if "aux_info" in kwargs else None
+        channel_map = kwargs["channel_map"] if "channel_map" in kwargs else None
 
         # -------------------------------------------------------------------------
         # validity checks
@@ -125,13 +128,19 @@ class AnalysisData:
         # when plotting, no variation will be included as specified in the config file)
         self.variation = True
         self.aux_info = aux_info
+        # one row per channel, instead of channel map columns repeated in each row of data
+        self.channel_map = (
+            get_channel_table(sub_data) if channel_map is None else channel_map
+        )
+        # binned values of the analysed data, by (time window, parameter), shared by its plots (see binning.get_bins())
+        self.time_bins = {}
 
         # -------------------------------------------------------------------------
         # subselect data
         # -------------------------------------------------------------------------
 
         # always get basic parameters
-        params_to_get = ["datetime"] + utils.COLUMNS_TO_LOAD + ["status"]
+        params_to_get = ["datetime", "channel"]
 
         for col in sub_data.columns:
             # pulser flag is present only if subsystem.flag_pulser_events() was called -> needed to subselect phy/pulser events
@@ -272,16 +281,11 @@ class AnalysisData:
                 # ! sorry need to jump through a lot of hoops here ! bare with me....
 
                 # --- count number of events in given time windows
-                # - count() returns count of rows for each column - redundant, same value in each (unless we have NaN)
-                # just want one column 'event_rate' -> pick 'channel' since it's never NaN, so correct count; rename to event rate
-                # - this is now a resampled dataframe with column event rate, and multiindex channel, datetime -> put them back as columns with reset index
-                event_rate = (
-                    self.data.set_index("datetime")
-                    .groupby("channel")
-                    .resample(self.time_window, origin="start")
-                    .count()["channel"]
-                    .to_frame(name="event_rate")
-                    .reset_index()
+                # - events of all channels are counted in the windows of a common grid, starting at the first timestamp (see binning.py)
+                # - bins are kept from the first to the last event of each channel, empty ones with a count of 0
+                event_rate = binning.bin_data(self.data, self.time_window)
+                event_rate = event_rate[["channel", "datetime", "entries"]].rename(
+                    columns={"entries": "event_rate"}
                 )
 
                 # ToDo: check time_window for event rate is smaller than the time window, but bigger than the rate (otherwise plots make no sense)
@@ -290,12 +294,14 @@ class AnalysisData:
                 dt_seconds = get_seconds(self.time_window)
                 event_rate["event_rate"] = event_rate["event_rate"] * 1.0 / dt_seconds
 
-                # --- get rid of last value
-                # as the data range does not equally divide by the time window, the count in the last "window" will be smaller
+                # --- get rid of last window
+                # as the data range does not equally divide by the time window, the count in the last window of the grid will be smaller
                 # as it corresponds to, in reality, smaller window
                 # since we divided by the window, the rate then will appear as smaller
-                # it's too complicated to fix that, so I will just get rid of the last row
-                event_rate = event_rate.iloc[:-1]
+                # it's too complicated to fix that, so I will just get rid of the last window (for all channels)
+                event_rate = event_rate[
+                    event_rate["datetime"] < event_rate["datetime"].max()
+                ].copy()
 
                 # --- shift timestamp
                 # the resulting table will start with the first timestamp of the original table
@@ -304,25 +310,8 @@ class AnalysisData:
                     event_rate["datetime"] + pd.Timedelta(self.time_window) / 2
                 )
 
-                # --- now have to jump through hoops to put back in location position and name
-                # - group original table by channel and pick first occurrence to get the channel map (ignore other columns)
-                # - reindex to match event rate table index
-                # - put the columns in with concat
-                event_rate = event_rate.set_index("channel")
-                # need to copy, otherwise next line removes "channel" from original, and crashes next time over not finding channel
-                columns = utils.COLUMNS_TO_LOAD[:]
-                columns.remove("channel")
-                self.data = pd.concat(
-                    [
-                        event_rate,
-                        self.data.groupby("channel")
-                        .first()
-                        .reindex(event_rate.index)[columns],
-                    ],
-                    axis=1,
-                )
-                # put the channel back as column
-                self.data = self.data.reset_index()
+                # channel map info are not needed: they are looked up by channel when needed
+                self.data = event_rate.reset_index(drop=True)
             elif param == "FWHM":
                 # calculate FWHM for each channel (substitute 'param' column with it)
                 channel_fwhm = (
@@ -347,9 +336,8 @@ class AnalysisData:
 
                 # ToDo: already loaded before in Subsystem => 1) load mass already then, 2) inherit channel map from Subsystem ?
                 # get channel map at this timestamp
-                lmeta = LegendMetadata()
-                full_channel_map = lmeta.hardware.configuration.channelmaps.on(
-                    timestamp=first_timestamp
+                full_channel_map = metadata.get_legend_on(
+                    "hardware/configuration/channelmaps", first_timestamp
                 )
 
                 # get pulser rate
@@ -362,20 +350,20 @@ class AnalysisData:
 
                 # - subselect only pulser events (flag_pulser True)
                 # - count number of rows i.e. events for each detector
-                # - select arbitrary column that is definitely not NaN in each row e.g. channel to represent the count
+                # - select arbitrary column that is definitely not NaN in each row e.g. datetime to represent the count
                 # - rename to "pulser_events"
-                # now we have a table with number of pulser events as column with DETECTOR NAME AS INDEX
+                # now we have a table with number of pulser events as column with CHANNEL AS INDEX
                 df_livetime = (
                     self.data[self.data["flag_pulser"]]
-                    .groupby("name")
-                    .count()["channel"]
+                    .groupby("channel")["datetime"]
+                    .count()
                     .to_frame("pulser_events")
                 )
 
                 # ------ calculate livetime for each detector and add it to original dataframe
                 df_livetime["livetime_in_s"] = df_livetime["pulser_events"] / rate
 
-                self.data = self.data.set_index("name")
+                self.data = self.data.set_index("channel")
                 self.data = pd.concat(
                     [self.data, df_livetime.reindex(self.data.index)], axis=1
                 )
@@ -384,19 +372,23 @@ class AnalysisData:
 
                 # --- calculate exposure for each detector
                 # get diodes map
-                dets_map = lmeta.hardware.detectors.germanium.diodes
+                dets_map = (
+                    metadata.get_legend_metadata().hardware.detectors.germanium.diodes
+                )
+                names = self.channel_map.set_index("channel")["name"]
 
-                # add a new column "mass" to self.data containing mass values evaluated from dets_map[channel_name]["production"]["mass_in_g"], where channel_name is the value in "name" column
-                for det_name in self.data.index.unique():
+                # add a new column "exposure" to self.data with mass values evaluated from dets_map[channel_name]["production"]["mass_in_g"], where channel_name is the name of the channel in the channel map
+                for channel in self.data.index.unique():
+                    det_name = names[channel]
                     mass_in_kg = dets_map[det_name]["production"]["mass_in_g"] / 1000
                     # exposure in kg*yr
-                    self.data.at[det_name, "exposure"] = (
+                    self.data.at[channel, "exposure"] = (
                         mass_in_kg
-                        * df_livetime.at[det_name, "livetime_in_s"]
+                        * df_livetime.at[channel, "livetime_in_s"]
                         / (60 * 60 * 24 * 365.25)
                     )
 
-                self.data.reset_index()
+                self.data = self.data.reset_index()
             elif param == "AoE_Custom":
                 self.data["AoE_Custom"] = self.data["A_max"] / self.data["cuspEmax"]
 
@@ -404,25 +396,27 @@ class AnalysisData:
         """
         Get mean value of each parameter of interest in each channel in the first 10% of the dataset.
 
-        Ignore in case of SiPMs, as each entry is a list of values, not a single value.
+        For SiPMs, each entry is a list of values: the mean is taken over all values of list-valued parameters of each channel.
         """
         utils.logger.info("... getting channel mean")
         # series with index channel, columns of parameters containing mean of each channel;
         # the mean is performed over the first 10% interval of the full time range specified in the config file
 
-        # get mean (only for non-list parameters; in that case, add a new column with None values):
-        # check if we are looking at SiPMs -> do not get mean because entries are usually lists
-        # ToDo: need to iterate over the parameters (some of them could be lists, others not)
+        # for SiPMs, entries are usually lists (JaggedArray columns): their mean is taken over all values
 
         # congratulations, it's a sipm!
         if self.is_spms():
             channels = (self.data["channel"]).unique()
-            # !! need to update for multiple parameter case!
-            channel_mean = pd.DataFrame(
-                {"channel": channels, self.parameters[0]: [None] * len(channels)}
-            )
-            channel_mean = channel_mean.set_index("channel")
-            # !! need to update for multiple parameter case!
+            channel_mean = pd.DataFrame(index=pd.Index(channels, name="channel"))
+            self_data_time_cut = cut_dataframe(self.data)
+            for param in self.parameters:
+                # list-valued parameters: mean of all values of each channel (None otherwise)
+                if jagged.is_jagged(self.data[param]):
+                    channel_mean[param] = jagged.mean_by(
+                        self_data_time_cut[param], self_data_time_cut["channel"]
+                    )
+                else:
+                    channel_mean[param] = None
             self.data = concat_channel_mean(self, channel_mean)
         # otherwise, it's either an aux or geds
         else:
@@ -439,7 +433,7 @@ class AnalysisData:
             elif self.saving == "append":
                 subsys = self.get_subsys() if self.aux_info is None else self.aux_info
                 # the file does not exist, so we get the mean as usual
-                if not os.path.exists(self.plt_path + "-" + subsys + ".dat"):
+                if not results.exists(self.plt_path + "-" + subsys):
                     self_data_time_cut = cut_dataframe(self.data)
                     # create a column with the mean of the cut dataframe (cut in the time window of interest)
                     channel_mean = self_data_time_cut.groupby("channel").mean(
@@ -450,15 +444,9 @@ class AnalysisData:
 
                 # the file exist: we have to combine previous data with new data, and re-compute the mean over the first 10% of data (that now, are more than before)
                 else:
-                    # open already existing shelve file
-                    with shelve.open(self.plt_path + "-" + subsys, "r") as shelf:
-                        old_dict = dict(shelf)
-
                     if len(self.parameters) == 1:
                         param = self.parameters[0]
-                        channel_mean = get_saved_df(
-                            self, subsys, param, old_dict, self.evt_type
-                        )
+                        channel_mean = get_saved_df(self, subsys, param, self.evt_type)
                         # concatenate column with mean values
                         self.data = concat_channel_mean(self, channel_mean)
 
@@ -468,7 +456,7 @@ class AnalysisData:
                                 param.split("_var")[0] if "_var" in param else param
                             )
                             channel_mean = get_saved_df(
-                                self, subsys, parameter, old_dict, self.evt_type
+                                self, subsys, parameter, self.evt_type
                             )
                             # we need to repeat this operation for each param, otherwise only the mean of the last one survives
                             self.data = concat_channel_mean(self, channel_mean)
@@ -489,18 +477,32 @@ class AnalysisData:
         if self.variation:
             utils.logger.info("... calculating % variation from the mean")
             for param in self.parameters:
+                if jagged.is_jagged(self.data[param]):
+                    # list-valued parameter: variation of each value wrt the mean of its channel
+                    array = self.data[param].array
+                    mean = self.data[param + "_mean"].to_numpy(dtype="float64")
+                    self.data[param + "_var"] = array.with_values(
+                        (array.values / np.repeat(mean, array.lengths) - 1) * 100
+                    )
+                    continue
                 # % variation: subtract mean from value for each channel
                 self.data[param + "_var"] = (
                     self.data[param] / self.data[param + "_mean"] - 1
                 ) * 100  # %
 
+    def get_channel_info(self, column: str):
+        """Get channel map info (e.g. 'location') of the channel of the first row of data."""
+        channel = self.data.iloc[0]["channel"]
+        channel_map = self.channel_map
+        return channel_map.loc[channel_map["channel"] == channel, column].iloc[0]
+
     def is_spms(self) -> bool:
         """Return True if 'location' (=fiber) and 'position' (=top, bottom) are strings."""
         if self.data.empty:
             return False
 
-        if isinstance(self.data.iloc[0]["location"], str) and isinstance(
-            self.data.iloc[0]["position"], str
+        if isinstance(self.get_channel_info("location"), str) and isinstance(
+            self.get_channel_info("position"), str
         ):
             return True
         else:
@@ -514,32 +516,32 @@ class AnalysisData:
         """Return True if the system is the pulser channel."""
         return (
             self.is_geds()
-            and self.data.iloc[0]["location"] == 0
-            and self.data.iloc[0]["position"] == 0
+            and self.get_channel_info("location") == 0
+            and self.get_channel_info("position") == 0
         )
 
     def is_pulser01ana(self) -> bool:
         """Return True if the system is the pulser channel."""
         return (
             self.is_geds()
-            and self.data.iloc[0]["location"] == -1
-            and self.data.iloc[0]["position"] == -1
+            and self.get_channel_info("location") == -1
+            and self.get_channel_info("position") == -1
         )
 
     def is_fc_bsln(self) -> bool:
         """Return True if the system is the FC baseline channel."""
         return (
             self.is_geds()
-            and self.data.iloc[0]["location"] == -2
-            and self.data.iloc[0]["position"] == -2
+            and self.get_channel_info("location") == -2
+            and self.get_channel_info("position") == -2
         )
 
     def is_muon(self) -> bool:
         """Return True if the system is the muon channel."""
         return (
             self.is_geds()
-            and self.data.iloc[0]["location"] == -3
-            and self.data.iloc[0]["position"] == -3
+            and self.get_channel_info("location") == -3
+            and self.get_channel_info("position") == -3
         )
 
     def is_aux(self) -> bool:
@@ -567,6 +569,73 @@ class AnalysisData:
             return "geds"
 
 
+# -------------------------------------------------------------------------
+# cache of analysed data
+# -------------------------------------------------------------------------
+
+# analysis objects already built, by subsystem data and selection (see get_analysis_data and get_aux_df);
+# values also keep the subsystem data, so that its id is not reused while in cache
+ANALYSES = {}
+
+
+def get_selection_key(selection: dict) -> tuple:
+    """Get the entries of a selection (plot settings) that define the content of an AnalysisData object."""
+    key = []
+    for entry in ["parameters", "event_type", "cuts", "time_window"]:
+        value = selection.get(entry)
+        key.append(tuple(value) if isinstance(value, list) else value)
+    # saved data are used for channel mean values when appending
+    key += [selection.get("saving"), selection.get("plt_path")]
+    return tuple(key)
+
+
+def copy_analysis_data(analysis):
+    """
+    Copy an AnalysisData object, so that its data can be modified without changing the cached one.
+
+    Binned values (time_bins) are shared with the cached object: they are those of the data as analysed.
+    """
+    if not isinstance(analysis, AnalysisData):
+        return analysis
+    new_analysis = copy.copy(analysis)
+    if getattr(analysis, "data", None) is not None:
+        new_analysis.data = analysis.data.copy()
+    return new_analysis
+
+
+def get_analysis_data(
+    sub_data: pd.DataFrame,
+    selection: dict,
+    aux_info: str = None,
+    channel_map: pd.DataFrame = None,
+) -> AnalysisData:
+    """
+    Get an AnalysisData object, reusing the one already built for the same subsystem data, selection and aux info, if any.
+
+    A copy is returned, which can be modified. Use clear_analysis_cache() once subsystem data are not needed anymore.
+    channel_map: channel map info of the subsystem (see AnalysisData)
+    """
+    key = (id(sub_data), get_selection_key(selection), aux_info)
+    if key not in ANALYSES:
+        ANALYSES[key] = (
+            sub_data,
+            AnalysisData(
+                sub_data,
+                selection=selection,
+                aux_info=aux_info,
+                channel_map=channel_map,
+            ),
+        )
+    else:
+        utils.logger.debug("... reusing analysed data")
+    return copy_analysis_data(ANALYSES[key][1])
+
+
+def clear_analysis_cache():
+    """Remove all cached analysis objects (and references to subsystem data)."""
+    ANALYSES.clear()
+
+
 # -------------------------------------------------------------------------
 # helper function
 # -------------------------------------------------------------------------
@@ -600,44 +669,72 @@ def cut_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     return df.loc[df["datetime"] < thr_datetime]
 
 
-def get_saved_df(
-    self, subsys: str, param: str, old_dict: dict, evt_type: str
-) -> pd.DataFrame:
-    """Get the already saved dataframe from the already saved output shelve file, for a given parameter ```param```. In particular, it evaluates again the mean over the new 10% of data in the new larger time window."""
-    # get old dataframe (we are interested only in the column with mean values)
-    old_df = old_dict["monitoring"][evt_type][param]["df_" + subsys]
+def get_saved_df(self, subsys: str, param: str, evt_type: str) -> pd.DataFrame:
+    """
+    Get the mean value of a parameter ```param``` over the first 10% of the new larger time window, made of already saved and new data.
 
+    Saved data are read as time-bucketed summaries (see results.get_summary()):
+    only rows of the bucket containing the 10% timestamp are read, to sum values before it.
+    """
     # we need to re-calculate the mean value over the new bigger time window!
-    # we retrieve absolute values of already saved df, we use
-    old_absolute_values = old_df.copy().filter(items=["channel", "datetime", param])
-    new_absolute_values = self.data.copy().filter(items=["channel", "datetime", param])
+    # we retrieve count and sum in time buckets of already saved data (if any, e.g. not for a new parameter)
+    path = self.plt_path + "-" + subsys
+    old_summary = results.read_summary(path, evt_type, param)
+    new_summary = results.get_summary(self.data, param)
+    summary = results.combine_summaries(
+        [df for df in [old_summary, new_summary] if df is not None]
+    )
 
-    concatenated_df = pd.concat(
-        [old_absolute_values, new_absolute_values], ignore_index=True
+    # get the buckets with timestamps below 10% of data present in the selected time window
+    min_datetime = summary["first"].min()  # first timestamp
+    max_datetime = summary["last"].max()  # last timestamp
+    thr_datetime = min_datetime + (max_datetime - min_datetime) * 0.1
+    bucket_start = thr_datetime.floor(results.SUMMARY_WIDTH)
+    summary_time_cut = summary[summary["datetime"] < bucket_start]
+
+    # the bucket containing the 10% timestamp is only partially included: take its rows before the 10% timestamp
+    columns = ["channel", "datetime", param]
+    old_rows = results.read_parameter(
+        path, evt_type, param, columns=columns, start=bucket_start, end=thr_datetime
     )
-    # get the dataframe for timestamps below 10% of data present in the selected time window
-    concatenated_df_time_cut = cut_dataframe(concatenated_df)
-    # remove 'datetime' column (it was necessary just to evaluate again the first 10% of data that are necessary to evaluate the mean on the new dataset)
-    concatenated_df_time_cut = concatenated_df_time_cut.drop(columns=["datetime"])
-
-    # create a column with the mean of the cut dataframe (cut in the time window of interest)
-    channel_mean = (
-        concatenated_df_time_cut.groupby("channel")[param].mean().reset_index()
+    new_rows = self.data.loc[
+        (self.data["datetime"] >= bucket_start)
+        & (self.data["datetime"] < thr_datetime),
+        columns,
+    ]
+    rows = pd.concat(
+        [df for df in [old_rows, new_rows] if df is not None], ignore_index=True
+    )
+    summary_time_cut = pd.concat(
+        [summary_time_cut, results.get_summary(rows, param)], ignore_index=True
     )
 
-    # drop potential duplicate rows
-    channel_mean = channel_mean.drop_duplicates(subset=["channel"])
-    # set channel to index because that's how it comes out in previous cases from df.mean()
-    channel_mean = channel_mean.set_index("channel")
+    # create a column with the mean of the cut data, with channel as index (as it comes out from df.mean())
+    channel_sum = summary_time_cut.groupby("channel")[["count", "sum"]].sum()
+    channel_mean = (channel_sum["sum"] / channel_sum["count"]).to_frame(param)
 
     return channel_mean
 
 
 def get_aux_df(
-    df: pd.DataFrame, parameter: list, plot_settings: dict, aux_ch: str
+    df: pd.DataFrame,
+    parameter: list,
+    plot_settings: dict,
+    aux_ch: str,
+    channel_map: pd.DataFrame = None,
 ) -> pd.DataFrame:
-    """Get dataframes containing auxiliary (PULS01ANA) data, storing absolute/diff&ratio/mean/% variations values."""
+    """
+    Get dataframes containing auxiliary (PULS01ANA) data, storing absolute/diff&ratio/mean/% variations values.
+
+    Results are cached like in get_analysis_data(), df being the subsystem data (not modified here).
+    channel_map: channel map info of the subsystem (see AnalysisData)
+    """
     if len(parameter) == 1:
+        key = (id(df), get_selection_key(plot_settings), aux_ch)
+        if key in ANALYSES:
+            utils.logger.debug(f"... reusing {aux_ch} data")
+            return tuple(copy_analysis_data(aux) for aux in ANALYSES[key][1])
+
         param = parameter[0]
         if (
             param in utils.PARAMETER_TIERS.keys()
@@ -662,22 +759,26 @@ def get_aux_df(
         # keep one channel only
         first_ch = aux_data.iloc[0]["channel"]
         aux_data = aux_data[aux_data["channel"] == first_ch]
+        aux_channel_map = channel_map
         first_timestamp = utils.unix_timestamp_to_string(
             aux_data["datetime"].dt.to_pydatetime()[0].timestamp()
         )
         if aux_ch == "pulser01ana":
-            chmap = LegendMetadata().hardware.configuration.channelmaps.on(
-                timestamp=first_timestamp
+            chmap = metadata.get_legend_on(
+                "hardware/configuration/channelmaps", first_timestamp
             )
             # PULS01ANA channel
             if "PULS01ANA" in chmap.keys():
-                aux_data = get_aux_info(aux_data, chmap, "PULS01ANA")
+                aux_channel_map = get_aux_info(chmap, "PULS01ANA")
             # PULS (=AUX00) channel (for periods below p03)
             else:
-                aux_data = get_aux_info(aux_data, chmap, "PULS01")
+                aux_channel_map = get_aux_info(chmap, "PULS01")
+            aux_data["channel"] = aux_channel_map["channel"].iloc[0]
 
         # get channel mean and blabla
-        aux_analysis = AnalysisData(aux_data, selection=plot_settings)
+        aux_analysis = AnalysisData(
+            aux_data, selection=plot_settings, channel_map=aux_channel_map
+        )
         utils.logger.debug("... aux dataframe \n%s", aux_analysis.data)
 
         # get abs/mean/% variation for ratio values with aux channel data --> objects to save
@@ -693,7 +794,10 @@ def get_aux_df(
         )
 
         aux_ratio_analysis = AnalysisData(
-            aux_ratio_data, selection=plot_settings, aux_info="pulser01anaRatio"
+            aux_ratio_data,
+            selection=plot_settings,
+            aux_info="pulser01anaRatio",
+            channel_map=channel_map,
         )
         utils.logger.debug("... aux ratio dataframe \n%s", aux_ratio_analysis.data)
 
@@ -709,10 +813,16 @@ def get_aux_df(
             ]
         )
         aux_diff_analysis = AnalysisData(
-            aux_diff_data, selection=plot_settings, aux_info="pulser01anaDiff"
+            aux_diff_data,
+            selection=plot_settings,
+            aux_info="pulser01anaDiff",
+            channel_map=channel_map,
         )
         utils.logger.debug("... aux difference dataframe \n%s", aux_diff_analysis.data)
 
+        ANALYSES[key] = (df, (aux_analysis, aux_ratio_analysis, aux_diff_analysis))
+        return tuple(copy_analysis_data(aux) for aux in ANALYSES[key][1])
+
     if len(parameter) > 1:
         utils.logger.warning(
             "\033[93mThe aux subtraction/difference is not implemented for multi parameters! We skip it and plot the normal quantities, not corrected for the aux channel.\033[0m"
@@ -726,27 +836,41 @@ def get_aux_df(
     return aux_analysis, aux_ratio_analysis, aux_diff_analysis
 
 
-def get_aux_info(df: pd.DataFrame, chmap: dict, aux_ch: str) -> pd.DataFrame:
-    """Return a DataFrame with correct pulser AUX info."""
-    df["channel"] = LegendMetadata().channelmap().PULS01ANA.daq.rawid
-    df["HV_card"] = None
-    df["HV_channel"] = None
-    df["cc4_channel"] = None
-    df["cc4_id"] = None
-    df["daq_card"] = LegendMetadata().channelmap().PULS01ANA.daq.card.id
-    df["daq_crate"] = LegendMetadata().channelmap().PULS01ANA.daq.crate
-    df["det_type"] = None
-    df["location"] = (
+def get_aux_info(chmap: dict, aux_ch: str) -> pd.DataFrame:
+    """Return a (one-row) channel map with correct pulser AUX info."""
+    # (cached) channel map, looked up once
+    puls01ana = metadata.get_channelmap().PULS01ANA
+    location = (
         utils.SPECIAL_SYSTEMS["pulser01ana"]
         if aux_ch == "PULS01ANA"
         else utils.SPECIAL_SYSTEMS["pulser"]
     )
-    df["position"] = df["location"]
-    df["name"] = aux_ch
+    df = pd.DataFrame(
+        {
+            "channel": [puls01ana.daq.rawid],
+            "name": aux_ch,
+            "location": location,
+            "position": location,
+            "cc4_id": None,
+            "cc4_channel": None,
+            "daq_crate": puls01ana.daq.crate,
+            "daq_card": puls01ana.daq.card.id,
+            "HV_card": None,
+            "HV_channel": None,
+            "det_type": None,
+            "status": "on",
+        }
+    )
 
     return df
 
 
+def get_channel_table(df: pd.DataFrame) -> pd.DataFrame:
+    """Get channel map info (one row per channel) from the channel map columns of data, if any."""
+    columns = [col for col in utils.COLUMNS_TO_LOAD + ["status"] if col in df.columns]
+    return df[columns].drop_duplicates("channel").reset_index(drop=True)
+
+
 def concat_channel_mean(self, channel_mean) -> pd.DataFrame:
     """Add a new column containing the mean values of the inspected parameter."""
     # some means are meaningless -> drop the corresponding column
@@ -0,0 +1,137 @@
+import numpy as np
+from pandas import DataFrame, DatetimeIndex, Timedelta
+
+from . import jagged
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# TIME BINNING OF CHANNEL DATA
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Values of all channels are binned at once in time windows of a common grid, starting at the first timestamp of the data,
+# with one row per channel and bin (from the first to the last bin with entries of each channel, as DataFrame.resample()):
+#   channel, datetime (start of the bin), entries (number of rows), count, sum, m2 (sum of squared deviations from the mean),
+#   min, max (of non-NaN values)
+# Values of list-valued parameters (JaggedArray columns) are all binned with the timestamp of their row.
+# Binned values are reused by all plots of the same data (resampled values vs time, status maps): they are kept
+# with the data they belong to (e.g. AnalysisData.time_bins), not in a global cache.
+
+
+def bin_data(data: DataFrame, time_window: str, parameter: str = None) -> DataFrame:
+    """
+    Bin values of a parameter of all channels in time windows of a common grid.
+
+    data: dataframe with 'channel', 'datetime' and the parameter column
+    time_window: width of the bins, in the format of DataFrame.resample() (e.g. '10T')
+    parameter: parameter to bin (default: None, only rows are counted, e.g. for event rates)
+    """
+    if len(data) == 0:
+        return DataFrame(
+            {
+                "channel": data["channel"].to_numpy(),
+                "datetime": data["datetime"].reset_index(drop=True),
+                "entries": np.zeros(0, dtype=np.int64),
+                "count": np.zeros(0, dtype=np.int64),
+                **{column: np.zeros(0) for column in ["sum", "m2", "min", "max"]},
+            }
+        )
+
+    # timestamps as int64 nanoseconds (UTC)
+    times = data["datetime"].values.astype("datetime64[ns]").astype("int64")
+    width = Timedelta(time_window).value
+    start = times.min()
+    bins = (times - start) // width
+    n_bins = bins.max() + 1
+    channels, codes = np.unique(data["channel"].to_numpy(), return_inverse=True)
+    flat = codes * n_bins + bins
+    size = len(channels) * n_bins
+
+    entries = np.bincount(flat, minlength=size)
+    if parameter is None:
+        values = np.zeros(len(data))
+    elif jagged.is_jagged(data[parameter]):
+        # list-valued parameter: all values of a row go to the bin of the row
+        array = data[parameter].array
+        values = array.values.astype("float64")
+        flat = np.repeat(flat, array.lengths)
+    else:
+        values = data[parameter].to_numpy(dtype="float64")
+    valid = ~np.isnan(values)
+    flat_valid = flat[valid]
+    values = values[valid]
+    count = np.bincount(flat_valid, minlength=size)
+    total = np.bincount(flat_valid, weights=values, minlength=size)
+    # squared deviations from the mean of each bin (a sum of squares would cancel out for values far from 0)
+    mean = np.divide(total, count, out=np.zeros(size), where=count > 0)
+    m2 = np.bincount(
+        flat_valid, weights=(values - mean[flat_valid]) ** 2, minlength=size
+    )
+
+    # min and max of values sorted by bin
+    min_values = np.full(size, np.nan)
+    max_values = np.full(size, np.nan)
+    if len(values) > 0:
+        order = np.argsort(flat_valid, kind="stable")
+        sorted_flat = flat_valid[order]
+        sorted_values = values[order]
+        first = np.flatnonzero(np.diff(sorted_flat, prepend=-1))
+        min_values[sorted_flat[first]] = np.minimum.reduceat(sorted_values, first)
+        max_values[sorted_flat[first]] = np.maximum.reduceat(sorted_values, first)
+
+    # keep bins from the first to the last one with entries of each channel
+    has_entries = entries.reshape(len(channels), n_bins) > 0
+    first_bin = has_entries.argmax(axis=1)
+    last_bin = n_bins - 1 - has_entries[:, ::-1].argmax(axis=1)
+    bin_index = np.arange(n_bins)
+    ch_idx, bin_idx = np.nonzero(
+        (bin_index >= first_bin[:, None]) & (bin_index <= last_bin[:, None])
+    )
+    keep = ch_idx * n_bins + bin_idx
+
+    datetimes = DatetimeIndex(start + bin_idx * width).tz_localize("UTC")
+    if data["datetime"].dt.tz is None:
+        datetimes = datetimes.tz_localize(None)
+    else:
+        datetimes = datetimes.tz_convert(data["datetime"].dt.tz)
+
+    return DataFrame(
+        {
+            "channel": channels[ch_idx],
+            "datetime": datetimes,
+            "entries": entries[keep],
+            "count": count[keep],
+            "sum": total[keep],
+            "m2": m2[keep],
+            "min": min_values[keep],
+            "max": max_values[keep],
+        }
+    )
+
+
+def get_bins(
+    data: DataFrame, time_window: str, parameter: str, time_bins: dict = None
+) -> DataFrame:
+    """
+    Get binned values of a parameter (see bin_data()), binning the data only the first time.
+
+    time_bins: binned values of this data already computed, by (time window, parameter), updated here
+        (default: None, data binned every time)
+    """
+    if time_bins is None:
+        return bin_data(data, time_window, parameter)
+    key = (time_window, parameter)
+    if key not in time_bins:
+        time_bins[key] = bin_data(data, time_window, parameter)
+    return time_bins[key]
+
+
+def get_mean_std(bins: DataFrame) -> DataFrame:
+    """Add mean and standard deviation (as DataFrame.std(), NaN for less than 2 values) of binned values."""
+    bins = bins.copy()
+    count = bins["count"].where(bins["count"] > 0)
+    bins["mean"] = bins["sum"] / count
+    bins["std"] = np.sqrt(bins["m2"] / (count - 1).where(count > 1))
+    return bins
+
+
+def get_channel_bins(bins: DataFrame, channel) -> DataFrame:
+    """Get binned values of a channel, with mean and standard deviation."""
+    return get_mean_std(bins[bins["channel"] == channel]).reset_index(drop=True)
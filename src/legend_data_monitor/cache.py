@@ -0,0 +1,312 @@
+import hashlib
+import os
+import re
+import sys
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from . import utils
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# LOCAL CACHE OF LOADED LH5 COLUMNS
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# multipliers for size budgets given as strings, e.g. '50GB'
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1e3, "MB": 1e6, "GB": 1e9, "TB": 1e12}
+
+
+class ColumnCache:
+    """
+    On-disk cache of columns loaded from LH5 files, keyed by (file key, tier, channel, column).
+
+    All cached columns of a given LH5 file (i.e. file key and tier) are stored in one HDF5 file of the cache directory,
+    as '<channel>/<column>' datasets (list-valued columns as '<channel>/<column>/flattened_data' and 'cumulative_length').
+    The LH5 file mtime and size are saved as attributes of the cache file: if they don't match anymore, the cache file is dropped.
+    Cache files are touched every time they are used, and least recently used ones are evicted when the size budget is exceeded.
+
+    path [str]: cache directory, created if it does not exist
+    max_size [int or str]: size budget in bytes, or string with unit (e.g. '50GB'); None for no limit
+
+    In the config file, enable it in the dataset entry with "cache": "<path>" or "cache": {"path": "<path>", "max_size": "50GB"}.
+    """
+
+    def __init__(self, path: str, max_size=None):
+        self.path = path
+        self.max_size = get_size_in_bytes(max_size) if max_size is not None else None
+        os.makedirs(self.path, exist_ok=True)
+
+    def get_cache_file(self, lh5_file: str, key: str, tier: str) -> str:
+        """Return the name of the cache file for a given LH5 file."""
+        # different productions share keys and tiers, the hash of the original path makes them unique
+        path_hash = hashlib.sha1(os.path.abspath(lh5_file).encode()).hexdigest()[:12]
+        return os.path.join(self.path, f"{key}-{tier}-{path_hash}.h5")
+
+    def get(self, lh5_file: str, key: str, tier: str, columns: dict) -> dict:
+        """
+        Read cached columns of an LH5 file.
+
+        columns: dict {channel: list of columns}
+        Returns {channel: {column: values}} with the cached columns only; missing ones have to be loaded from the LH5 file.
+        """
+        cached = {channel: {} for channel in columns}
+        cache_file = self.get_cache_file(lh5_file, key, tier)
+        if not os.path.isfile(cache_file):
+            return cached
+
+        try:
+            source = os.stat(lh5_file)
+            with h5py.File(cache_file, "r") as f:
+                # the LH5 file changed (e.g. reprocessed) -> the cache is not valid anymore
+                if (
+                    f.attrs["source_mtime"] != source.st_mtime
+                    or f.attrs["source_size"] != source.st_size
+                ):
+                    valid = False
+                else:
+                    valid = True
+                    for channel, channel_columns in columns.items():
+                        if str(channel) not in f:
+                            continue
+                        for column in channel_columns:
+                            if column in f[str(channel)]:
+                                cached[channel][column] = read_column(
+                                    f[str(channel)][column]
+                                )
+        except (OSError, KeyError):
+            utils.logger.warning(
+                "\033[93mCorrupted cache file %s, it will be removed.\033[0m",
+                cache_file,
+            )
+            valid = False
+
+        if not valid:
+            os.remove(cache_file)
+            return {channel: {} for channel in columns}
+
+        # mark as recently used
+        os.utime(cache_file)
+        return cached
+
+    def put(self, lh5_file: str, key: str, tier: str, data: dict):
+        """
+        Save columns of an LH5 file into the cache.
+
+        data: dict {channel: {column: values}}
+        """
+        cache_file = self.get_cache_file(lh5_file, key, tier)
+        source = os.stat(lh5_file)
+        try:
+            with h5py.File(cache_file, "a") as f:
+                if (
+                    f.attrs.get("source_mtime") != source.st_mtime
+                    or f.attrs.get("source_size") != source.st_size
+                ):
+                    # new or outdated cache file: start from scratch
+                    for name in list(f.keys()):
+                        del f[name]
+                    f.attrs["source_mtime"] = source.st_mtime
+                    f.attrs["source_size"] = source.st_size
+                for channel, channel_data in data.items():
+                    group = f.require_group(str(channel))
+                    for column, values in channel_data.items():
+                        if column in group:
+                            del group[column]
+                        write_column(group, column, values)
+        except OSError:
+            # e.g. the file is being written by another process: simply don't cache
+            utils.logger.warning(
+                "\033[93mCould not write cache file %s, skipping it.\033[0m",
+                cache_file,
+            )
+
+    def evict(self):
+        """Remove least recently used cache files until the total size is within the size budget."""
+        if self.max_size is None:
+            return
+
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".h5") and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        # oldest first
+        for _, size, cache_file in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(cache_file)
+            except FileNotFoundError:
+                # already evicted by another process sharing the cache
+                pass
+            total_size -= size
+            utils.logger.debug(f"... evicted {cache_file} from cache")
+
+
+# -------------------------------------------------------------------------------
+# helper functions
+# -------------------------------------------------------------------------------
+
+
+def get_size_in_bytes(size) -> float:
+    """Convert a size given as number of bytes or string with unit (e.g. '50GB', '500 MB') to bytes."""
+    if isinstance(size, (int, float)):
+        return size
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?B?)\s*", size.upper())
+    if not match:
+        utils.logger.error(
+            "\033[91mInvalid cache size '%s'. Use something like '50GB'.\033[0m", size
+        )
+        sys.exit()
+    return float(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+
+def write_column(group: h5py.Group, column: str, values):
+    """Write a column in a cache group; list-valued columns are stored as flattened data + cumulative length."""
+    values = np.asarray(values) if not isinstance(values, np.ndarray) else values
+    if values.dtype == object:
+        lengths = np.array([len(entry) for entry in values], dtype="uint32")
+        flattened = (
+            np.concatenate([np.asarray(entry) for entry in values])
+            if len(values)
+            else np.array([])
+        )
+        vov = group.create_group(column)
+        vov.create_dataset("flattened_data", data=flattened)
+        vov.create_dataset("cumulative_length", data=np.cumsum(lengths))
+    else:
+        group.create_dataset(column, data=values)
+
+
+def read_column(node):
+    """Read a column from a cache group, as written by write_column()."""
+    if isinstance(node, h5py.Dataset):
+        return node[()]
+    flattened = node["flattened_data"][()]
+    cumulative_length = node["cumulative_length"][()]
+    return np.fromiter(
+        np.split(flattened, cumulative_length[:-1]),
+        dtype=object,
+        count=len(cumulative_length),
+    )
+
+
+def load_with_cache(dl, column_cache: ColumnCache, load=None) -> pd.DataFrame:
+    """
+    Load data with a DataLoader whose files and output were already set, using the column cache.
+
+    Only columns not yet cached are loaded (for the files missing them), then saved into the cache.
+    The output has the same format as DataLoader.load() for pandas output.
+
+    load: function loading data of a DataLoader with files and output set (default: DataLoader.load)
+    """
+    filedb = dl.filedb
+    level = dl.levels[0]
+    tiers = dl.tiers[level]
+    files = list(dl.file_list)
+    tables = filedb.config["tables"]
+    columns = filedb.config["columns"]
+
+    def get_lh5_file(file, tier):
+        return os.path.join(
+            dl.data_dir,
+            filedb.tier_dirs[tier].lstrip("/"),
+            filedb.df.loc[file, f"{tier}_file"].lstrip("/"),
+        )
+
+    # -------------------------------------------------------------------------
+    # look up what is already cached
+    # -------------------------------------------------------------------------
+    # (file, tier) -> {channel: {column: values}}
+    found = {}
+    # file -> set of columns to load for that file
+    to_load = {}
+    for file in files:
+        key = filedb.df.loc[file, filedb.sortby]
+        for tier in tiers:
+            found[(file, tier)] = column_cache.get(
+                get_lh5_file(file, tier),
+                key,
+                tier,
+                {channel: columns[tier] for channel in tables[tier]},
+            )
+            for channel in tables[tier]:
+                missing = set(columns[tier]) - set(found[(file, tier)][channel])
+                if missing:
+                    to_load.setdefault(file, set()).update(missing)
+
+    utils.logger.info(
+        f"...... {len(files) - len(to_load)}/{len(files)} files entirely found in cache"
+    )
+
+    # -------------------------------------------------------------------------
+    # load missing columns, grouping files that miss the same ones
+    # -------------------------------------------------------------------------
+    groups = {}
+    for file, missing in to_load.items():
+        groups.setdefault(tuple(sorted(missing)), []).append(file)
+
+    for missing, group_files in groups.items():
+        dl.reset()
+        # selected by index: keys alone would drop the filters of the original query (e.g. type, run)
+        dl.set_files(f"index in {[int(file) for file in group_files]}")
+        dl.set_output(fmt="pd.DataFrame", columns=list(missing))
+        loaded = load(dl) if load else dl.load()
+
+        loaded = loaded.sort_values(["file", f"{level}_table", f"{level}_idx"])
+        rows = loaded.groupby(["file", f"{level}_table"]).indices
+        for file in group_files:
+            key = filedb.df.loc[file, filedb.sortby]
+            for tier in tiers:
+                new_data = {}
+                for channel in tables[tier]:
+                    idx = rows.get((file, channel), [])
+                    for column in missing:
+                        if column not in columns[tier]:
+                            continue
+                        # if the channel or the column is not in the file, zero-length columns are cached
+                        # (no rows come out for the channel, or NaN values for the column)
+                        values = (
+                            loaded[column].to_numpy()[idx]
+                            if column in loaded.columns
+                            else np.array([])
+                        )
+                        new_data.setdefault(channel, {})[column] = values
+                        found[(file, tier)][channel][column] = values
+                column_cache.put(get_lh5_file(file, tier), key, tier, new_data)
+
+    column_cache.evict()
+
+    # -------------------------------------------------------------------------
+    # build the output DataFrame: file by file, channel by channel
+    # -------------------------------------------------------------------------
+    # channels are taken from the lowest tier, as the DataLoader does
+    output = {f"{level}_table": [], f"{level}_idx": [], "file": []}
+    output.update({column: [] for tier in tiers for column in columns[tier]})
+    for file in files:
+        for channel in tables[tiers[0]]:
+            channel_data = found[(file, tiers[0])][channel]
+            n_rows = max((len(values) for values in channel_data.values()), default=0)
+            if n_rows == 0:
+                continue
+            output[f"{level}_table"].append(np.full(n_rows, channel))
+            output[f"{level}_idx"].append(np.arange(n_rows))
+            output["file"].append(np.full(n_rows, file))
+            for tier in tiers:
+                for column in columns[tier]:
+                    values = found[(file, tier)].get(channel, {}).get(column)
+                    # channels without this tier (e.g. AUX channels in hit tier) or columns missing from the file get NaN,
+                    # as with the DataLoader
+                    if values is None or len(values) != n_rows:
+                        values = np.full(n_rows, np.nan)
+                    output[column].append(values)
+
+    return pd.DataFrame(
+        {
+            column: (np.concatenate(values) if values else np.array([]))
+            for column, values in output.items()
+        }
+    )
@@ -0,0 +1,261 @@
+import os
+import sqlite3
+
+from . import utils
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# PERSISTENT CATALOG OF PRODUCTION FILES
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Files are catalogued in a sqlite database at the path given in the dataset config ("catalog": "<path>"),
+# shared among sessions and productions; without it, an in-memory catalog is used for the session.
+
+# open catalogs, by database path (None for the in-memory one)
+CATALOGS = {}
+
+
+class DatasetCatalog:
+    """
+    Persistent index (sqlite) of the lh5 files of productions, used to resolve runs and timestamps into file keys.
+
+    Every file is stored with its tier folder, type, period, run, key, size and mtime.
+    The last event timestamp of a file is read only the first time it is needed, and then stored as well.
+    Each run folder is listed again only if its mtime changed (new or removed files); size and mtime of its
+    catalogued files are checked in any case, so that files rewritten in place are updated.
+
+    path [str]: path to the sqlite database, created if it does not exist (default: None, in-memory catalog)
+
+    In the config file, set its location in the dataset entry with "catalog": "<path>".
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        # (tier folder, type, period) already refreshed in this session
+        self.refreshed = set()
+
+        if path is None:
+            self.db = sqlite3.connect(":memory:", check_same_thread=False)
+            self.create_tables()
+            return
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # bunches of files can be loaded in a background thread (see core.prefetch)
+            self.db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self.create_tables()
+        except (OSError, sqlite3.Error):
+            utils.logger.warning(
+                "\033[93mCould not open the file catalog %s, an in-memory one will be used.\033[0m",
+                self.path,
+            )
+            self.db = sqlite3.connect(":memory:", check_same_thread=False)
+            self.create_tables()
+
+    def create_tables(self):
+        """Create catalog tables and indices if not there yet."""
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, tier_dir TEXT, type TEXT, period TEXT, run TEXT,"
+                " key TEXT, last_timestamp TEXT, size INTEGER, mtime REAL)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS files_key ON files (tier_dir, period, type, key)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS runs (tier_dir TEXT, type TEXT, period TEXT, run TEXT, mtime REAL,"
+                " PRIMARY KEY (tier_dir, type, period, run))"
+            )
+
+    def refresh(self, tier_dir: str, data_type: str, period: str):
+        """Update the catalog for the given tier folder, type and period, scanning only run folders that changed."""
+        tier_dir = os.path.abspath(tier_dir)
+        if (tier_dir, data_type, period) in self.refreshed:
+            return
+
+        period_dir = os.path.join(tier_dir, data_type, period)
+        runs = (
+            {
+                entry.name: entry.stat().st_mtime
+                for entry in os.scandir(period_dir)
+                if entry.is_dir()
+            }
+            if os.path.isdir(period_dir)
+            else {}
+        )
+        scope = (tier_dir, data_type, period)
+        known_runs = dict(
+            self.db.execute(
+                "SELECT run, mtime FROM runs WHERE tier_dir = ? AND type = ? AND period = ?",
+                scope,
+            ).fetchall()
+        )
+
+        with self.db:
+            # runs that disappeared
+            for run in set(known_runs) - set(runs):
+                for table in ["files", "runs"]:
+                    self.db.execute(
+                        f"DELETE FROM {table} WHERE tier_dir = ? AND type = ? AND period = ? AND run = ?",
+                        scope + (run,),
+                    )
+
+            for run, run_mtime in runs.items():
+                if known_runs.get(run) == run_mtime:
+                    self.check_run(tier_dir, data_type, period, run)
+                    continue
+                self.scan_run(tier_dir, data_type, period, run)
+                self.db.execute(
+                    "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?)",
+                    scope + (run, run_mtime),
+                )
+
+        self.refreshed.add((tier_dir, data_type, period))
+
+    def get_known_files(
+        self, tier_dir: str, data_type: str, period: str, run: str
+    ) -> dict:
+        """Get (size, mtime) of the catalogued files of a run, by path."""
+        return {
+            path: (size, mtime)
+            for path, size, mtime in self.db.execute(
+                "SELECT path, size, mtime FROM files WHERE tier_dir = ? AND type = ? AND period = ? AND run = ?",
+                (tier_dir, data_type, period, run),
+            )
+        }
+
+    def check_run(self, tier_dir: str, data_type: str, period: str, run: str):
+        """Update catalogued files of a run folder that were modified (e.g. rewritten in place) or removed, without listing the folder."""
+        n_modified = 0
+        for path, size_mtime in self.get_known_files(
+            tier_dir, data_type, period, run
+        ).items():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+                continue
+            if size_mtime == (stat.st_size, stat.st_mtime):
+                continue
+            # the last timestamp will be read again
+            self.db.execute(
+                "UPDATE files SET last_timestamp = NULL, size = ?, mtime = ? WHERE path = ?",
+                (stat.st_size, stat.st_mtime, path),
+            )
+            n_modified += 1
+
+        if n_modified:
+            utils.logger.debug(
+                f"... catalog: {n_modified} modified files in {tier_dir}/{data_type}/{period}/{run}"
+            )
+
+    def scan_run(self, tier_dir: str, data_type: str, period: str, run: str):
+        """Add new or modified files of a run folder to the catalog, and remove the ones not there anymore."""
+        run_dir = os.path.join(tier_dir, data_type, period, run)
+        known = self.get_known_files(tier_dir, data_type, period, run)
+        found = set()
+        n_new = 0
+        for entry in os.scandir(run_dir):
+            if not entry.name.endswith(".lh5") or not entry.is_file():
+                continue
+            found.add(entry.path)
+            stat = entry.stat()
+            if known.get(entry.path) == (stat.st_size, stat.st_mtime):
+                continue
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, NULL, ?, ?)",
+                (
+                    entry.path,
+                    tier_dir,
+                    data_type,
+                    period,
+                    run,
+                    utils.get_key(entry.name),
+                    stat.st_size,
+                    stat.st_mtime,
+                ),
+            )
+            n_new += 1
+        for path in set(known) - found:
+            self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+        utils.logger.debug(f"... catalog: {n_new} new files in {run_dir}")
+
+    def get_files(
+        self,
+        tier_dir: str,
+        data_type,
+        period: str,
+        runs: list = None,
+        start: str = None,
+        end: str = None,
+        exclude: list = None,
+    ) -> list:
+        """
+        Get (run, key, path) of files, sorted by key.
+
+        data_type: type or list of types of data (e.g. 'phy')
+        runs: list of runs (e.g. ['r010']) to select; None for all
+        start, end: select keys within start <= key <= end, format YYYYMMDDThhmmssZ
+        exclude: list of keys to skip (e.g. faulty files)
+        """
+        tier_dir = os.path.abspath(tier_dir)
+        data_types = [data_type] if isinstance(data_type, str) else list(data_type)
+        for dtype in data_types:
+            self.refresh(tier_dir, dtype, period)
+
+        query = "SELECT run, key, path FROM files WHERE tier_dir = ? AND period = ?"
+        query += " AND type IN ({})".format(",".join("?" * len(data_types)))
+        args = [tier_dir, period] + data_types
+        if runs is not None:
+            query += " AND run IN ({})".format(",".join("?" * len(runs)))
+            args += list(runs)
+        if start is not None:
+            query += " AND key >= ?"
+            args.append(start)
+        if end is not None:
+            query += " AND key <= ?"
+            args.append(end)
+        if exclude:
+            query += " AND key NOT IN ({})".format(",".join("?" * len(exclude)))
+            args += list(exclude)
+        query += " ORDER BY key, path"
+
+        return self.db.execute(query, args).fetchall()
+
+    def get_last_timestamp(self, path: str) -> str:
+        """Get the last event timestamp of a catalogued file, reading it from the file only the first time."""
+        row = self.db.execute(
+            "SELECT last_timestamp FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row and row[0]:
+            return row[0]
+
+        last_timestamp = utils.get_last_timestamp(path)
+        with self.db:
+            self.db.execute(
+                "UPDATE files SET last_timestamp = ? WHERE path = ?",
+                (last_timestamp, path),
+            )
+        return last_timestamp
+
+    def find_run(self, tier_dir: str, data_type, period: str, timestamp: str):
+        """Get the run containing a given timestamp (format YYYYMMDDThhmmssZ), or None if no file contains it."""
+        before = self.get_files(tier_dir, data_type, period, end=timestamp)
+        if not before:
+            return None
+        run, _, path = before[-1]
+        # the timestamp is within the run if a later file of the same run exists...
+        if self.get_files(tier_dir, data_type, period, runs=[run], start=timestamp):
+            return run
+        # ... or if it is before the last event of the last file of the run
+        if timestamp <= self.get_last_timestamp(path):
+            return run
+        return None
+
+
+def get_catalog(dataset: dict) -> DatasetCatalog:
+    """Get the catalog for the given 'dataset' config entry ("catalog": "<path>", in-memory if missing), opening it only once per session."""
+    path = dataset.get("catalog")
+    if path not in CATALOGS:
+        CATALOGS[path] = DatasetCatalog(path)
+    return CATALOGS[path]
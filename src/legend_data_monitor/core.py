@@ -3,8 +3,19 @@ import os
 import re
 import subprocess
 import sys
+import threading
+from queue import Queue
 
-from . import plotting, slow_control, subsystem, utils
+from . import (
+    cache,
+    plotting,
+    results,
+    save_data,
+    segments,
+    slow_control,
+    subsystem,
+    utils,
+)
 
 
 def retrieve_scdb(user_config_path: str, port: int, pswd: str):
@@ -143,6 +154,26 @@ def auto_control_plots(
     generate_plots(config, plt_path, n_files)
 
 
+def compact_results(output_path: str, var_keys: bool = False):
+    """
+    Merge segments of appended data into the result files and hdf files of all subsystems found under an output folder (see results.compact, segments.compact).
+
+    var_keys: also write % variations in '_var' keys of hdf files, for readers using pandas.read_hdf() (see save_data.write_var_keys)
+    """
+    for folder, _, files in os.walk(output_path):
+        for file in sorted(files):
+            if not file.endswith(segments.MANIFEST_SUFFIX):
+                continue
+            file_path = os.path.join(folder, file[: -len(segments.MANIFEST_SUFFIX)])
+            if file_path.endswith(results.RESULTS_SUFFIX):
+                results.compact(file_path[: -len(results.RESULTS_SUFFIX)])
+            elif file_path.endswith(".hdf"):
+                if var_keys:
+                    save_data.write_var_keys(file_path)
+                else:
+                    save_data.compact_hdf(file_path)
+
+
 def generate_plots(config: dict, plt_path: str, n_files=None):
     """Generate plots once the config file is set and once we provide the path and name in which store results. n_files specifies if we want to inspect the entire time window (if n_files is not specified), otherwise we subdivide the time window in smaller datasets, each one being composed by n_files files."""
     # no subdivision of data (useful when the inspected time window is short enough)
@@ -178,82 +209,251 @@ def generate_plots(config: dict, plt_path: str, n_files=None):
         config["dataset"].pop("end", None)
         config["dataset"].pop("runs", None)
 
-        for idx, bunch in enumerate(bunches):
-            utils.logger.debug(
-                f"\33[44mYou are inspecting bunch #{idx+1}/{len(bunches)}...\33[0m"
+        # inspect all bunches in a single session
+        stream_plots(config, plt_path, bunches)
+
+
+def make_plots(config: dict, plt_path: str, saving: str):
+    # load data of all subsystems at once
+    subsystems = load_subsystems(config)
+
+    # flag events
+    flag_subsystems(config, subsystems)
+
+    for system in config["subsystems"]:
+        # - set up log file for each system
+        add_log_file(plt_path, system)
+
+        # -------------------------------------------------------------------------
+        # make subsystem plots
+        # -------------------------------------------------------------------------
+        plotting.make_subsystem_plots(
+            subsystems[system], config["subsystems"][system], plt_path, saving
+        )
+
+        # beautification of the log file
+        clean_log_file(plt_path, system)
+
+
+def stream_plots(config: dict, plt_path: str, bunches: list):
+    """
+    Inspect bunches of file keys one after the other in a single session, each bunch flowing through load -> flag -> analyse/save stages.
+
+    Only one bunch of loaded data is kept in memory at a time; channel maps, statuses and file lists come from the caches of the session.
+    The first bunch overwrites existing outputs, the following ones are appended (writing only their own rows).
+    Pdf files are drawn once at the end, from the data of all bunches.
+    """
+    subsystems_to_plot = list(config["subsystems"].keys())
+    # plots to be drawn at the end, by subsystem
+    rendering = {system: {} for system in subsystems_to_plot}
+
+    for system in subsystems_to_plot:
+        add_log_file(plt_path, system)
+
+    # bunches are loaded in background while the previous ones are analysed
+    loaded_bunches = load_bunches(config, bunches)
+    depth, max_memory = get_prefetch_settings(config["dataset"])
+    if depth > 0:
+        loaded_bunches = prefetch(loaded_bunches, depth, max_memory)
+
+    subsystems = None
+    for idx, subsystems in enumerate(flag_bunches(config, loaded_bunches)):
+        # if it is the first dataset, just override previous content; then, append the ones coming after
+        saving = "overwrite" if idx == 0 else "append"
+        for system in subsystems_to_plot:
+            plotting.make_subsystem_plots(
+                subsystems[system],
+                config["subsystems"][system],
+                plt_path,
+                saving,
+                rendering[system],
+            )
+        # release loaded data before loading the next bunch (subsystems of the last bunch are kept for drawing)
+        for subsys in subsystems.values():
+            subsys.data = None
+
+    if subsystems is not None:
+        for system in subsystems_to_plot:
+            plotting.render_subsystem_plots(
+                subsystems[system], rendering[system], plt_path
             )
-            # if it is the first dataset, just override previous content
-            if idx == 0:
-                config["saving"] = "overwrite"
-            # if we already inspected the first dataset, append the ones coming after
-            if idx > 0:
-                config["saving"] = "append"
+    for system in subsystems_to_plot:
+        clean_log_file(plt_path, system)
 
-            # get the dataset
-            config["dataset"]["timestamps"] = bunch
-            # make the plots / load data for the dataset of interest
-            make_plots(config.copy(), plt_path, config["saving"])
 
+def load_bunches(config: dict, bunches: list):
+    """Yield subsystems with loaded data (see load_subsystems), one bunch of file keys after the other."""
+    for idx, bunch in enumerate(bunches):
+        utils.logger.debug(
+            f"\33[44mYou are inspecting bunch #{idx+1}/{len(bunches)}...\33[0m"
+        )
+        # get the dataset
+        bunch_config = config.copy()
+        bunch_config["dataset"] = dict(config["dataset"], timestamps=bunch)
+        yield load_subsystems(bunch_config)
+
+
+def get_prefetch_settings(dataset: dict) -> tuple:
+    """
+    Get the number of bunches to load in advance and the memory cap (bytes, None for no cap) from the 'prefetch' entry of the dataset.
+
+    Prefetching is disabled by default (opt-in): bunches would be read in a background thread,
+    concurrently with the writing of hdf files and the queries to the file catalog.
+    """
+    settings = dataset.get("prefetch", 0)
+    if not isinstance(settings, dict):
+        settings = {"depth": settings}
+    depth = int(settings.get("depth", 1))
+    max_memory = settings.get("max_memory")
+    if max_memory is not None:
+        max_memory = cache.get_size_in_bytes(max_memory)
+    return depth, max_memory
+
+
+def get_memory_usage(subsystems: dict) -> int:
+    """Get the memory used by loaded data of subsystems, in bytes (including the contents of object columns)."""
+    return sum(
+        int(subsys.data.memory_usage(deep=True).sum())
+        for subsys in subsystems.values()
+        if subsys.data is not None
+    )
+
+
+def prefetch(loaded_bunches, depth: int, max_memory=None):
+    """
+    Yield bunches of loaded subsystems, loading up to 'depth' of the following ones in a background thread.
+
+    max_memory: max memory (bytes) of the bunches waiting to be yielded; no other bunch is loaded while above it,
+        but at least one bunch is always loaded in advance
+    Errors (or exits) while loading are raised in the calling thread, when reaching the bunch that failed.
+    """
+    queue = Queue(maxsize=depth)
+    # memory of the bunches in the queue
+    queued = {"memory": 0}
+    memory_freed = threading.Condition()
+    stop = threading.Event()
+
+    def load():
+        try:
+            for subsystems in loaded_bunches:
+                memory = get_memory_usage(subsystems)
+                with memory_freed:
+                    # wait for the queue to go below the memory cap (or be empty)
+                    while (
+                        max_memory is not None
+                        and queued["memory"] > 0
+                        and queued["memory"] + memory > max_memory
+                        and not stop.is_set()
+                    ):
+                        memory_freed.wait(timeout=1)
+                    queued["memory"] += memory
+                if stop.is_set():
+                    return
+                queue.put((subsystems, memory, None))
+            queue.put((None, 0, None))
+        except BaseException as e:
+            queue.put((None, 0, e))
+
+    loader = threading.Thread(target=load, daemon=True)
+    loader.start()
 
-def make_plots(config: dict, plt_path: str, saving: str):
+    try:
+        while True:
+            subsystems, memory, error = queue.get()
+            if error is not None:
+                raise error
+            if subsystems is None:
+                return
+            with memory_freed:
+                queued["memory"] -= memory
+                memory_freed.notify()
+            yield subsystems
+    finally:
+        # e.g. the analysis of a bunch failed: let the loader thread finish
+        stop.set()
+        with memory_freed:
+            memory_freed.notify()
+        while loader.is_alive():
+            if not queue.empty():
+                queue.get()
+            loader.join(timeout=0.1)
+
+
+def flag_bunches(config: dict, loaded_bunches):
+    """Yield subsystems of each loaded bunch once their events are flagged (see flag_subsystems)."""
+    for subsystems in loaded_bunches:
+        flag_subsystems(config, subsystems)
+        yield subsystems
+
+
+def load_subsystems(config: dict) -> dict:
+    """Set up all subsystems needed for the plots in the config (and for flagging events) and load their data. Return them in a dictionary, by name."""
     # -------------------------------------------------------------------------
-    # flag events - PULSER
+    # set up subsystems
+    # -------------------------------------------------------------------------
+    # What subsystems do we want to plot?
+    subsystems_to_plot = list(config["subsystems"].keys())
+
+    # pulser, FC baseline and muon are always needed to flag events; put all in a dict,
+    # so that later, if pulser is also wanted to be plotted, we don't have to set it up twice
+    # the AUX channel is needed too if any plotted parameter can be compared to it (FOR ALL SYSTEMS)
+    aux_parameters = utils.get_aux_parameters(config)
+    aux_systems = ["pulser01ana"] if aux_parameters else []
+
+    subsystems = {}
+    for system in ["pulser", "FCbsln", "muon"] + aux_systems + subsystems_to_plot:
+        if system not in subsystems:
+            # Subsystem: knows its channel map & software status (on/off channels)
+            subsystems[system] = subsystem.Subsystem(system, dataset=config["dataset"])
+
+    # -------------------------------------------------------------------------
+    # load data of all subsystems at once
     # -------------------------------------------------------------------------
-    # put it in a dict, so that later, if pulser is also wanted to be plotted, we don't have to load it twice
-    subsystems = {"pulser": subsystem.Subsystem("pulser", dataset=config["dataset"])}
     # get list of all parameters needed for all requested plots, if any
-    parameters = utils.get_all_plot_parameters("pulser", config)
-    # get data for these parameters and time range given in the dataset
     # (if no parameters given to plot, baseline and wfmax will always be loaded to flag pulser events anyway)
-    subsystems["pulser"].get_data(parameters)
+    parameters = {
+        system: utils.get_all_plot_parameters(system, config) for system in subsystems
+    }
+    # all parameters needed from the AUX channel are loaded once, for all plots
+    for system in aux_systems:
+        parameters[system] += aux_parameters
+    # get data for these parameters and time range given in the dataset, reading each file only once
+    subsystem.get_shared_data(subsystems, parameters)
+
+    return subsystems
+
+
+def flag_subsystems(config: dict, subsystems: dict):
+    """Flag pulser, FC baseline and muon events in the data of the subsystems to plot, adding AUX channel data if needed, and remove unwanted timestamps."""
+    # -------------------------------------------------------------------------
+    # flag events - PULSER
+    # -------------------------------------------------------------------------
     utils.logger.debug(subsystems["pulser"].data)
 
     # -------------------------------------------------------------------------
     # flag events - FC baseline
     # -------------------------------------------------------------------------
-    subsystems["FCbsln"] = subsystem.Subsystem("FCbsln", dataset=config["dataset"])
-    parameters = utils.get_all_plot_parameters("FCbsln", config)
-    subsystems["FCbsln"].get_data(parameters)
     # the following 3 lines help to tag FC bsln events that are not in coincidence with a pulser
-    subsystems["FCbsln"].flag_pulser_events(subsystems["pulser"])
+    subsystems["FCbsln"].flag_events(pulser=subsystems["pulser"])
     subsystems["FCbsln"].flag_fcbsln_only_events()
-    subsystems["FCbsln"].data.drop(columns={"flag_pulser"})
+    # pulser flags were only needed to select FC bsln events without pulser
+    subsystems["FCbsln"].data = subsystems["FCbsln"].data.drop(columns=["flag_pulser"])
     utils.logger.debug(subsystems["FCbsln"].data)
 
     # -------------------------------------------------------------------------
     # flag events - muon
     # -------------------------------------------------------------------------
-    subsystems["muon"] = subsystem.Subsystem("muon", dataset=config["dataset"])
-    parameters = utils.get_all_plot_parameters("muon", config)
-    subsystems["muon"].get_data(parameters)
     utils.logger.debug(subsystems["muon"].data)
 
-    # -------------------------------------------------------------------------
-    # What subsystems do we want to plot?
-    subsystems_to_plot = list(config["subsystems"].keys())
-
-    for system in subsystems_to_plot:
-        # -------------------------------------------------------------------------
-        # set up subsystem
-        # -------------------------------------------------------------------------
-
-        # set up if wasn't already set up (meaning, not pulser, previously already set up)
-        if system not in subsystems:
-            # Subsystem: knows its channel map & software status (on/off channels)
-            subsystems[system] = subsystem.Subsystem(system, dataset=config["dataset"])
-            # get list of parameters needed for all requested plots, if any
-            parameters = utils.get_all_plot_parameters(system, config)
-            # get data for these parameters and dataset range
-            subsystems[system].get_data(parameters)
-
+    for system in config["subsystems"]:
         # load also aux channel if necessary (FOR ALL SYSTEMS), and add it to the already existing df
         for plot in config["subsystems"][system].keys():
             # !!! add if for sipms...
+            # (None if no parameter can be compared to the AUX channel, hence nothing will be included)
             subsystems[system].include_aux(
                 config["subsystems"][system][plot]["parameters"],
-                config["dataset"],
                 config["subsystems"][system][plot],
-                "pulser01ana",
+                subsystems.get("pulser01ana"),
             )
 
         utils.logger.debug(subsystems[system].data)
@@ -261,42 +461,34 @@ def make_plots(config: dict, plt_path: str, saving: str):
         # -------------------------------------------------------------------------
         # flag events (FOR ALL SYSTEMS)
         # -------------------------------------------------------------------------
-        # flag pulser events for future parameter data selection
-        subsystems[system].flag_pulser_events(subsystems["pulser"])
-        # flag FC baseline events (not in correspondence with any pulser event) for future parameter data selection
-        subsystems[system].flag_fcbsln_events(subsystems["FCbsln"])
-        # flag muon events for future parameter data selection
-        subsystems[system].flag_muon_events(subsystems["muon"])
+        # flag pulser, FC baseline (not in correspondence with any pulser event) and muon events for future parameter data selection
+        subsystems[system].flag_events(
+            subsystems["pulser"], subsystems["FCbsln"], subsystems["muon"]
+        )
 
         # remove timestamps for given detectors (moved here cause otherwise timestamps for flagging don't match)
-        subsystems[system].remove_timestamps(utils.REMOVE_KEYS)
+        subsystems[system].remove_timestamps(utils.get_remove_intervals())
         utils.logger.debug(subsystems[system].data)
 
-        # -------------------------------------------------------------------------
-        # make subsystem plots
-        # -------------------------------------------------------------------------
-
-        # - set up log file for each system
-        # file handler
-        file_handler = utils.logging.FileHandler(plt_path + "-" + system + ".log")
-        file_handler.setLevel(utils.logging.DEBUG)
-        # add to logger
-        utils.logger.addHandler(file_handler)
 
-        plotting.make_subsystem_plots(
-            subsystems[system], config["subsystems"][system], plt_path, saving
-        )
-
-        # -------------------------------------------------------------------------
-        # beautification of the log file
-        # -------------------------------------------------------------------------
-        # Read the log file into a string
-        with open(plt_path + "-" + system + ".log") as f:
-            log_text = f.read()
-        # Define a regular expression pattern to match escape sequences for color codes
-        pattern = re.compile(r"\033\[[0-9;]+m")
-        # Remove the color codes from the log text using the pattern
-        clean_text = pattern.sub("", log_text)
-        # Write the cleaned text to a new file
-        with open(plt_path + "-" + system + ".log", "w") as f:
-            f.write(clean_text)
+def add_log_file(plt_path: str, system: str):
+    """Set up the log file of a subsystem."""
+    # file handler
+    file_handler = utils.logging.FileHandler(plt_path + "-" + system + ".log")
+    file_handler.setLevel(utils.logging.DEBUG)
+    # add to logger
+    utils.logger.addHandler(file_handler)
+
+
+def clean_log_file(plt_path: str, system: str):
+    """Beautification of the log file of a subsystem: remove color codes."""
+    # Read the log file into a string
+    with open(plt_path + "-" + system + ".log") as f:
+        log_text = f.read()
+    # Define a regular expression pattern to match escape sequences for color codes
+    pattern = re.compile(r"\033\[[0-9;]+m")
+    # Remove the color codes from the log text using the pattern
+    clean_text = pattern.sub("", log_text)
+    # Write the cleaned text to a new file
+    with open(plt_path + "-" + system + ".log", "w") as f:
+        f.write(clean_text)
@@ -0,0 +1,252 @@
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from . import jagged, utils
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# DIRECT LH5 COLUMN READER - alternative to DataLoader.load()
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Reading processes are not forked from this (possibly multithreaded, e.g. while prefetching bunches) process,
+# which could deadlock on locks held by other threads (HDF5, logging): they are forked from a fork server
+# started once, with this module already imported ('spawn' where the fork server is not available).
+
+# multiprocessing context, created once
+MP_CONTEXT = []
+
+
+def get_mp_context():
+    """Get the multiprocessing context of reading processes ('forkserver', or 'spawn' if not available)."""
+    if not MP_CONTEXT:
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+        else:
+            context = multiprocessing.get_context("spawn")
+        MP_CONTEXT.append(context)
+    return MP_CONTEXT[0]
+
+
+def load_direct(dl, processes=None) -> pd.DataFrame:
+    """
+    Load data of the files selected in a DataLoader reading the requested columns directly with h5py, instead of DataLoader.load().
+
+    dl: DataLoader whose files and output columns were already set
+    processes: number of processes reading files in parallel (default: number of CPUs)
+
+    Rows of different tiers are aligned by position within each channel table: tables of a channel with
+    different numbers of rows in different tiers are an error.
+    Requested columns not found in any file (e.g. if no file was selected) get NaN values.
+    The output has the same format as DataLoader.load() for pandas output.
+    """
+    filedb = dl.filedb
+    level = dl.levels[0]
+    tiers = dl.tiers[level]
+    files = list(dl.file_list)
+    tables = filedb.config["tables"]
+    # only columns requested in output, grouped by tier
+    columns = {
+        tier: [col for col in filedb.config["columns"][tier] if col in dl.output_columns]
+        for tier in tiers
+    }
+
+    # -------------------------------------------------------------------------
+    # one reading task per file, listing what to read from each of its tiers
+    # -------------------------------------------------------------------------
+    tasks = []
+    for file in files:
+        task = []
+        for tier in tiers:
+            lh5_file = os.path.join(
+                dl.data_dir,
+                filedb.tier_dirs[tier].lstrip("/"),
+                filedb.df.loc[file, f"{tier}_file"].lstrip("/"),
+            )
+            task.append(
+                (
+                    lh5_file,
+                    {
+                        channel: filedb.get_table_name(tier, channel)
+                        for channel in tables[tier]
+                    },
+                    columns[tier],
+                )
+            )
+        tasks.append(task)
+
+    if processes is None:
+        processes = os.cpu_count()
+    processes = max(1, min(processes, len(tasks)))
+    utils.logger.info(f"...... reading {len(tasks)} files with {processes} processes")
+
+    if processes > 1:
+        with ProcessPoolExecutor(
+            max_workers=processes, mp_context=get_mp_context()
+        ) as executor:
+            results = list(executor.map(read_file, tasks))
+    else:
+        results = [read_file(task) for task in tasks]
+
+    # -------------------------------------------------------------------------
+    # preallocate output arrays and fill them file by file, channel by channel
+    # -------------------------------------------------------------------------
+    # channels are taken from the lowest tier, as the DataLoader does
+    # (channel, number of rows) per file
+    chunks = [
+        [
+            (channel, result[0][channel][0])
+            for channel in tables[tiers[0]]
+            if channel in result[0]
+        ]
+        for result in results
+    ]
+    n_rows = sum(n for file_chunks in chunks for _, n in file_chunks)
+
+    # rows are aligned by position: tables of the other tiers must have as many rows
+    for file, result, file_chunks in zip(files, results, chunks):
+        for channel, n in file_chunks:
+            for tier_idx, tier in enumerate(tiers[1:], start=1):
+                if channel in result[tier_idx] and result[tier_idx][channel][0] != n:
+                    utils.logger.error(
+                        "\033[91mChannel %s of file %s has %s rows in tier %s but %s in tier %s, rows cannot be aligned. Exit here.\033[0m",
+                        channel,
+                        filedb.df.loc[file, "timestamp"],
+                        result[tier_idx][channel][0],
+                        tier,
+                        n,
+                        tiers[0],
+                    )
+                    sys.exit()
+
+    # dtype of each column; channels without a given tier (e.g. AUX channels in hit tier) will get NaN
+    dtypes = {}
+    for tier_idx, tier in enumerate(tiers):
+        for column in columns[tier]:
+            found = [
+                result[tier_idx][channel][1][column]
+                for result in results
+                for channel in result[tier_idx]
+                if column in result[tier_idx][channel][1]
+            ]
+            if not found:
+                continue
+            is_list = any(isinstance(values, tuple) for values in found)
+            dtype = (
+                object
+                if is_list
+                else np.result_type(*[values.dtype for values in found])
+            )
+            has_gaps = any(
+                channel not in result[tier_idx]
+                or column not in result[tier_idx][channel][1]
+                for result, file_chunks in zip(results, chunks)
+                for channel, _ in file_chunks
+            )
+            if has_gaps and not is_list:
+                dtype = np.result_type(dtype, np.float64)
+            dtypes[(tier_idx, column)] = dtype
+
+    output = {
+        f"{level}_table": np.empty(n_rows, dtype=np.int64),
+        f"{level}_idx": np.empty(n_rows, dtype=np.int64),
+        "file": np.empty(n_rows, dtype=np.int64),
+    }
+    # list-valued columns are collected as one JaggedArray per chunk, joined at the end
+    jagged_chunks = {}
+    for (_, column), dtype in dtypes.items():
+        if dtype is object:
+            jagged_chunks[column] = []
+        else:
+            output[column] = np.empty(n_rows, dtype=dtype)
+
+    start = 0
+    for file, result, file_chunks in zip(files, results, chunks):
+        for channel, n in file_chunks:
+            stop = start + n
+            output[f"{level}_table"][start:stop] = channel
+            output[f"{level}_idx"][start:stop] = np.arange(n)
+            output["file"][start:stop] = file
+            for (tier_idx, column), dtype in dtypes.items():
+                values = result[tier_idx].get(channel, (0, {}))[1].get(column)
+                if dtype is object:
+                    # list-valued column (VectorOfVectors): flat values and offsets as in the file
+                    jagged_chunks[column].append(
+                        jagged.JaggedArray.empty(n)
+                        if values is None
+                        else jagged.JaggedArray.from_vov(*values)
+                    )
+                elif values is None:
+                    output[column][start:stop] = np.nan
+                else:
+                    output[column][start:stop] = values
+            start = stop
+
+    for column, arrays in jagged_chunks.items():
+        output[column] = jagged.JaggedArray._concat_same_type(arrays)
+
+    # columns found nowhere, e.g. no file matched the query
+    for tier in tiers:
+        for column in columns[tier]:
+            if column not in output:
+                output[column] = np.full(n_rows, np.nan)
+
+    return pd.DataFrame(output)
+
+
+def read_file(task: list) -> list:
+    """
+    Read requested columns of all channels from the tier files of one key.
+
+    task: list with one (LH5 file, {channel: table name}, columns) tuple per tier
+    Returns a list (one entry per tier) of {channel: (number of rows, {column: values})};
+    list-valued columns are returned as (flattened data, cumulative length) tuples.
+    Channels not found in a file are skipped.
+    """
+    result = []
+    for lh5_file, table_names, columns in task:
+        tier_result = {}
+        with h5py.File(lh5_file, "r") as f:
+            for channel, table_name in table_names.items():
+                if table_name not in f:
+                    continue
+                table = f[table_name]
+                # number of rows of the table, even if no column is requested
+                n_rows = get_n_rows(table)
+                values = {}
+                for column in columns:
+                    if column not in table:
+                        continue
+                    node = table[column]
+                    if isinstance(node, h5py.Dataset):
+                        values[column] = node[()]
+                    else:
+                        # VectorOfVectors
+                        values[column] = (
+                            node["flattened_data"][()],
+                            node["cumulative_length"][()],
+                        )
+                tier_result[channel] = (n_rows, values)
+        result.append(tier_result)
+
+    return result
+
+
+def get_n_rows(node) -> int:
+    """
+    Get the number of rows of an LH5 object (h5py dataset or group).
+
+    Tables (also nested ones, e.g. waveforms) are measured on their 'timestamp' column if any, on their first
+    column otherwise; VectorOfVectors on their cumulative length, encoded arrays on their encoded data.
+    Multi-dimensional datasets (ArrayOfEqualSizedArrays) have one row per entry of their first dimension.
+    """
+    if isinstance(node, h5py.Dataset):
+        return node.shape[0]
+    for key in ["cumulative_length", "encoded_data", "timestamp"]:
+        if key in node:
+            return get_n_rows(node[key])
+    return get_n_rows(node[next(iter(node.keys()))])
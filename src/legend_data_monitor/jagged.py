@@ -0,0 +1,283 @@
+import numbers
+
+import numpy as np
+from pandas import DataFrame, Series
+from pandas.api.extensions import (
+    ExtensionArray,
+    ExtensionDtype,
+    register_extension_dtype,
+)
+from pandas.api.indexers import check_array_indexer
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# JAGGED ARRAYS OF LIST-VALUED PARAMETERS
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# List-valued parameters (e.g. SiPM 'energies', 'energy_in_pe', 'trigger_pos') are kept in dataframes as JaggedArray columns,
+# with the same encoding as LH5 VectorOfVectors instead of one Python list per row:
+#   values   flat array with the values of all rows
+#   offsets  start of each row in values, plus the end of the last one (len(offsets) = number of rows + 1)
+#   mask     True for missing rows (e.g. channels without this parameter), which have no values
+# Rows are returned as views of values (numpy arrays). Per-row reductions are vectorized (event_sum, event_max, multiplicity).
+# Selection, sorting and concatenation work as for other columns; pandas reductions and groupby aggregations do not:
+# use the helpers below (mean_by, event_*), flat values (e.g. plot_styles.get_values()) or to_object().
+
+
+@register_extension_dtype
+class JaggedDtype(ExtensionDtype):
+    """Dtype of list-valued columns stored as JaggedArray."""
+
+    name = "jagged"
+    type = np.ndarray
+    na_value = np.nan
+
+    @classmethod
+    def construct_array_type(cls):
+        return JaggedArray
+
+
+class JaggedArray(ExtensionArray):
+    """
+    List-valued column stored as flat values and offsets (see top of module).
+
+    values: flat array with the values of all rows
+    offsets: start of each row in values, plus the end of the last row
+    mask: [optional] True for missing rows (default: no missing rows)
+    """
+
+    def __init__(self, values, offsets, mask=None):
+        self.values = np.asarray(values)
+        self.offsets = np.asarray(offsets, dtype="int64")
+        self.mask = (
+            np.zeros(len(self.offsets) - 1, dtype=bool)
+            if mask is None
+            else np.asarray(mask, dtype=bool)
+        )
+
+    # -------------------------------------------------------------------------
+    # construction
+    # -------------------------------------------------------------------------
+
+    @classmethod
+    def from_vov(cls, flattened_data, cumulative_length):
+        """Build from the arrays of a LH5 VectorOfVectors, without copying values."""
+        offsets = np.zeros(len(cumulative_length) + 1, dtype="int64")
+        offsets[1:] = cumulative_length
+        return cls(flattened_data, offsets)
+
+    @classmethod
+    def from_lists(cls, lists):
+        """Build from a sequence of lists or arrays; other entries (e.g. NaN, None) are missing rows."""
+        lists = list(lists)
+        mask = np.array(
+            [not isinstance(entry, (list, tuple, np.ndarray)) for entry in lists],
+            dtype=bool,
+        )
+        rows = [
+            np.array([]) if missing else np.asarray(entry)
+            for entry, missing in zip(lists, mask)
+        ]
+        lengths = np.array([len(row) for row in rows], dtype="int64")
+        offsets = np.zeros(len(rows) + 1, dtype="int64")
+        offsets[1:] = np.cumsum(lengths)
+        values = np.concatenate(rows) if rows else np.array([], dtype="float64")
+        return cls(values, offsets, mask)
+
+    @classmethod
+    def empty(cls, n_rows: int, dtype="float64"):
+        """Build n_rows empty rows (not missing)."""
+        return cls(np.array([], dtype=dtype), np.zeros(n_rows + 1, dtype="int64"))
+
+    @classmethod
+    def _from_sequence(cls, scalars, *, dtype=None, copy=False):
+        if isinstance(scalars, cls):
+            return scalars.copy() if copy else scalars
+        return cls.from_lists(scalars)
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls.from_lists(values)
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        to_concat = list(to_concat)
+        if not to_concat:
+            return cls.empty(0)
+        lengths = np.concatenate([array.lengths for array in to_concat])
+        offsets = np.zeros(len(lengths) + 1, dtype="int64")
+        offsets[1:] = np.cumsum(lengths)
+        return cls(
+            np.concatenate([array.values for array in to_concat]),
+            offsets,
+            np.concatenate([array.mask for array in to_concat]),
+        )
+
+    # -------------------------------------------------------------------------
+    # ExtensionArray interface
+    # -------------------------------------------------------------------------
+
+    @property
+    def dtype(self):
+        return JaggedDtype()
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.offsets.nbytes + self.mask.nbytes
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Number of values of each row."""
+        return np.diff(self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, item):
+        if isinstance(item, numbers.Integral):
+            item = int(item) + len(self) if item < 0 else int(item)
+            if self.mask[item]:
+                return self.dtype.na_value
+            return self.values[self.offsets[item] : self.offsets[item + 1]]
+        if isinstance(item, slice):
+            return self.take(np.arange(len(self))[item])
+        item = check_array_indexer(self, item)
+        if item.dtype == bool:
+            item = np.flatnonzero(item)
+        return self.take(item)
+
+    def __array__(self, dtype=None, copy=None):
+        rows = np.fromiter(
+            (
+                np.nan if missing else self.values[start:stop]
+                for missing, start, stop in zip(
+                    self.mask, self.offsets[:-1], self.offsets[1:]
+                )
+            ),
+            dtype=object,
+            count=len(self),
+        )
+        return rows
+
+    def __eq__(self, other):
+        other = other if isinstance(other, JaggedArray) else [other] * len(self)
+        return np.array(
+            [
+                not (missing or isinstance(row, float))
+                and np.array_equal(self[i], row)
+                for i, (missing, row) in enumerate(zip(self.mask, other))
+            ],
+            dtype=bool,
+        )
+
+    def isna(self) -> np.ndarray:
+        return self.mask.copy()
+
+    def copy(self):
+        return JaggedArray(self.values.copy(), self.offsets.copy(), self.mask.copy())
+
+    def take(self, indices, allow_fill=False, fill_value=None):
+        """Take rows at given positions, gathering their values at once; with allow_fill, -1 gives missing rows."""
+        indices = np.asarray(indices, dtype="int64")
+        if allow_fill:
+            if (indices < -1).any():
+                raise ValueError("Invalid value in 'indices': must be >= -1")
+            fill = indices == -1
+        else:
+            fill = np.zeros(len(indices), dtype=bool)
+            indices = np.where(indices < 0, indices + len(self), indices)
+        rows = indices[~fill]
+        if len(rows) and (rows.min() < 0 or rows.max() >= len(self)):
+            raise IndexError("Index out of bounds for JaggedArray")
+
+        lengths = np.zeros(len(indices), dtype="int64")
+        lengths[~fill] = self.lengths[rows]
+        starts = np.zeros(len(indices), dtype="int64")
+        starts[~fill] = self.offsets[rows]
+        mask = np.ones(len(indices), dtype=bool)
+        mask[~fill] = self.mask[rows]
+
+        offsets = np.zeros(len(indices) + 1, dtype="int64")
+        offsets[1:] = np.cumsum(lengths)
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return JaggedArray(self.values[positions], offsets, mask)
+
+    def _values_for_factorize(self):
+        rows = np.fromiter(
+            (None if missing else tuple(row) for missing, row in zip(self.mask, self)),
+            dtype=object,
+            count=len(self),
+        )
+        return rows, None
+
+    # -------------------------------------------------------------------------
+    # vectorized reductions
+    # -------------------------------------------------------------------------
+
+    def row_ids(self) -> np.ndarray:
+        """Row of each value."""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def with_values(self, values):
+        """Get a JaggedArray with the same rows, but other (flat) values, e.g. computed from these ones."""
+        return JaggedArray(values, self.offsets, self.mask)
+
+    def multiplicity(self) -> np.ndarray:
+        """Number of (non-NaN) values of each row, e.g. of SiPM hits in each event."""
+        return np.bincount(
+            self.row_ids(), weights=~np.isnan(self.values), minlength=len(self)
+        ).astype("int64")
+
+    def event_sum(self) -> np.ndarray:
+        """Sum of the (non-NaN) values of each row; NaN for missing rows."""
+        sums = np.bincount(
+            self.row_ids(), weights=np.nan_to_num(self.values), minlength=len(self)
+        )
+        sums[self.mask] = np.nan
+        return sums
+
+    def event_max(self) -> np.ndarray:
+        """Max of the (non-NaN) values of each row; NaN for rows without values."""
+        maxima = np.full(len(self), np.nan)
+        valid = ~np.isnan(self.values)
+        row_ids = self.row_ids()[valid]
+        values = self.values[valid]
+        if len(values):
+            first = np.flatnonzero(np.diff(row_ids, prepend=-1))
+            maxima[row_ids[first]] = np.maximum.reduceat(values, first)
+        return maxima
+
+
+# -------------------------------------------------------------------------------
+# dataframe helpers
+# -------------------------------------------------------------------------------
+
+
+def is_jagged(column: Series) -> bool:
+    """Check if a column is a JaggedArray."""
+    return isinstance(column.array, JaggedArray)
+
+
+def convert_lists(df: DataFrame) -> DataFrame:
+    """Convert object columns of lists/arrays (e.g. loaded with DataLoader) to JaggedArray columns."""
+    for col in df.columns:
+        if df[col].dtype != object or df[col].empty:
+            continue
+        first = df[col].dropna()
+        if not first.empty and isinstance(first.iloc[0], (list, np.ndarray)):
+            df[col] = JaggedArray.from_lists(df[col])
+    return df
+
+
+def to_object(df: DataFrame) -> DataFrame:
+    """Convert JaggedArray columns to object columns of arrays (e.g. to save them in hdf files)."""
+    columns = [col for col in df.columns if is_jagged(df[col])]
+    if not columns:
+        return df
+    return df.assign(**{col: np.asarray(df[col].array) for col in columns})
+
+
+def mean_by(column: Series, keys) -> Series:
+    """Mean of all (non-NaN) values of a JaggedArray column, grouping rows by keys (e.g. channels)."""
+    array = column.array
+    return Series(array.values.astype("float64")).groupby(
+        np.repeat(np.asarray(keys), array.lengths)
+    ).mean()
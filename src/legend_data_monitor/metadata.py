@@ -0,0 +1,165 @@
+import os
+from datetime import datetime
+
+import pandas as pd
+from legendmeta import LegendMetadata
+
+try:
+    from dbetto import TextDB
+    from dbetto.catalog import Catalog
+except ImportError:  # older pylegendmeta, before its database code moved to dbetto
+    from legendmeta import JsonDB as TextDB
+    from legendmeta.catalog import Catalog
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# PROCESS-WIDE CACHE OF METADATA, KEYED BY VALIDITY
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Queries at different timestamps for which the same metadata files are valid (e.g. all bunches of a run)
+# share the same entry, so that files are read and merged only once.
+# Returned objects are shared: do not modify them.
+# Validity files are looked up as TextDB.on() does (validity.json/yaml/yml/jsonl); folders without one
+# are queried with TextDB.on() directly.
+
+# validity file names, in the order they are looked for
+VALIDITY_FILES = ["validity.json", "validity.yaml", "validity.yml", "validity.jsonl"]
+
+# TextDB (JsonDB) objects, by path
+DBS = {}
+# validity catalogs (None for folders without validity file), by path
+VALIDITIES = {}
+# results of TextDB.on(), by (path, valid files, system)
+VALID_ENTRIES = {}
+# channel map tables, by (path, valid files)
+CHANNEL_TABLES = {}
+# merged channel maps of LegendMetadata.channelmap(), by valid files of channel maps and dataprod config
+CHANNELMAPS = {}
+# LegendMetadata instance, created once
+LEGEND_METADATA = []
+
+
+def get_db(path: str):
+    """Get the TextDB (JsonDB) of a metadata folder, created only once per path."""
+    path = os.path.abspath(path)
+    if path not in DBS:
+        DBS[path] = TextDB(path)
+    return DBS[path]
+
+
+def get_validity_file(path: str) -> str:
+    """Get the validity file of a metadata folder (first one of VALIDITY_FILES found), None if there is none."""
+    for name in VALIDITY_FILES:
+        file = os.path.join(path, name)
+        if os.path.isfile(file):
+            return file
+    return None
+
+
+def get_validity(path: str, timestamp, system: str = "all") -> tuple:
+    """
+    Get the files of a metadata folder valid at a given timestamp (str 'YYYYMMDDThhmmssZ' or datetime), its validity file being read only once.
+
+    Returns None if the folder has no validity file.
+    """
+    path = os.path.abspath(path)
+    if path not in VALIDITIES:
+        file = get_validity_file(path)
+        VALIDITIES[path] = None if file is None else Catalog.read_from(file)
+    if VALIDITIES[path] is None:
+        return None
+    files = VALIDITIES[path].valid_for(timestamp, system)
+    return tuple(files) if isinstance(files, list) else (files,)
+
+
+def get_on(path: str, timestamp, system: str = "all"):
+    """Same as TextDB(path).on(timestamp, system=system), but computed only once per set of valid files (every time for folders without validity file)."""
+    path = os.path.abspath(path)
+    valid_files = get_validity(path, timestamp, system)
+    if valid_files is None:
+        return get_db(path).on(timestamp, None, system)
+    key = (path, valid_files, system)
+    if key not in VALID_ENTRIES:
+        VALID_ENTRIES[key] = get_db(path).on(timestamp, None, system)
+    return VALID_ENTRIES[key]
+
+
+def get_channel_table(path: str, timestamp) -> pd.DataFrame:
+    """
+    Get the channel map valid at a given timestamp as a table, one row per entry (index), parsed only once per set of valid files.
+
+    Columns: system, fcid, rawid, name, string, fiber, position, cc4_id, cc4_channel, daq_crate, daq_card, HV_card, HV_channel.
+    Missing fields are None. All columns are of object type, to keep the original (python) values.
+    """
+    path = os.path.abspath(path)
+    valid_files = get_validity(path, timestamp)
+    if valid_files is None:
+        return build_channel_table(get_on(path, timestamp))
+    key = (path, valid_files)
+    if key not in CHANNEL_TABLES:
+        CHANNEL_TABLES[key] = build_channel_table(get_on(path, timestamp))
+    return CHANNEL_TABLES[key]
+
+
+def build_channel_table(channel_map: dict) -> pd.DataFrame:
+    """Parse the entries of a channel map into a table (see get_channel_table())."""
+    rows = {}
+    for entry, info in channel_map.items():
+        daq = info.get("daq", {})
+        location = info.get("location", {})
+        cc4 = info.get("electronics", {}).get("cc4", {})
+        voltage = info.get("voltage", {})
+        rows[entry] = {
+            "system": info.get("system"),
+            "fcid": daq.get("fcid"),
+            "rawid": daq.get("rawid"),
+            "name": info.get("name"),
+            "string": location.get("string"),
+            "fiber": location.get("fiber"),
+            "position": location.get("position"),
+            "cc4_id": cc4.get("id"),
+            "cc4_channel": cc4.get("channel"),
+            "daq_crate": daq.get("crate"),
+            "daq_card": daq.get("card", {}).get("id"),
+            "HV_card": voltage.get("card", {}).get("id"),
+            "HV_channel": voltage.get("channel"),
+        }
+    # build column by column, so that values are not converted (e.g. int with None to float)
+    columns = next(iter(rows.values())).keys() if rows else []
+    return pd.DataFrame(
+        {
+            col: pd.Series(
+                [row[col] for row in rows.values()], index=list(rows), dtype=object
+            )
+            for col in columns
+        }
+    )
+
+
+def get_legend_metadata() -> LegendMetadata:
+    """Get the LegendMetadata object (path from $LEGEND_METADATA), created only once."""
+    if not LEGEND_METADATA:
+        LEGEND_METADATA.append(LegendMetadata())
+    return LEGEND_METADATA[0]
+
+
+def get_legend_on(folder: str, timestamp, system: str = "all"):
+    """Query a folder of legend-metadata (e.g. 'hardware/configuration/channelmaps') at a given timestamp, see get_on()."""
+    return get_on(
+        os.path.join(str(get_legend_metadata().__path__), folder), timestamp, system
+    )
+
+
+def get_channelmap(timestamp=None):
+    """Same as LegendMetadata().channelmap(timestamp), but merged only once per set of valid files. Default timestamp is now."""
+    if timestamp is None:
+        timestamp = datetime.now()
+    lmeta_path = str(get_legend_metadata().__path__)
+    key = tuple(
+        get_validity(os.path.join(lmeta_path, folder), timestamp)
+        for folder in ["hardware/configuration/channelmaps", "dataprod/config"]
+    )
+    # not cached if a folder has no validity file
+    if None in key:
+        return get_legend_metadata().channelmap(timestamp)
+    if key not in CHANNELMAPS:
+        CHANNELMAPS[key] = get_legend_metadata().channelmap(timestamp)
+    return CHANNELMAPS[key]
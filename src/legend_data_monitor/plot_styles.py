@@ -12,9 +12,9 @@ import pandas as pd
 from matplotlib.axes import Axes
 from matplotlib.dates import DateFormatter, date2num, num2date
 from matplotlib.figure import Figure
-from pandas import DataFrame, Timedelta, concat
+from pandas import DataFrame, Timedelta
 
-from . import utils
+from . import binning, jagged, utils
 
 # -------------------------------------------------------------------------------
 # single parameter plotting functions
@@ -45,9 +45,9 @@ def plot_vs_time(
     )
 
     if plot_info["resampled"] != "only":
-        parameter_array = np.array(data_channel[plot_info["parameter"]])
+        times, parameter_array = get_values_vs_time(data_channel, plot_info["parameter"])
         ax.plot(
-            data_channel["datetime"].dt.to_pydatetime(),
+            times,
             parameter_array[:, None],
             zorder=0,
             color=all_col,
@@ -62,21 +62,27 @@ def plot_vs_time(
         # unless event rate - already resampled and counted in some time window
         if not plot_info["parameter"] == "event_rate":
             # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ 1 - resampling
-            # resample in given time window, as start pick the first timestamp in table
-            resampled = (
-                data_channel.set_index("datetime")
-                .resample(plot_info["time_window"], origin="start")
-                .mean(numeric_only=True)
+            # values binned in given time window, on a grid common to all channels (see binning.py) if binned before plotting;
+            # otherwise, as start pick the first timestamp in table
+            time_bins = plot_info.get("time_bins")
+            if time_bins is None:
+                time_bins = binning.bin_data(
+                    data_channel, plot_info["time_window"], plot_info["parameter"]
+                )
+            # (channel is the index of the data, depending on the plot structure)
+            channel = (
+                data_channel.iloc[0]["channel"]
+                if "channel" in data_channel
+                else data_channel.index[0]
             )
-            # will have datetime as index after resampling -> put back
-            resampled = resampled.reset_index()
+            resampled = binning.get_channel_bins(time_bins, channel)
             # the timestamps in the resampled table will start from the first timestamp, and go with sampling intervals
             # I want to shift them by half sampling window, so that the resampled value is plotted in the middle time window in which it was calculated
             resampled["datetime"] = (
                 resampled["datetime"] + Timedelta(plot_info["time_window"]) / 2
             )
 
-            parameter_array = np.array(resampled[plot_info["parameter"]])
+            parameter_array = np.array(resampled["mean"])
             ax.plot(
                 resampled["datetime"].dt.to_pydatetime(),
                 parameter_array[:, None],
@@ -88,24 +94,11 @@ def plot_vs_time(
 
             # evaluation of std bands, if enabled
             if plot_info["std"] is True:
-                # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ 2 - std evaluation
-                std_data = (
-                    data_channel.set_index("datetime")
-                    .resample(plot_info["time_window"], origin="start")
-                    .std(numeric_only=True)
-                )
-                std_data = std_data.reset_index()
-
-                # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ 3 - appending std to the resampled dataframe
-                std_data = std_data.rename(columns={plot_info["parameter"]: "std"})
-                new_dataframe = concat(
-                    [resampled, std_data[["std"]]], ignore_index=False, axis=1
-                )
-
+                # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ 2 - std of binned values
                 ax.fill_between(
                     resampled["datetime"].dt.to_pydatetime(),
-                    resampled[plot_info["parameter"]] - new_dataframe["std"],
-                    resampled[plot_info["parameter"]] + new_dataframe["std"],
+                    resampled["mean"] - resampled["std"],
+                    resampled["mean"] + resampled["std"],
                     alpha=0.25,
                     color=res_col,
                 )
@@ -166,7 +159,8 @@ def plot_vs_time(
 def par_vs_ch(
     data_channel: DataFrame, fig: Figure, ax: Axes, plot_info: dict, color=None
 ):
-    if len(data_channel[plot_info["parameter"]].unique()) > 1:
+    values = pd.unique(get_values(data_channel, plot_info["parameter"]))
+    if len(values) > 1:
         utils.logger.error(
             "\033[91mYou are trying to plot multiple values for a given channel.\nThis is not possible, there should be only one unique value! Try again.\033[0m"
         )
@@ -182,7 +176,7 @@ def par_vs_ch(
     position = data_channel["position"].unique()[0]
     ax.scatter(
         map_dict[str(location)][str(position)],
-        data_channel[plot_info["parameter"]].unique()[0],
+        values[0],
         color=color,
     )
 
@@ -205,18 +199,15 @@ def par_vs_ch(
 def plot_histo(
     data_channel: DataFrame, fig: Figure, ax: Axes, plot_info: dict, color=None
 ):
+    # all values of list-valued parameters
+    values = pd.Series(
+        get_values(data_channel, plot_info["parameter"]), name=plot_info["parameter"]
+    )
+
     # --- histo range
     # take full range if not specified
-    x_min = (
-        plot_info["range"][0]
-        if plot_info["range"][0] is not None
-        else data_channel[plot_info["parameter"]].min()
-    )
-    x_max = (
-        plot_info["range"][1]
-        if plot_info["range"][1] is not None
-        else data_channel[plot_info["parameter"]].max()
-    )
+    x_min = plot_info["range"][0] if plot_info["range"][0] is not None else values.min()
+    x_max = plot_info["range"][1] if plot_info["range"][1] is not None else values.max()
 
     # --- bin width
     bwidth = {"keV": 2.5}
@@ -238,7 +229,7 @@ def plot_histo(
 
         # -------------------------------------------------------------------------
         # Plot histogram
-        data_channel[plot_info["parameter"]].plot.hist(
+        values.plot.hist(
             bins=bin_edges,
             range=[x_min, x_max],
             histtype="step",
@@ -268,8 +259,7 @@ def plot_scatter(
 ):
     # plot data
     ax.scatter(
-        data_channel["datetime"].dt.to_pydatetime(),
-        data_channel[plot_info["parameter"]],
+        *get_values_vs_time(data_channel, plot_info["parameter"]),
         color=color,
         # useful if there are overlapping points (but more difficult to see light colour points...)
         # facecolors='none',
@@ -303,7 +293,27 @@ def plot_par_vs_par(
     par_x = plot_info["parameters"][0]
     par_y = plot_info["parameters"][1]
 
-    ax.scatter(data_channel[par_x], data_channel[par_y], color=color)
+    # list-valued parameters: values of the same row are paired one by one, single values repeated for each of them
+    columns = [data_channel[par_x], data_channel[par_y]]
+    lengths = [column.array.lengths for column in columns if jagged.is_jagged(column)]
+    if any((other != lengths[0]).any() for other in lengths[1:]):
+        utils.logger.error(
+            "\033[91mCannot plot %s vs %s: their rows have different numbers of values.\033[0m",
+            par_y,
+            par_x,
+        )
+        return
+    if lengths:
+        columns = [
+            (
+                column.array.values
+                if jagged.is_jagged(column)
+                else np.repeat(column.to_numpy(), lengths[0])
+            )
+            for column in columns
+        ]
+
+    ax.scatter(columns[0], columns[1], color=color)
 
     labels = []
     for param in plot_info["parameters"]:
@@ -406,34 +416,30 @@ def plot_heatmap(
         ymax = 10000
         ybin = 100
 
-    # to plot spms data, we need a new dataframe with numeric-datetime column and 'unrolled'-list values column
-    # new_df = pd.DataFrame(columns=['datetime', plot_info["parameter"]])
-    new_df = pd.DataFrame()
-    for _, row in data_channel.iterrows():
-        for value in row[plot_info["parameter"]]:
-            # remove nan entries for simplicity (and since we have the possibility here)
-            if value is np.nan:
-                continue
-            new_row = [[row["datetime"], value]]
-            new_row = pd.DataFrame(
-                new_row, columns=["datetime", plot_info["parameter"]]
-            )
-            new_df = pd.concat([new_df, new_row], ignore_index=True, axis=0)
-
-    x_values = pd.to_numeric(new_df["datetime"].dt.to_pydatetime()).values
-    y_values = new_df[plot_info["parameter"]]
+    # to plot spms data, we need numeric-datetime and 'unrolled'-list values:
+    # list values are flattened at once, each timestamp being repeated as many times as the values of its list
+    times, values = get_flat_values(data_channel, plot_info["parameter"])
+    # remove nan entries for simplicity (and since we have the possibility here)
+    not_nan = ~np.isnan(values)
+    times = times[not_nan]
+    values = values[not_nan]
 
     # plot data
 
     h, xedges, yedges = np.histogram2d(
-        x_values,
-        y_values,
+        times,
+        values,
         bins=[xbin, ybin],
         range=[
-            [data_channel.iloc[0]["datetime"], data_channel.iloc[-1]["datetime"]],
+            [
+                data_channel.iloc[0]["datetime"].value,
+                data_channel.iloc[-1]["datetime"].value,
+            ],
             [ymin, ymax],
         ],
     )
+    # time edges (ns) as numbers of days, as the time ticks below
+    xedges = date2num(pd.to_datetime(xedges.astype("int64"), utc=True))
     # cmap = copy(fig.get_cmap(col_map))
     # cmap.set_bad(cmap(0))
 
@@ -469,6 +475,52 @@ def plot_heatmap(
     return ch_dict
 
 
+def get_values(data_channel: DataFrame, parameter: str) -> np.ndarray:
+    """Get the values of a parameter as a flat array: all values of all rows for list-valued parameters (JaggedArray columns)."""
+    column = data_channel[parameter]
+    if jagged.is_jagged(column):
+        return column.array.values
+    return column.to_numpy()
+
+
+def get_values_vs_time(data_channel: DataFrame, parameter: str) -> tuple:
+    """
+    Get times (datetime) and values of a parameter to plot them vs time.
+
+    All values of list-valued parameters (JaggedArray columns) are returned, each with the time of its row.
+    """
+    if not jagged.is_jagged(data_channel[parameter]):
+        return (
+            data_channel["datetime"].dt.to_pydatetime(),
+            data_channel[parameter].to_numpy(),
+        )
+    times, values = get_flat_values(data_channel, parameter)
+    times = pd.to_datetime(times, utc=True).tz_convert(data_channel["datetime"].dt.tz)
+    return times.to_pydatetime(), values
+
+
+def get_flat_values(data_channel: DataFrame, parameter: str) -> tuple:
+    """
+    Flatten list values of a parameter (e.g. SiPM energies) into arrays of timestamps (int ns, UTC) and values.
+
+    Each timestamp is repeated as many times as the values of its list, using the lengths (offsets) of the lists;
+    JaggedArray columns already have flat values and offsets.
+    """
+    times = (
+        data_channel["datetime"].values.astype("datetime64[ns]").astype("int64")
+    )
+    if jagged.is_jagged(data_channel[parameter]):
+        array = data_channel[parameter].array
+        return np.repeat(times, array.lengths), array.values.astype("float64")
+
+    lists = data_channel[parameter].to_numpy()
+    # a single value (e.g. NaN for no list) counts as a list of one value
+    lists = [np.atleast_1d(np.asarray(entry, dtype="float64")) for entry in lists]
+    lengths = np.array([len(entry) for entry in lists], dtype="int64")
+    values = np.concatenate(lists) if lists else np.array([], dtype="float64")
+    return np.repeat(times, lengths), values
+
+
 # -------------------------------------------------------------------------------
 # mapping user keywords to plot style functions
 # -------------------------------------------------------------------------------
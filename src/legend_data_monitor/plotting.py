@@ -1,5 +1,5 @@
+import copy
 import io
-import shelve
 from typing import Union
 
 import matplotlib.patches as mpatches
@@ -11,7 +11,10 @@ from seaborn import color_palette
 
 from . import (
     analysis_data,
+    binning,
+    jagged,
     plot_styles,
+    results,
     save_data,
     string_visualization,
     subsystem,
@@ -33,13 +36,34 @@ COLORS = []
 
 
 def make_subsystem_plots(
-    subsystem: subsystem.Subsystem, plots: dict, plt_path: str, saving=None
+    subsystem: subsystem.Subsystem,
+    plots: dict,
+    plt_path: str,
+    saving=None,
+    rendering: dict = None,
 ):
-    pdf = PdfPages(plt_path + "-" + subsystem.type + ".pdf")
-    out_dict = {}
-    aux_out_dict = {}
-    aux_ratio_out_dict = {}
-    aux_diff_out_dict = {}
+    """
+    Analyse, plot and save data of a subsystem for all the requested plots.
+
+    rendering: if given, plots are not drawn but recorded in this dictionary (by plot title), to be drawn later
+        with render_subsystem_plots(); used when inspecting bunches of data in a single session
+    """
+    pdf = (
+        PdfPages(plt_path + "-" + subsystem.type + ".pdf") if rendering is None else None
+    )
+
+    # start from scratch, removing results saved by previous runs
+    if saving == "overwrite":
+        for name in [
+            subsystem.type,
+            "pulser01ana",
+            "pulser01anaRatio",
+            "pulser01anaDiff",
+        ]:
+            results.remove(plt_path + "-" + name)
+
+    # hdf outputs are kept open for all plots, and closed at the end
+    writer = save_data.HDFWriter(subsystem.output)
 
     for plot_title in plots:
         utils.logger.info(
@@ -116,8 +140,9 @@ def make_subsystem_plots(
         # - get channel mean
         # - calculate variation from mean, if asked
         # note: subsystem.data contains: absolute value of a param, the respective value for aux channel (with ratio and diff already computed)
-        data_analysis = analysis_data.AnalysisData(
-            subsystem.data, selection=plot_settings
+        # (analysed data are reused among plots with the same parameters, event type, cuts and time window)
+        data_analysis = analysis_data.get_analysis_data(
+            subsystem.data, plot_settings, channel_map=subsystem.channel_map
         )
         # check if the dataframe is empty; if so, skip this parameter
         if utils.check_empty_df(data_analysis):
@@ -132,7 +157,11 @@ def make_subsystem_plots(
         # this is ok for geds, but for spms? maybe another function will be necessary for this????
         # note: this will not do anything in case the parameter is from hit tier
         aux_analysis, aux_ratio_analysis, aux_diff_analysis = analysis_data.get_aux_df(
-            subsystem.data.copy(), params, plot_settings, "pulser01ana"
+            subsystem.data,
+            params,
+            plot_settings,
+            "pulser01ana",
+            subsystem.channel_map,
         )
 
         # -------------------------------------------------------------------------
@@ -148,17 +177,21 @@ def make_subsystem_plots(
                 and plot_settings["AUX_ratio"] is True
             ):
                 data_to_plot = aux_ratio_analysis
+                data_source = "pulser01anaRatio"
             if "AUX_diff" in plot_settings.keys() and plot_settings["AUX_diff"] is True:
                 data_to_plot = aux_diff_analysis
+                data_source = "pulser01anaDiff"
             if (
                 ("AUX_ratio" not in plot_settings and "AUX_diff" not in plot_settings)
                 or (plot_settings.get("AUX_ratio") is False)
                 or (plot_settings.get("AUX_diff") is False)
             ):
                 data_to_plot = data_analysis
+                data_source = subsystem.type
         # if empty, ...
         else:
             data_to_plot = data_analysis
+            data_source = subsystem.type
 
         # -------------------------------------------------------------------------
         # set up plot info
@@ -175,11 +208,15 @@ def make_subsystem_plots(
             if "plot_structure" in plot_settings
             else None
         )
+        # channel map info of the plotted channels
+        channel_info = subsystem.channel_map[
+            subsystem.channel_map["channel"].isin(data_to_plot.data["channel"])
+        ]
 
         if plot_structure == "per cc4":
             if (
-                data_to_plot.data.iloc[0]["cc4_id"] is None
-                or data_to_plot.data.iloc[0]["cc4_channel"] is None
+                channel_info.iloc[0]["cc4_id"] is None
+                or channel_info.iloc[0]["cc4_channel"] is None
             ):
                 if subsystem.type in ["spms", "pulser", "pulser01ana", "bsln"]:
                     utils.logger.error(
@@ -194,11 +231,11 @@ def make_subsystem_plots(
                     exit()
             # ...if cc4 are present, group by them
             max_ch_per_string = (
-                data_to_plot.data.groupby("cc4_id")["cc4_channel"].nunique().max()
+                channel_info.groupby("cc4_id")["cc4_channel"].nunique().max()
             )
         else:
             max_ch_per_string = (
-                data_to_plot.data.groupby("location")["position"].nunique().max()
+                channel_info.groupby("location")["position"].nunique().max()
             )
         global COLORS
         COLORS = color_palette("hls", max_ch_per_string).as_hex()
@@ -307,13 +344,32 @@ def make_subsystem_plots(
         # call chosen plot structure + plotting
         # -------------------------------------------------------------------------
 
-        if "exposure" in plot_info["parameters"]:
-            string_visualization.exposure_plot(
-                subsystem, data_to_plot.data, plot_info, pdf
-            )
+        if rendering is not None:
+            # keep what is needed to draw it later (inputs of the plotting functions may be modified while saving)
+            rendering[plot_title] = {
+                "plot_structure": plot_structure,
+                "plot_info": copy.deepcopy(plot_info),
+                "colors": COLORS,
+                "params": params,
+                "event_type": plot_settings["event_type"],
+                "status": plot_settings.get("status", False),
+                "saving": saving,
+                # where the data to plot is saved, and data of this bunch in case it cannot be retrieved from there
+                "source": data_source,
+                "data": data_to_plot.data,
+                "status_data": data_analysis.data,
+                "time_bins": data_to_plot.time_bins,
+                "status_time_bins": data_analysis.time_bins,
+            }
         else:
-            utils.logger.debug("Plot structure: %s", plot_settings["plot_structure"])
-            plot_structure(data_to_plot.data, plot_info, pdf)
+            plot_data(
+                subsystem,
+                data_to_plot.data,
+                plot_info,
+                plot_structure,
+                pdf,
+                data_to_plot.time_bins,
+            )
 
         # For some reason, after some plotting functions the index is set to "channel".
         # We need to set it back otherwise string_visualization.py gets crazy and everything crashes.
@@ -324,12 +380,12 @@ def make_subsystem_plots(
         # -------------------------------------------------------------------------
         # here we are not checking if we are plotting one or more than one parameter
         # the output dataframe and plot_info objects are merged for more than one parameters
-        # this will be split at a later stage, when building the output dictionary through utils.build_out_dict(...)
+        # this will be split at a later stage, when saving results through save_data.save_results(...)
 
-        # --- save shelf
-        # normal geds values (??? do we want the rescaled ones to be saved as shelf?)
+        # --- result store
+        # normal geds values (??? do we want the rescaled ones to be saved too?)
         par_dict_content = save_data.save_df_and_info(data_analysis.data, plot_info)
-        # aux values as shelf (necessary to get the right mean) - if not empty
+        # aux values (necessary to get the right mean) - if not empty
         if not utils.check_empty_df(aux_analysis):
             aux_plot_info = plot_info.copy()
             aux_plot_info["subsystem"] = "pulser01ana"
@@ -358,40 +414,30 @@ def make_subsystem_plots(
             aux_ratio_analysis,
             aux_diff_analysis,
             plot_info,
+            writer,
         )
 
         # -------------------------------------------------------------------------
         # call status plot
         # -------------------------------------------------------------------------
 
-        if "status" in plot_settings and plot_settings["status"]:
-            if subsystem.type in ["pulser", "pulser01ana", "FCbsln", "muon"]:
-                utils.logger.debug(
-                    f"Thresholds are not enabled for {subsystem.type}! Use you own eyes to do checks there"
-                )
-            else:
-                # take care of one parameter and multiple parameters cases
-                for param in params:
-                    if len(params) == 1:
-                        _ = string_visualization.status_plot(
-                            subsystem, data_analysis.data, plot_info, pdf
-                        )
-                    if len(params) > 1:
-                        # retrieved the necessary info for the specific parameter under study (just in the multi-parameters case)
-                        plot_info_param = save_data.get_param_info(param, plot_info)
-                        _ = string_visualization.status_plot(
-                            subsystem, data_analysis.data, plot_info_param, pdf
-                        )
+        if rendering is None and "status" in plot_settings and plot_settings["status"]:
+            plot_status(
+                subsystem,
+                data_analysis.data,
+                plot_info,
+                params,
+                pdf,
+                data_analysis.time_bins,
+            )
 
         # -------------------------------------------------------------------------
         # save results
         # -------------------------------------------------------------------------
 
-        # building a dictionary with dataframe/plot_info to be later stored in a shelve object
+        # storing dataframe/plot_info in the result store, one parameter at a time
         if saving is not None:
-            out_dict = save_data.build_out_dict(
-                plot_settings, par_dict_content, out_dict
-            )
+            save_data.save_results(plot_settings, par_dict_content)
 
             # check if the parameter is a hit or special parameter (still need to include MORE PARAMS case)
             params = params[0]
@@ -400,37 +446,79 @@ def make_subsystem_plots(
                 and utils.PARAMETER_TIERS[params] != "hit"
             ) and params not in utils.SPECIAL_PARAMETERS:
                 # aux data
-                aux_out_dict = save_data.build_out_dict(
-                    plot_settings, aux_par_dict_content, aux_out_dict
-                )
+                save_data.save_results(plot_settings, aux_par_dict_content)
                 # subsystem data / aux data
-                aux_ratio_out_dict = save_data.build_out_dict(
-                    plot_settings, aux_ratio_par_dict_content, aux_ratio_out_dict
-                )
+                save_data.save_results(plot_settings, aux_ratio_par_dict_content)
                 # subsystem data - aux data
-                aux_diff_out_dict = save_data.build_out_dict(
-                    plot_settings, aux_diff_par_dict_content, aux_diff_out_dict
-                )
+                save_data.save_results(plot_settings, aux_diff_par_dict_content)
+
+    writer.close()
+    analysis_data.clear_analysis_cache()
+
+    if rendering is None:
+        # save in pdf object
+        pdf.close()
+
+        utils.logger.info(
+            f"All plots saved in: \33[4m{plt_path}-{subsystem.type}.pdf\33[0m"
+        )
 
-    # save in shelve object, overwriting the already existing file with new content (either completely new or new bunches)
-    if saving is not None:
-        out_file = shelve.open(plt_path + f"-{subsystem.type}")
-        out_file["monitoring"] = out_dict
-        out_file.close()
 
-        aux_out_file = shelve.open(plt_path + "-pulser01ana")
-        aux_out_file["monitoring"] = aux_out_dict
-        aux_out_file.close()
+def render_subsystem_plots(
+    subsystem: subsystem.Subsystem, rendering: dict, plt_path: str
+):
+    """
+    Draw the plots recorded by make_subsystem_plots() over several bunches of data, once all of them were inspected.
 
-        aux_ratio_out_file = shelve.open(plt_path + "-pulser01anaRatio")
-        aux_ratio_out_file["monitoring"] = aux_ratio_out_dict
-        aux_ratio_out_file.close()
+    One-parameter plots are drawn from the data saved in the result store (i.e. over all inspected bunches, with final mean values);
+    other plots (e.g. 'par vs par', exposure) show the data of the last bunch.
+    """
+    global COLORS
+    pdf = PdfPages(plt_path + "-" + subsystem.type + ".pdf")
 
-        aux_diff_out_file = shelve.open(plt_path + "-pulser01anaDiff")
-        aux_diff_out_file["monitoring"] = aux_diff_out_dict
-        aux_diff_out_file.close()
+    for plot_title, plot in rendering.items():
+        utils.logger.info(f"\33[95m~~~ R E N D E R I N G : {plot_title}\33[0m")
+        data = plot["data"]
+        status_data = plot["status_data"]
+        time_bins = plot["time_bins"]
+        status_time_bins = plot["status_time_bins"]
+        if (
+            plot["saving"] is not None
+            and len(plot["params"]) == 1
+            and "exposure" not in plot["params"]
+        ):
+            param = plot["params"][0]
+            saved_data = get_saved_data(
+                subsystem, plt_path, plot["source"], plot["event_type"], param
+            )
+            saved_status_data = (
+                saved_data
+                if plot["source"] == subsystem.type
+                else get_saved_data(
+                    subsystem, plt_path, subsystem.type, plot["event_type"], param
+                )
+            )
+            if saved_data is not None and saved_status_data is not None:
+                data = saved_data
+                status_data = saved_status_data
+                # saved data binned once for plot and status map, if the same
+                time_bins = {}
+                status_time_bins = time_bins if status_data is data else {}
+
+        COLORS = plot["colors"]
+        plot_data(
+            subsystem, data, plot["plot_info"], plot["plot_structure"], pdf, time_bins
+        )
+        if plot["status"]:
+            plot_status(
+                subsystem,
+                status_data,
+                plot["plot_info"],
+                plot["params"],
+                pdf,
+                status_time_bins,
+            )
 
-    # save in pdf object
     pdf.close()
 
     utils.logger.info(
@@ -438,6 +526,92 @@ def make_subsystem_plots(
     )
 
 
+def plot_data(
+    subsystem: subsystem.Subsystem,
+    data: DataFrame,
+    plot_info: dict,
+    plot_structure,
+    pdf: PdfPages,
+    time_bins: dict = None,
+):
+    """
+    Call the chosen plot structure function (or the exposure plot) on the data to plot.
+
+    Channel map info of the subsystem are joined to data here, only for plotting (see utils.add_channel_info()).
+    time_bins: binned values of the data, reused and updated (see binning.get_bins())
+    """
+    if "exposure" in plot_info["parameters"]:
+        string_visualization.exposure_plot(
+            subsystem,
+            utils.add_channel_info(data, subsystem.channel_map),
+            plot_info,
+            pdf,
+        )
+    else:
+        utils.logger.debug("Plot structure: %s", plot_structure.__name__)
+        # values vs time are resampled from values of all channels binned at once (see binning.py)
+        if (
+            plot_info["plot_style"] == "vs time"
+            and plot_info["resampled"] != "no"
+            and plot_info.get("parameter", "event_rate") != "event_rate"
+        ):
+            plot_info["time_bins"] = binning.get_bins(
+                data, plot_info["time_window"], plot_info["parameter"], time_bins
+            )
+        plot_structure(
+            utils.add_channel_info(data, subsystem.channel_map), plot_info, pdf
+        )
+        # not to be saved with other plotting info
+        plot_info.pop("time_bins", None)
+
+
+def plot_status(
+    subsystem: subsystem.Subsystem,
+    data: DataFrame,
+    plot_info: dict,
+    params: list,
+    pdf: PdfPages,
+    time_bins: dict = None,
+):
+    """Call the status plot for each plotted parameter (time_bins: binned values of the data, see plot_data())."""
+    if subsystem.type in ["pulser", "pulser01ana", "FCbsln", "muon"]:
+        utils.logger.debug(
+            f"Thresholds are not enabled for {subsystem.type}! Use you own eyes to do checks there"
+        )
+        return
+
+    # take care of one parameter and multiple parameters cases
+    for param in params:
+        if len(params) == 1:
+            _ = string_visualization.status_plot(
+                subsystem, data, plot_info, pdf, time_bins
+            )
+        if len(params) > 1:
+            # retrieved the necessary info for the specific parameter under study (just in the multi-parameters case)
+            plot_info_param = save_data.get_param_info(param, plot_info)
+            _ = string_visualization.status_plot(
+                subsystem, data, plot_info_param, pdf, time_bins
+            )
+
+
+def get_saved_data(
+    subsystem: subsystem.Subsystem,
+    plt_path: str,
+    source: str,
+    event_type: str,
+    param: str,
+):
+    """
+    Get the data of a parameter saved in the result store of 'source' (subsystem or aux data name); None if not saved.
+
+    Channel map info are not saved: they are joined when plotting, as for analysed data.
+    """
+    data = results.read_parameter(plt_path + "-" + source, event_type, param)
+    if data is None:
+        return None
+    return jagged.convert_lists(data)
+
+
 # -------------------------------------------------------------------------------
 # different plot structure functions, defining figures and subplot layouts
 # -------------------------------------------------------------------------------
@@ -577,9 +751,9 @@ def plot_per_cc4(data_analysis: DataFrame, plot_info: dict, pdf: PdfPages):
     # -------------------------------------------------------------------------------
     # create label of format hardcoded for geds sXX-pX-chXXX-name-CC4channel
     # -------------------------------------------------------------------------------
-    labels = data_analysis.groupby("channel").first()[
+    labels = data_analysis.groupby("channel")[
         ["name", "position", "location", "cc4_channel", "cc4_id"]
-    ]
+    ].first()
     labels["channel"] = labels.index
     labels["label"] = labels[["location", "position", "name", "cc4_channel"]].apply(
         lambda x: f"s{x[0]}-p{x[1]}-{x[2]}-cc4 ch.{x[3]}", axis=1
@@ -673,7 +847,7 @@ def plot_per_string(data_analysis: DataFrame, plot_info: dict, pdf: PdfPages):
     # create label of format hardcoded for geds pX-chXXX-name
     # -------------------------------------------------------------------------------
 
-    labels = data_analysis.groupby("channel").first()[["name", "position"]]
+    labels = data_analysis.groupby("channel")[["name", "position"]].first()
     labels["channel"] = labels.index
     labels["label"] = labels[["position", "channel", "name"]].apply(
         lambda x: f"p{x[0]}-ch{str(x[1]).zfill(3)}-{x[2]}", axis=1
@@ -771,7 +945,7 @@ def plot_array(data_analysis: DataFrame, plot_info: dict, pdf: PdfPages):
     # -------------------------------------------------------------------------------
     # create label of format hardcoded for geds sX-pX-chXXX-name
     # -------------------------------------------------------------------------------
-    labels = data_analysis.groupby("channel").first()[["name", "location", "position"]]
+    labels = data_analysis.groupby("channel")[["name", "location", "position"]].first()
     labels["channel"] = labels.index
     labels["label"] = labels[["location", "position", "channel", "name"]].apply(
         lambda x: f"p{x[1]}-ch{str(x[2])}-{x[3]}", axis=1
@@ -817,7 +991,7 @@ def plot_array(data_analysis: DataFrame, plot_info: dict, pdf: PdfPages):
             channels.append(map_dict[str(location)][str(position)])
             if len(plot_info["parameters"]) == 1:
                 values_per_string.append(
-                    data_channel[plot_info["parameter"]].unique()[0]
+                    plot_styles.get_values(data_channel, plot_info["parameter"])[0]
                 )
                 channels_per_string.append(map_dict[str(location)][str(position)])
 
@@ -926,9 +1100,9 @@ def plot_per_barrel_and_position(
     # create label of format hardcoded for geds pX-chXXX-name
     # -------------------------------------------------------------------------------
 
-    labels = data_analysis.groupby("channel").first()[
+    labels = data_analysis.groupby("channel")[
         ["name", "position", "location", "fiber"]
-    ]
+    ].first()
     labels["channel"] = labels.index
     labels["label"] = labels[
         ["position", "location", "fiber", "channel", "name"]
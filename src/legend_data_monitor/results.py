@@ -0,0 +1,387 @@
+import glob
+import os
+
+import numpy as np
+from pandas import DataFrame, HDFStore, Series, Timestamp, concat
+
+from . import jagged, segments
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# RESULT STORE OF MONITORED PARAMETERS
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# One hdf file per subsystem (or aux data), '<experiment>-<period>-<time_selection>-<type>-<subsystem>-monitoring.h5',
+# with one group per event type and parameter:
+#   /<event_type>/<parameter>/data   rows of the parameter (table format, 'channel' and 'datetime' are indexed)
+#   /<event_type>/<parameter>/mean   mean value of each channel
+#   /<event_type>/<parameter>/summary   count and sum of values of each channel in time buckets (numeric parameters only)
+# Plotting info are saved as attribute 'plot_info' of the data node.
+# Mean values and % variations are not stored per row: they are added when reading, as '<parameter>_mean' and '<parameter>_var'.
+#
+# Appended data are not written in the result file, but in new segment files '<...>-monitoring-<number>.h5' (same structure),
+# which are never modified afterwards and are registered in the manifest '<...>-monitoring.h5.json' once complete
+# (see the segments module). Readers merge the result file and the registered segments; compact() merges segments
+# into the result file, automatically once MAX_SEGMENTS segments are registered.
+
+# suffix of result files, after '<experiment>-<period>-<time_selection>-<type>-<subsystem>'
+RESULTS_SUFFIX = "-monitoring.h5"
+# width of the time buckets of summaries
+SUMMARY_WIDTH = "1min"
+# number of registered segments triggering a compaction when appending
+MAX_SEGMENTS = 32
+
+
+def get_results_file(path: str) -> str:
+    """Get the result file of a subsystem, given its output path '<plt_path>-<subsystem>'."""
+    return path + RESULTS_SUFFIX
+
+
+def get_key(event_type: str, parameter: str) -> str:
+    """Get the group of a parameter in a result file."""
+    return f"/{event_type}/{parameter}"
+
+
+def exists(path: str, event_type: str = None, parameter: str = None) -> bool:
+    """Check if results of a subsystem exist, or if they contain a given event type and parameter."""
+    return len(get_files(path, event_type, parameter)) > 0
+
+
+def remove(path: str):
+    """Remove the result file of a subsystem, its segments and manifest, if present."""
+    results_file = get_results_file(path)
+    files = [results_file, segments.get_manifest_file(results_file)] + glob.glob(
+        glob.escape(path) + "-monitoring-*.h5*"
+    )
+    files = [file for file in files if os.path.exists(file)]
+    if not files:
+        return
+    with segments.lock_manifest(results_file):
+        for file in files:
+            os.remove(file)
+
+
+def get_parameters(path: str, files: list = None) -> dict:
+    """Get saved parameters of a subsystem, as {event type: [parameters]} (files: files to look at, default: all, see get_files())."""
+    parameters = {}
+    for file in get_files(path) if files is None else files:
+        with HDFStore(file, mode="r") as store:
+            for key in store.keys():
+                _, event_type, parameter, node = key.split("/")
+                if node == "data" and parameter not in parameters.get(event_type, []):
+                    parameters.setdefault(event_type, []).append(parameter)
+    return parameters
+
+
+# -------------------------------------------------------------------------------
+# segments
+# -------------------------------------------------------------------------------
+
+
+def get_files(path: str, event_type: str = None, parameter: str = None) -> list:
+    """
+    Get files with results of a subsystem, oldest first: the result file and the segments not yet merged in it.
+
+    If event_type and parameter are given, only files containing this parameter are returned.
+    """
+    files = segments.get_files(get_results_file(path))
+    if event_type is None or parameter is None:
+        return files
+    return with_parameter(files, event_type, parameter)
+
+
+def with_parameter(files: list, event_type: str, parameter: str) -> list:
+    """Select the files containing data of a given event type and parameter."""
+    key = get_key(event_type, parameter) + "/data"
+    selected = []
+    for file in files:
+        with HDFStore(file, mode="r") as store:
+            if key in store:
+                selected.append(file)
+    return selected
+
+
+# -------------------------------------------------------------------------------
+# writing
+# -------------------------------------------------------------------------------
+
+
+def write_parameter(
+    path: str, event_type: str, parameter: str, df: DataFrame, plot_info: dict
+):
+    """
+    Save data of a parameter in the result file, replacing what was already saved there for it.
+
+    df: dataframe with 'channel', 'datetime', the parameter column and its '_mean' (and '_var') columns, plus other columns to keep
+    """
+    write_file(get_results_file(path), event_type, parameter, df, plot_info)
+
+
+def append_parameter(
+    path: str, event_type: str, parameter: str, df: DataFrame, plot_info: dict
+):
+    """
+    Append new data of a parameter to what was already saved for it (see write_parameter() for the format of df).
+
+    Data are written in a new segment (see the segments module), visible to readers once complete.
+    Mean values of channels present in the new data replace the saved ones.
+    Segments are merged into the result file once there are MAX_SEGMENTS of them (see compact()).
+    """
+    results_file = get_results_file(path)
+    # a segment left incomplete (e.g. by a crash) is never registered, nor read
+    write_file(results_file + ".tmp", event_type, parameter, df, plot_info)
+    if segments.register(results_file, results_file + ".tmp") >= MAX_SEGMENTS:
+        compact(path)
+
+
+def write_file(
+    file: str,
+    event_type: str,
+    parameter: str,
+    df: DataFrame,
+    plot_info: dict,
+):
+    """Save data of a parameter in a given file (result file or segment), replacing what was already saved there for it."""
+    # list-valued columns are saved as arrays of each row (see jagged.to_object())
+    df_data, channel_mean = split_mean(jagged.to_object(df), parameter)
+    with HDFStore(file, mode="a") as store:
+        key = get_key(event_type, parameter)
+        put_data(store, key + "/data", df_data)
+        store.put(key + "/mean", channel_mean)
+        store.get_storer(key + "/data").attrs.plot_info = plot_info
+        summary = get_summary(df_data, parameter)
+        if summary is not None:
+            store.put(key + "/summary", summary, format="table")
+        elif key + "/summary" in store:
+            store.remove(key + "/summary")
+
+
+def split_mean(df: DataFrame, parameter: str) -> tuple:
+    """Split a dataframe into rows without '_mean'/'_var' columns, and the mean value of each channel (Series indexed by channel)."""
+    mean_col = parameter + "_mean"
+    df_data = df.drop(
+        columns=[col for col in [mean_col, parameter + "_var"] if col in df.columns]
+    ).reset_index(drop=True)
+    if mean_col in df.columns:
+        channel_mean = df.groupby("channel", sort=True)[mean_col].first()
+    else:
+        channel_mean = Series(dtype="float64", index=df["channel"].unique())
+    channel_mean.index.name = "channel"
+    channel_mean.name = mean_col
+    return df_data, channel_mean
+
+
+def put_data(store: HDFStore, key: str, df_data: DataFrame):
+    """Write rows of a parameter, in table format if possible (fixed format otherwise, e.g. for list-valued columns)."""
+    if key in store:
+        store.remove(key)
+    try:
+        store.put(
+            key,
+            df_data,
+            format="table",
+            data_columns=[col for col in ["channel", "datetime"] if col in df_data],
+        )
+    except (ValueError, TypeError):
+        if key in store:
+            store.remove(key)
+        store.put(key, df_data)
+
+
+def compact(path: str):
+    """
+    Merge the segments of a subsystem into its result file, which is then replaced at once (see segments.compact()).
+
+    Can run while new data are appended; nothing is done if another compaction of the same subsystem is running.
+    """
+    segments.compact(
+        get_results_file(path),
+        lambda files, new_file: write_merged(path, files, new_file),
+    )
+
+
+def write_merged(path: str, files: list, new_file: str):
+    """Write all parameters saved in the given result file and segments of a subsystem (oldest first) in a new file, rows sorted by channel and datetime."""
+    for event_type, parameters in get_parameters(path, files).items():
+        for parameter in parameters:
+            write_file(
+                new_file,
+                event_type,
+                parameter,
+                read_parameter(path, event_type, parameter, files=files),
+                read_plot_info(path, event_type, parameter, files=files),
+            )
+
+
+# -------------------------------------------------------------------------------
+# reading
+# -------------------------------------------------------------------------------
+
+
+def read_parameter(
+    path: str,
+    event_type: str,
+    parameter: str,
+    channels: list = None,
+    columns: list = None,
+    start=None,
+    end=None,
+    files: list = None,
+):
+    """
+    Read saved data of a parameter, with '<parameter>_mean' and '<parameter>_var' columns, sorted by channel and datetime.
+
+    channels: list of channels to read (default: all)
+    columns: list of columns to read (default: all)
+    start, end: time range [start, end) to read, as datetime, pandas Timestamp or string 'YYYY-MM-DD hh:mm:ss' (UTC if no timezone is given)
+    files: files to read, oldest first (default: all, see get_files())
+    Only rows of the selected channels and time range are read from disk, using the indexes of 'channel' and 'datetime'.
+    Returns None if nothing was saved for this parameter.
+    """
+    files = with_parameter(
+        get_files(path) if files is None else files, event_type, parameter
+    )
+    if not files:
+        return None
+
+    key = get_key(event_type, parameter)
+    dfs = []
+    channel_mean = None
+    for file in files:
+        with HDFStore(file, mode="r") as store:
+            dfs.append(select_data(store, key + "/data", channels, start, end))
+            # newer mean values replace older ones
+            file_mean = store[key + "/mean"]
+            channel_mean = (
+                file_mean
+                if channel_mean is None
+                else file_mean.combine_first(channel_mean)
+            )
+    df = concat(dfs, ignore_index=True) if len(dfs) > 1 else dfs[0]
+
+    mean_col = parameter + "_mean"
+    df[mean_col] = df["channel"].map(channel_mean)
+    if np.issubdtype(df[parameter].dtype, np.number):
+        df[parameter + "_var"] = (df[parameter] / df[mean_col] - 1) * 100
+    else:
+        df[parameter + "_var"] = None
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+
+    return df.sort_values(
+        [col for col in ["channel", "datetime"] if col in df.columns]
+    ).reset_index(drop=True)
+
+
+def select_data(
+    store: HDFStore, key: str, channels: list = None, start=None, end=None
+) -> DataFrame:
+    """Read rows of a parameter from a file, for the given channels and time range (see read_parameter())."""
+    if store.get_storer(key).is_table:
+        conditions = get_time_conditions("datetime", start, end)
+        if channels is not None:
+            conditions.append("channel in {}".format([int(ch) for ch in channels]))
+        return store.select(key, where=conditions or None)
+
+    df = store[key]
+    if channels is not None:
+        df = df[df["channel"].isin(channels)]
+    if start is not None:
+        df = df[df["datetime"] >= get_utc_timestamp(start)]
+    if end is not None:
+        df = df[df["datetime"] < get_utc_timestamp(end)]
+    return df
+
+
+def get_utc_timestamp(time) -> Timestamp:
+    """Convert a datetime, pandas Timestamp or string to a UTC Timestamp (times without timezone are taken as UTC)."""
+    time = Timestamp(time)
+    return time.tz_localize("UTC") if time.tz is None else time.tz_convert("UTC")
+
+
+def get_time_conditions(column: str, start=None, end=None) -> list:
+    """Get the 'where' conditions selecting the time range [start, end) of a column (or 'index') of a table."""
+    conditions = []
+    if start is not None:
+        conditions.append(f"{column} >= '{get_utc_timestamp(start).isoformat()}'")
+    if end is not None:
+        conditions.append(f"{column} < '{get_utc_timestamp(end).isoformat()}'")
+    return conditions
+
+
+def read_plot_info(path: str, event_type: str, parameter: str, files: list = None):
+    """Read plotting info of a saved parameter (the latest saved); None if nothing was saved for this parameter (files: see read_parameter())."""
+    files = with_parameter(
+        get_files(path) if files is None else files, event_type, parameter
+    )
+    if not files:
+        return None
+    with HDFStore(files[-1], mode="r") as store:
+        storer = store.get_storer(get_key(event_type, parameter) + "/data")
+        return storer.attrs.plot_info
+
+
+# -------------------------------------------------------------------------------
+# summaries
+# -------------------------------------------------------------------------------
+
+
+def get_summary(df: DataFrame, parameter: str) -> DataFrame:
+    """
+    Summarise rows of a parameter in time buckets of each channel; None if values are not numeric.
+
+    Columns: channel, datetime (start of the bucket), first, last (times of the first and last rows), count, sum (of non-NaN values)
+    Summaries of different rows can be merged with combine_summaries(), e.g. to get mean values over a time range without reading rows.
+    """
+    if not np.issubdtype(df[parameter].dtype, np.number):
+        return None
+    return (
+        df.assign(bucket=df["datetime"].dt.floor(SUMMARY_WIDTH))
+        .groupby(["channel", "bucket"], sort=True)
+        .agg(
+            first=("datetime", "min"),
+            last=("datetime", "max"),
+            count=(parameter, "count"),
+            sum=(parameter, "sum"),
+        )
+        .rename_axis(index=["channel", "datetime"])
+        .reset_index()
+    )
+
+
+def combine_summaries(summaries: list) -> DataFrame:
+    """Merge summaries of different rows (see get_summary()) into one bucket per channel and time."""
+    return (
+        concat(summaries, ignore_index=True)
+        .groupby(["channel", "datetime"], sort=True)
+        .agg(
+            first=("first", "min"),
+            last=("last", "max"),
+            count=("count", "sum"),
+            sum=("sum", "sum"),
+        )
+        .reset_index()
+    )
+
+
+def read_summary(path: str, event_type: str, parameter: str) -> DataFrame:
+    """
+    Read the summary of saved data of a parameter (see get_summary()), merged over the result file and segments.
+
+    Files saved without summary are summarised from their rows.
+    Returns None if nothing was saved for this parameter, or if it is not numeric.
+    """
+    files = get_files(path, event_type, parameter)
+    if not files:
+        return None
+
+    key = get_key(event_type, parameter)
+    summaries = []
+    for file in files:
+        with HDFStore(file, mode="r") as store:
+            if key + "/summary" in store:
+                summaries.append(store[key + "/summary"])
+                continue
+            summary = get_summary(store[key + "/data"], parameter)
+        if summary is None:
+            return None
+        summaries.append(summary)
+    return combine_summaries(summaries)
@@ -72,6 +72,7 @@ def main():
     add_user_bunch_parser(subparsers)
     add_user_rsync_parser(subparsers)
     add_auto_prod_parser(subparsers)
+    add_compact_parser(subparsers)
 
     if len(sys.argv) < 2:
         parser.print_usage(sys.stderr)
@@ -249,3 +250,26 @@ def auto_prod_cli(args):
     legend_data_monitor.core.auto_control_plots(
         plot_config, file_keys, prod_path, prod_config
     )
+
+
+def add_compact_parser(subparsers):
+    """Configure :func:`.core.compact_results` command line interface."""
+    parser_compact = subparsers.add_parser(
+        "compact",
+        description="""Merge segments of appended data into the result files (-monitoring.h5) and hdf files (.hdf) of all subsystems found under an output folder. It can run in background while new data are appended.""",
+    )
+    parser_compact.add_argument(
+        "--path",
+        help="""Path to the output folder (e.g. \"some_path/generated/plt/phy/p03/\").""",
+    )
+    parser_compact.add_argument(
+        "--var-keys",
+        action="store_true",
+        help="""Also write %% variations in '_var' keys of hdf files, for readers using pandas.read_hdf() (they are removed again when new data are saved).""",
+    )
+    parser_compact.set_defaults(func=compact_cli)
+
+
+def compact_cli(args):
+    """Pass command line arguments to :func:`.core.compact_results`."""
+    legend_data_monitor.core.compact_results(args.path, args.var_keys)
@@ -1,10 +1,10 @@
 import os
-import shelve
+import sys
 
-import h5py
-from pandas import DataFrame, concat, read_hdf
+from pandas import DataFrame, HDFStore, concat, read_hdf
+from tables.filters import all_complibs
 
-from . import analysis_data, utils
+from . import aggregates, analysis_data, jagged, results, segments, utils
 
 # -------------------------------------------------------------------------
 # Saving related functions
@@ -12,7 +12,7 @@ from . import analysis_data, utils
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-# SHELVE OBJECTS
+# RESULT STORE
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
@@ -47,251 +47,52 @@ def save_df_and_info(df: DataFrame, plot_info: dict) -> dict:
     return par_dict_content
 
 
-def build_out_dict(
-    plot_settings: list,
-    par_dict_content: dict,
-    out_dict: dict,
-):
+def save_results(plot_settings: dict, par_dict_content: dict):
     """
-    Build the output dictionary based on the input 'saving' option.
+    Save dataframe and plotting info of the parameter(s) of a plot in the result store of the subsystem (see results.py), one parameter at a time.
 
     Parameters
     ----------
     plot_settings
         Dictionary with settings for plotting. It contains the following keys: 'parameters', 'event_type', 'plot_structure', 'resampled', 'plot_style', 'variation', 'time_window', 'range', 'saving', 'plt_path'
     par_dict_content
-        Dictionary containing, for a given parameter, the dataframe with data and a dictionary with info for plotting (e.g. plot style, title, units, labels, ...)
-    out_dict
-        Dictionary that is returned, containing the objects that need to be saved.
+        Dictionary containing the dataframe with data and a dictionary with info for plotting (e.g. plot style, title, units, labels, ...), see save_df_and_info()
     """
     saving = plot_settings["saving"] if "saving" in plot_settings.keys() else None
     plt_path = plot_settings["plt_path"] if "plt_path" in plot_settings.keys() else None
+    event_type = plot_settings["event_type"]
     plot_info = par_dict_content["plot_info"]
+    df = par_dict_content["df_" + plot_info["subsystem"]]
+    path = plt_path + "-" + plot_info["subsystem"]
 
-    # we overwrite the object with a new one
-    if saving == "overwrite":
-        out_dict = build_dict(plot_settings, plot_info, par_dict_content, out_dict)
-
-    # we retrieve the already existing shelve object, and we append new things to it; the parameter here is fixed
-    if saving == "append":
-        # the file does not exist, so we create it
-        if not os.path.exists(plt_path + "-" + plot_info["subsystem"] + ".dat"):
-            out_dict = build_dict(plot_settings, plot_info, par_dict_content, out_dict)
-
-        # the file exists, so we are going to append data
-        else:
-            utils.logger.info(
-                "There is already a file containing output data. Appending new data to it right now..."
-            )
-            # open already existing shelve file
-            with shelve.open(plt_path + "-" + plot_info["subsystem"], "r") as shelf:
-                old_dict = dict(shelf)
-
-            # one parameter case
-            if (
-                isinstance(plot_settings["parameters"], list)
-                and len(plot_settings["parameters"]) == 1
-            ) or isinstance(plot_settings["parameters"], str):
-                utils.logger.debug("... appending new data for the one-parameter case")
-                out_dict = append_new_data(
-                    (
-                        plot_settings["parameters"][0]
-                        if isinstance(plot_settings["parameters"], list)
-                        else plot_settings["parameters"]
-                    ),
-                    plot_settings,
-                    plot_info,
-                    old_dict,
-                    par_dict_content,
-                    plt_path,
-                )
-            # multi-parameters case
-            if (
-                isinstance(plot_settings["parameters"], list)
-                and len(plot_settings["parameters"]) > 1
-            ):
-                utils.logger.debug(
-                    "... appending new data for the multi-parameters case"
-                )
-                for param in plot_settings["parameters"]:
-                    out_dict = append_new_data(
-                        param,
-                        plot_settings,
-                        plot_info,
-                        old_dict,
-                        par_dict_content,
-                        plt_path,
-                    )
-
-    return out_dict
-
-
-def build_dict(
-    plot_settings: list, plot_info: list, par_dict_content: dict, out_dict: dict
-) -> dict:
-    """Create a dictionary with the correct format for being saved in the final shelve object."""
     # get the parameters under study (can be one, can be more for 'par vs par' plot style)
     params = (
         plot_info["parameters"]
         if "parameters" in plot_info.keys()
         else plot_info["parameter"]
     )
-
-    # one parameter
-    if (isinstance(params, list) and len(params) == 1) or isinstance(params, str):
-        utils.logger.debug("Building the output dictionary in the one-parameter case")
-        if isinstance(params, list):
-            param = params[0]
-        if isinstance(params, str):
-            param = params
-        parameter = param.split("_var")[0] if "_var" in param else param
-        par_dict_content["plot_info"] = get_param_info(
-            param, par_dict_content["plot_info"]
-        )
-        # --- building up the output dictionary
-        # event type key is already there
-        if plot_settings["event_type"] in out_dict.keys():
-            out_dict[plot_settings["event_type"]][parameter] = par_dict_content
-        # event type key is NOT there
-        else:
-            # empty dictionary (not filled yet)
-            if len(out_dict.keys()) == 0:
-                out_dict = {plot_settings["event_type"]: {parameter: par_dict_content}}
-            # the dictionary already contains something (but for another event type selection)
-            else:
-                out_dict[plot_settings["event_type"]] = {parameter: par_dict_content}
-    # more than one parameter
-    if isinstance(params, list) and len(params) > 1:
-        utils.logger.debug(
-            "Building the output dictionary in the multi-parameters case"
-        )
-        # we have to polish our dataframe and plot_info dictionary from other parameters...
-        # --- original plot info
-        # ::::::::::::::::::::::::::::::::::::::::::: example 'plot_info_all' :::::::::::::::::::::::::::::::::::::::::::
-        # {'title': 'Plotting cuspEmax vs baseline', 'subsystem': 'geds', 'locname': 'string',
-        #  'plot_style': 'par vs par', 'time_window': '10T', 'resampled': 'no', 'range': [None, None], 'std': False,
-        #  'unit': {'cuspEmax_var': 'ADC', 'baseline_var': 'ADC'},
-        #  'label': {'cuspEmax_var': 'cuspEmax', 'baseline_var': 'FPGA baseline'},
-        #  'unit_label': {'cuspEmax_var': '%', 'baseline_var': '%'},
-        #  'limits': {'cuspEmax_var': [-0.025, 0.025], 'baseline_var': [-5, 5]},
-        #  'parameters': ['cuspEmax_var', 'baseline_var'],
-        #  'param_mean': ['cuspEmax_mean', 'baseline_mean']}
-        plot_info_all = par_dict_content["plot_info"]
-
-        # --- original dataframes coming from the analysis
-        df_all = par_dict_content["df_" + plot_info_all["subsystem"]]
-
-        for param in params:
-            parameter = param.split("_var")[0] if "_var" in param else param
-
-            # --- cleaned plot info
-            # ::::::::::::::::::::::::::::::::::::::::::: example 'plot_info_param' :::::::::::::::::::::::::::::::::::::::::::
-            # {'title': 'Prove in corso', 'subsystem': 'geds', 'locname': 'string', 'plot_style': 'par vs par', 'time_window': '10T',
-            #  'resampled': 'no', 'range': [None, None], 'std': False, 'unit': 'ADC', 'label': 'cuspEmax', 'unit_label': '%',
-            #  'limits': [-0.025, 0.025], 'param_mean': 'cuspEmax_mean', 'parameter': 'cuspEmax_var', 'variation': True}
-            plot_info_param = get_param_info(param, plot_info_all)
-
-            # --- cleaned df
-            df_param = get_param_df(parameter, df_all)
-
-            # --- rebuilding the 'par_dict_content' for the parameter under study
-            par_dict_content = save_df_and_info(df_param, plot_info_param)
-
-            # --- building up the output dictionary
-            # event type key is already there
-            if plot_settings["event_type"] in out_dict.keys():
-                out_dict[plot_settings["event_type"]][parameter] = par_dict_content
-            # event type key is NOT there
-            else:
-                # empty dictionary (not filled yet)
-                if len(out_dict.keys()) == 0:
-                    out_dict = {
-                        plot_settings["event_type"]: {parameter: par_dict_content}
-                    }
-                # the dictionary already contains something (but for another event type selection)
-                else:
-                    out_dict[plot_settings["event_type"]] = {
-                        parameter: par_dict_content
-                    }
-
-    return out_dict
-
-
-def append_new_data(
-    param: str,
-    plot_settings: dict,
-    plot_info: dict,
-    old_dict: dict,
-    par_dict_content: dict,
-    plt_path: str,
-) -> dict:
-    # the parameter is there
-    parameter = param.split("_var")[0] if "_var" in param else param
-    event_type = plot_settings["event_type"]
+    if isinstance(params, str):
+        params = [params]
 
     utils.logger.info("\33[95m**************************************************\33[0m")
     utils.logger.info(f"\33[95m*** S A V I N G : {plot_info['subsystem']}\33[0m")
     utils.logger.info("\33[95m**************************************************\33[0m")
 
-    if old_dict["monitoring"][event_type][parameter]:
-        # get already present df
-        old_df = old_dict["monitoring"][event_type][parameter][
-            "df_" + plot_info["subsystem"]
-        ].copy()
-        old_df = check_level0(old_df)
-
-        # get new df (plot_info object is the same as before, no need to get it and update it)
-        new_df = par_dict_content["df_" + plot_info["subsystem"]].copy()
-        # --- cleaned df
-        new_df = get_param_df(parameter, new_df)
-
-        # --- we have to copy the new means in the old one, otherwise we end up with two values (consider they have different lengths!)
-        # Create a dictionary mapping 'channel' values to 'parameter_mean' values from new_df
-        mean_dict = new_df.set_index("channel")[parameter + "_mean"].to_dict()
-        # Update 'parameter_mean' values in old_df based on the dictionary mapping
-        old_df[parameter + "_mean"] = (
-            old_df["channel"].map(mean_dict).fillna(old_df[parameter + "_mean"])
-        )
-
-        # we have to re-calculate the % variations based on the new mean values (new-df is ok, but old_df isn't!)
-        old_df = old_df.drop(columns={parameter + "_var"})
-        old_df[parameter + "_var"] = (
-            old_df[parameter] / old_df[parameter + "_mean"] - 1
-        ) * 100
-        old_df = old_df.reset_index(drop=True)
-
-        # concatenate the two dfs (channels are no more grouped; not a problem)
-        merged_df = DataFrame.empty
-        merged_df = concat([old_df, new_df], ignore_index=True, axis=0)
-        merged_df = merged_df.reset_index(drop=True)
-        # re-order content in order of channels/timestamps
-        merged_df = merged_df.sort_values(["channel", "datetime"])
-
-        # redefine the dict containing the df and plot_info
-        par_dict_content = {}
-        par_dict_content["df_" + plot_info["subsystem"]] = merged_df
-        par_dict_content["plot_info"] = plot_info
-
-        # saved the merged df as usual (but for the given parameter)
-        plot_info = get_param_info(param, plot_info)
-        out_dict = build_dict(
-            plot_settings, plot_info, par_dict_content, old_dict["monitoring"]
-        )
-
-        # we need to save it, otherwise when looping over the next parameter we lose the appended info for the already inspected parameter
-        out_file = shelve.open(plt_path + "-" + plot_info["subsystem"])
-        out_file["monitoring"] = out_dict
-        out_file.close()
-
-    return out_dict
-
+    for param in params:
+        parameter = param.split("_var")[0] if "_var" in param else param
+        # polish dataframe and plot_info dictionary from other parameters
+        plot_info_param = get_param_info(param, plot_info)
+        df_param = get_param_df(parameter, df)
 
-def check_level0(dataframe: DataFrame) -> DataFrame:
-    """Check if a dataframe contains the 'level_0' column. If so, remove it."""
-    if "level_0" in dataframe.columns:
-        return dataframe.drop(columns=["level_0"])
-    else:
-        return dataframe
+        if saving == "append" and results.exists(path, event_type, parameter):
+            utils.logger.debug(f"... appending new data for {parameter}")
+            results.append_parameter(
+                path, event_type, parameter, df_param, plot_info_param
+            )
+        else:
+            results.write_parameter(
+                path, event_type, parameter, df_param, plot_info_param
+            )
 
 
 def get_param_info(param: str, plot_info: dict) -> dict:
@@ -423,6 +224,161 @@ def get_param_df(parameter: str, df: DataFrame) -> DataFrame:
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
+class HDFWriter:
+    """
+    Output hdf files kept open while writing several keys, e.g. for all the plots of a subsystem.
+
+    Keys are not written in the files, but in a new segment of each file (see the segments module), which is moved into place
+    and registered when closing the writer: readers (e.g. dashboards) only see complete segments, and saved data are never copied.
+    Segments are merged into their file once results.MAX_SEGMENTS of them are registered.
+    Remember to close() the writer at the end; if the writer is not closed (e.g. after an error), files are left as they were.
+
+    output: dict of output format options (the 'output' entry of the dataset), with keys
+        - 'compression' [str]: PyTables compression library, e.g. 'zlib', 'blosc:lz4', 'blosc:zstd' (default: no compression)
+        - 'complevel' [int]: compression level from 1 to 9 (default: 5 if a compression library is given)
+        - 'expected_rows' [int]: expected number of rows of pivots, used by PyTables to size chunks of new keys
+        - 'float32' [bool or list]: store float values of all parameters (True), or only of the listed ones, in single precision
+    """
+
+    def __init__(self, output: dict = None):
+        # HDFStore of the new segment, HDFStores of the saved file and segments, and set of keys, by file path
+        self.stores = {}
+        self.saved = {}
+        self.keys = {}
+
+        output = output or {}
+        unknown = set(output) - {"compression", "complevel", "expected_rows", "float32"}
+        if unknown:
+            utils.logger.error(
+                "\033[91mUnknown output option(s): %s\033[0m", ", ".join(unknown)
+            )
+            sys.exit()
+        self.compression = output.get("compression")
+        if self.compression is not None and self.compression not in all_complibs:
+            utils.logger.error(
+                "\033[91mInvalid compression '%s'. Choose among: %s\033[0m",
+                self.compression,
+                ", ".join(all_complibs),
+            )
+            sys.exit()
+        self.complevel = output.get(
+            "complevel", 5 if self.compression is not None else None
+        )
+        self.expected_rows = output.get("expected_rows")
+        self.float32 = output.get("float32", False)
+
+    def get_store(self, file_path: str) -> HDFStore:
+        """Get the HDFStore of the new segment of a file, opening (or creating) it if not yet done."""
+        if file_path not in self.stores:
+            self.saved[file_path] = [
+                HDFStore(file, mode="r") for file in segments.get_files(file_path)
+            ]
+            self.keys[file_path] = segments.get_keys(self.saved[file_path])
+            # a segment left by an interrupted writer is replaced
+            self.stores[file_path] = HDFStore(
+                file_path + ".tmp",
+                mode="w",
+                complevel=self.complevel,
+                complib=self.compression,
+            )
+        return self.stores[file_path]
+
+    def convert(self, parameter: str, df: DataFrame) -> DataFrame:
+        """Convert float64 columns of a parameter dataframe to float32, if requested for this parameter."""
+        if isinstance(self.float32, list):
+            # mean values follow their parameter
+            use_float32 = (
+                parameter in self.float32
+                or parameter.replace("_mean", "") in self.float32
+            )
+        else:
+            use_float32 = bool(self.float32)
+        if not use_float32:
+            return df
+        return df.astype(
+            {col: "float32" for col in df.columns if df[col].dtype == "float64"}
+        )
+
+    def has_key(self, file_path: str, key_name: str) -> bool:
+        """Check if a key is saved in a file."""
+        self.get_store(file_path)
+        return key_name in self.keys[file_path]
+
+    def put(self, file_path: str, key_name: str, df: DataFrame, **kwargs):
+        """Write a dataframe in a file, replacing the key if already there (same options of HDFStore.put)."""
+        store = self.get_store(file_path)
+        if key_name in store:
+            store.remove(key_name)
+        if kwargs.get("format") == "table" and self.expected_rows is not None:
+            # chunks are sized when creating the table, which only append() allows to tune
+            kwargs.pop("format")
+            store.append(key_name, df, expectedrows=self.expected_rows, **kwargs)
+        else:
+            store.put(key_name, df, **kwargs)
+        self.keys[file_path].add(key_name)
+
+    def append(self, file_path: str, key_name: str, df: DataFrame, **kwargs):
+        """Append rows to a key of a file, after the saved ones (same options of HDFStore.append)."""
+        store = self.get_store(file_path)
+        if key_name not in store:
+            if self.expected_rows is not None:
+                kwargs.setdefault("expectedrows", self.expected_rows)
+            store.append(key_name, df, **kwargs)
+            store.get_storer(key_name).attrs.appended = True
+        else:
+            # already written by this writer
+            try:
+                store.append(key_name, df, **kwargs)
+            except (ValueError, TypeError):
+                utils.logger.debug(f"... channels or types of {key_name} changed")
+                appended = segments.is_appended(store, key_name)
+                df = concat([store[key_name], df])
+                store.remove(key_name)
+                store.append(key_name, df, **kwargs)
+                store.get_storer(key_name).attrs.appended = appended
+        self.keys[file_path].add(key_name)
+
+    def get_keys(self, file_path: str) -> set:
+        """Get the keys saved in a file, including the ones written by this writer."""
+        self.get_store(file_path)
+        return set(self.keys[file_path])
+
+    def read(self, file_path: str, key_name: str) -> DataFrame:
+        """Read a key of a file, including what was written by this writer."""
+        store = self.get_store(file_path)
+        return read_key(self.saved[file_path] + [store], key_name)
+
+    def remove(self, file_path: str, key_name: str):
+        """Remove a key from a file, if present (files are not created for this)."""
+        if file_path not in self.stores and not segments.get_files(file_path):
+            return
+        if self.has_key(file_path, key_name):
+            store = self.get_store(file_path)
+            if key_name in store:
+                store.remove(key_name)
+            if segments.get_key_stores(self.saved[file_path], key_name):
+                removed_keys = segments.get_removed_keys(store) + [key_name]
+                store.root._v_attrs.removed_keys = removed_keys
+            self.keys[file_path].discard(key_name)
+
+    def close(self):
+        """Close all open files, registering their new segment (nothing if empty)."""
+        for file_path, store in self.stores.items():
+            is_empty = not store.keys() and not segments.get_removed_keys(store)
+            store.close()
+            for saved_store in self.saved[file_path]:
+                saved_store.close()
+            if is_empty:
+                os.remove(file_path + ".tmp")
+                continue
+            n_segments = segments.register(file_path, file_path + ".tmp")
+            if n_segments >= results.MAX_SEGMENTS:
+                compact_hdf(file_path)
+        self.stores = {}
+        self.saved = {}
+        self.keys = {}
+
+
 def save_hdf(
     saving: str,
     file_path: str,
@@ -432,8 +388,29 @@ def save_hdf(
     aux_ratio_analysis: analysis_data.AnalysisData,
     aux_diff_analysis: analysis_data.AnalysisData,
     plot_info: dict,
+    writer: HDFWriter = None,
 ) -> dict:
-    """Save the input dataframe in an external hdf file, using a different structure (time vs channel, with values in cells). Plot info are saved too."""
+    """
+    Save the input dataframe in an external hdf file, using a different structure (time vs channel, with values in cells). Plot info are saved too.
+
+    writer: HDFWriter keeping output files open (default: files are opened and closed here)
+    """
+    if writer is None:
+        writer = HDFWriter()
+        save_hdf(
+            saving,
+            file_path,
+            df,
+            aux_ch,
+            aux_analysis,
+            aux_ratio_analysis,
+            aux_diff_analysis,
+            plot_info,
+            writer,
+        )
+        writer.close()
+        return
+
     utils.logger.info("Building HDF file(s)")
     # save the final dataframe as a hdf object
     parameters = plot_info["parameters"]
@@ -536,8 +513,8 @@ def save_hdf(
             plot_info_param, orient="index", columns=["Value"]
         )
 
-        df_info.to_hdf(
-            file_path, key=f"{flag_rename[evt_type]}_{param_orig_camel}_info", mode="a"
+        writer.put(
+            file_path, f"{flag_rename[evt_type]}_{param_orig_camel}_info", df_info
         )
 
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -556,10 +533,10 @@ def save_hdf(
             df_info_aux = DataFrame.from_dict(
                 plot_info_aux, orient="index", columns=["Value"]
             )
-            df_info_aux.to_hdf(
+            writer.put(
                 file_path.replace(plot_info_param["subsystem"], aux_ch),
-                key=f"{flag_rename[evt_type]}_{param_orig_camel}_info",
-                mode="a",
+                f"{flag_rename[evt_type]}_{param_orig_camel}_info",
+                df_info_aux,
             )
 
             # ... absolute values
@@ -569,6 +546,7 @@ def save_hdf(
                 f"{flag_rename[evt_type]}_{param_orig_camel}",
                 file_path.replace(plot_info_param["subsystem"], aux_ch),
                 saving,
+                writer,
             )
             # ... mean values
             get_pivot(
@@ -577,14 +555,13 @@ def save_hdf(
                 f"{flag_rename[evt_type]}_{param_orig_camel}_mean",
                 file_path.replace(plot_info_param["subsystem"], aux_ch),
                 saving,
+                writer,
             )
-            # ... % variations wrt absolute values
-            get_pivot(
-                df_aux_to_save,
-                param_orig + "_var",
-                f"{flag_rename[evt_type]}_{param_orig_camel}_var",
+            # ... % variations are derived when reading, older ones would not be updated
+            remove_var_key(
                 file_path.replace(plot_info_param["subsystem"], aux_ch),
-                saving,
+                f"{flag_rename[evt_type]}_{param_orig_camel}",
+                writer,
             )
             utils.logger.info(
                 f"... HDF file for {aux_ch} - pure AUX values - saved in: \33[4m{file_path.replace(plot_info_param['subsystem'], aux_ch)}\33[0m"
@@ -600,6 +577,7 @@ def save_hdf(
             f"{flag_rename[evt_type]}_{param_orig_camel}",
             file_path,
             saving,
+            writer,
         )
         # ... mean values
         get_pivot(
@@ -608,14 +586,13 @@ def save_hdf(
             f"{flag_rename[evt_type]}_{param_orig_camel}_mean",
             file_path,
             saving,
+            writer,
         )
-        # ... % variations wrt absolute values
-        get_pivot(
-            df_to_save,
-            param_orig + "_var",
-            f"{flag_rename[evt_type]}_{param_orig_camel}_var",
+        # ... % variations are derived when reading, older ones would not be updated
+        remove_var_key(
             file_path,
-            saving,
+            f"{flag_rename[evt_type]}_{param_orig_camel}",
+            writer,
         )
 
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -629,6 +606,7 @@ def save_hdf(
                 f"{flag_rename[evt_type]}_{param_orig_camel}_{aux_ch}Ratio",
                 file_path,
                 saving,
+                writer,
             )
             # ... mean values
             get_pivot(
@@ -637,14 +615,13 @@ def save_hdf(
                 f"{flag_rename[evt_type]}_{param_orig_camel}_{aux_ch}Ratio_mean",
                 file_path,
                 saving,
+                writer,
             )
-            # ... % variations wrt absolute values
-            get_pivot(
-                df_aux_ratio_to_save,
-                param_orig + "_var",
-                f"{flag_rename[evt_type]}_{param_orig_camel}_{aux_ch}Ratio_var",
+            # ... % variations are derived when reading, older ones would not be updated
+            remove_var_key(
                 file_path,
-                saving,
+                f"{flag_rename[evt_type]}_{param_orig_camel}_{aux_ch}Ratio",
+                writer,
             )
 
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -658,6 +635,7 @@ def save_hdf(
                 f"{flag_rename[evt_type]}_{param_orig_camel}_{aux_ch}Diff",
                 file_path,
                 saving,
+                writer,
             )
             # ... mean values
             get_pivot(
@@ -666,14 +644,13 @@ def save_hdf(
                 f"{flag_rename[evt_type]}_{param_orig_camel}_{aux_ch}Diff_mean",
                 file_path,
                 saving,
+                writer,
             )
-            # ... % variations wrt absolute values
-            get_pivot(
-                df_aux_diff_to_save,
-                param_orig + "_var",
-                f"{flag_rename[evt_type]}_{param_orig_camel}_{aux_ch}Diff_var",
+            # ... % variations are derived when reading, older ones would not be updated
+            remove_var_key(
                 file_path,
-                saving,
+                f"{flag_rename[evt_type]}_{param_orig_camel}_{aux_ch}Diff",
+                writer,
             )
 
     utils.logger.info(
@@ -682,75 +659,254 @@ def save_hdf(
 
 
 def get_pivot(
-    df: DataFrame, parameter: str, key_name: str, file_path: str, saving: str
+    df: DataFrame,
+    parameter: str,
+    key_name: str,
+    file_path: str,
+    saving: str,
+    writer=None,
 ):
-    """Get pivot: datetimes (first column) vs channels (other columns)."""
-    df_pivot = df.pivot(index="datetime", columns="channel", values=parameter)
+    """
+    Get pivot: datetimes (first column) vs channels (other columns).
+
+    Pivots are saved in (appendable) table format: with 'append', only the new rows are written.
+    One-row mean values are overwritten in fixed format instead.
+    % variations are not saved, they are derived from absolute and mean values when reading them (see read_pivot, write_var_keys).
+
+    writer: HDFWriter keeping the output file open (default: the file is opened and closed here)
+    """
+    if writer is None:
+        writer = HDFWriter()
+        get_pivot(df, parameter, key_name, file_path, saving, writer)
+        writer.close()
+        return
+
+    df_pivot = jagged.to_object(df).pivot(
+        index="datetime", columns="channel", values=parameter
+    )
     # just select one row for mean values (since mean is constant over time for a given channel)
     # take into consideration parameters that are named with 'mean' in it, eg "bl_mean"
-    if "_mean" in parameter and parameter.count("mean") > 1:
+    is_mean = "_mean" in parameter and parameter.count("mean") > 1
+    if is_mean:
         df_pivot = df_pivot.iloc[[0]]
+    df_pivot = writer.convert(parameter, df_pivot)
+    # absolute values are appended bunch after bunch
+    is_appendable = not is_mean
+
+    # append new data, if this specific key was already saved
+    if saving == "append" and writer.has_key(file_path, key_name):
+        # for the mean entry, we overwrite the already existing content with the new mean value
+        if is_mean:
+            writer.put(file_path, key_name, df_pivot)
+        # otherwise, append new rows to the existing ones
+        else:
+            append_pivot(df_pivot, file_path, key_name, writer)
+
+    # overwrite already existing data (or create the new key)
+    else:
+        writer.put(
+            file_path, key_name, df_pivot, format="table" if is_appendable else "fixed"
+        )
+
+    # pre-aggregated levels of absolute values, to show long time ranges (see aggregates.read_aggregates)
+    if not key_name.endswith("_mean"):
+        update_aggregates(df_pivot, file_path, key_name, saving, writer)
+
+
+def remove_var_key(file_path: str, key_name: str, writer):
+    """
+    Remove the % variations of a pivot saved by older versions or by write_var_keys(), through a HDFWriter, as they would not be updated with new rows.
+
+    % variations are still read (derived from absolute and mean values) by read_pivot(); run write_var_keys() again for readers of '_var' keys.
+    """
+    if writer.has_key(file_path, key_name + "_var"):
+        utils.logger.info(
+            f"... removing {key_name}_var from {file_path}, as it would not be updated (see save_data.write_var_keys)"
+        )
+        writer.remove(file_path, key_name + "_var")
+
+
+def append_pivot(df_pivot: DataFrame, file_path: str, key_name: str, writer):
+    """
+    Append rows of a pivot to an already saved key of a hdf file, through a HDFWriter.
+
+    Rows are written in the new segment of the file only, and concatenated with the saved ones when reading (see read_pivot()).
+    """
+    writer.append(file_path, key_name, df_pivot)
+
+
+def update_aggregates(
+    df_pivot: DataFrame, file_path: str, key_name: str, saving: str, writer
+):
+    """
+    Update the pre-aggregated levels of a pivot with its new rows (see the aggregates module), through a HDFWriter.
+
+    With 'append', bins of the new rows are appended to the saved levels (bins are combined when reading);
+    levels missing from older files are built from the whole saved pivot.
+    """
+    rows = aggregates.get_rows(df_pivot)
+    if rows is None:
+        return
+
+    levels_saved = all(
+        writer.has_key(file_path, aggregates.get_key(key_name, level))
+        for level in aggregates.LEVELS
+    )
+    if saving == "append" and levels_saved:
+        for level, df_level in aggregates.get_levels(rows).items():
+            writer.append(
+                file_path,
+                aggregates.get_key(key_name, level),
+                df_level,
+                data_columns=["channel", "datetime"],
+            )
+        return
 
-    # append new data
     if saving == "append":
-        # check if the file exists: if not, create a new one
-        if not os.path.exists(file_path):
-            df_pivot.to_hdf(file_path, key=key_name, mode="a")
-            return
-        # the file exists, but this specific key was not saved - create the new key
-        saved_keys = []
-        with h5py.File(file_path, "r") as file:
-            saved_keys = list(file.keys())
-        if os.path.exists(file_path) and key_name not in saved_keys:
-            df_pivot.to_hdf(file_path, key=key_name, mode="a")
+        rows = aggregates.get_rows(writer.read(file_path, key_name))
+        # saved values are not all numeric (e.g. saved by older versions)
+        if rows is None:
             return
+    for level, df_level in aggregates.get_levels(rows).items():
+        writer.put(
+            file_path,
+            aggregates.get_key(key_name, level),
+            df_level,
+            format="table",
+            data_columns=["channel", "datetime"],
+        )
 
-        # for the mean entry, we overwrite the already existing content with the new mean value
-        if "_mean" in parameter and parameter.count("mean") > 1:
-            df_pivot.to_hdf(file_path, key=key_name, mode="a")
-        if "_mean" not in parameter or (
-            "_mean" in parameter and parameter.count("mean") == 1
-        ):
-            # if % variations, we have to re-calculate all of them for the new mean values
-            if "_var" in parameter:
-                key_name_orig = key_name.replace("_var", "")
-                new_mean = read_hdf(
-                    file_path, key=key_name_orig + "_mean"
-                )  # gia' aggiornata (perche' la media la aggiorniamo prima delle variazioni %)
-                all_abs_data = read_hdf(
-                    file_path, key=key_name_orig
-                )  # df vecchio con TUTTI i valori assoluti (anche quelli di prima)
-                new_var_data = all_abs_data.copy()
-
-                # one channel (AUX)
-                channels = list(df["channel"].unique())
-                if len(channels) == 1:
-                    channel = channels[0]
-                    new_var_data[channel] = (
-                        all_abs_data[channel] / new_mean[channel][0] - 1
-                    ) * 100
-                # more channels (geds)
-                else:
-                    for channel in channels:
-                        new_var_data[channel] = (
-                            all_abs_data[channel] / new_mean[channel][0] - 1
-                        ) * 100
-
-                # Write the combined DataFrame to the HDF5 file
-                new_var_data.to_hdf(file_path, key=key_name, mode="a")
-
-            # otherwise, just read the existing HDF5 file
-            else:
-                # Read the existing HDF5 file
-                existing_data = read_hdf(file_path, key=key_name)
-                # Concatenate the existing data and the new data
-                combined_data = concat([existing_data, df_pivot])
-                # Write the combined DataFrame to the HDF5 file
-                combined_data.to_hdf(file_path, key=key_name, mode="a")
-
-    # overwrite already existing data
-    else:
-        df_pivot.to_hdf(file_path, key=key_name, mode="a")
+
+def read_pivot(
+    file_path: str, key_name: str, start=None, end=None, channels: list = None
+) -> DataFrame:
+    """
+    Read a pivot (datetimes vs channels) saved by save_hdf(), from the hdf file and its segments (see the segments module).
+
+    For % variations ('<flag>_<param>_var', '<flag>_<param>_pulser01anaRatio_var', ...), values are computed from absolute values
+    and mean values as (absolute / mean - 1) * 100, using the first mean value of each channel.
+
+    start, end: time range [start, end) to read, as datetime, pandas Timestamp or string 'YYYY-MM-DD hh:mm:ss' (UTC if no timezone is given)
+    channels: list of channels (columns) to read (default: all)
+    Keys saved in table format only have the selected rows read from disk, using the datetime index.
+    """
+    with segments.open_files(file_path) as stores:
+        # '_var' keys saved by older versions (or by write_var_keys()) are read as they are
+        is_saved = segments.get_key_stores(stores, key_name)
+        if not key_name.endswith("_var") or is_saved:
+            return read_key(stores, key_name, start, end, channels)
+        key_name_orig = key_name[: -len("_var")]
+        abs_data = read_key(stores, key_name_orig, start, end, channels)
+        # the whole time range, to take the same mean values as for a full read
+        mean_data = read_key(stores, key_name_orig + "_mean", channels=channels)
+
+    return get_variations(abs_data, mean_data)
+
+
+def get_variations(abs_data: DataFrame, mean_data: DataFrame) -> DataFrame:
+    """Get % variations of absolute values wrt the first mean value of each channel, (absolute / mean - 1) * 100."""
+    # values stored in single precision (see 'float32' output option) are compared in double precision
+    abs_data = abs_data.astype(
+        {col: "float64" for col in abs_data.columns if abs_data[col].dtype == "float32"}
+    )
+    # first mean value of each channel (mean is constant over time for a given channel)
+    channel_mean = mean_data.bfill().iloc[0]
+    if channel_mean.dtype == "float32":
+        channel_mean = channel_mean.astype("float64")
+    return (abs_data / channel_mean - 1) * 100
+
+
+def write_var_keys(file_path: str):
+    """
+    Write the % variations of all pivots of a hdf file in '_var' keys (derived as in read_pivot()), as older versions did, and merge segments into the file.
+
+    For readers of the file with pandas.read_hdf(): keys are removed again when new data are saved, as they would not be updated;
+    run this again (e.g. with 'legend-data-monitor compact --var-keys') after saving.
+    """
+    writer = HDFWriter()
+    key_names = sorted(
+        key_name[: -len("_mean")]
+        for key_name in writer.get_keys(file_path)
+        if key_name.endswith("_mean")
+    )
+    for key_name in key_names:
+        if not writer.has_key(file_path, key_name):
+            continue
+        # fixed format, as saved by older versions
+        writer.put(
+            file_path,
+            key_name + "_var",
+            get_variations(
+                writer.read(file_path, key_name),
+                writer.read(file_path, key_name + "_mean"),
+            ),
+        )
+    writer.close()
+    compact_hdf(file_path)
+
+
+def read_key(
+    stores: list, key_name: str, start=None, end=None, channels: list = None
+) -> DataFrame:
+    """Read a pivot from the stores of a hdf file and its segments (see read_pivot()), concatenating the rows of all segments."""
+    dfs = segments.read_parts(
+        stores,
+        key_name,
+        lambda store, key: select_pivot(store, key, start, end, channels),
+    )
+    if len(dfs) == 1:
+        return dfs[0]
+    df = concat(dfs)
+    # channels missing from some segments are NaN there
+    if channels is not None and not key_name.endswith("_info"):
+        df = df.reindex(columns=channels)
+    return df
+
+
+def select_pivot(
+    store: HDFStore, key_name: str, start=None, end=None, channels: list = None
+) -> DataFrame:
+    """Read the rows of a pivot in the time range [start, end) and the columns of the given channels (see read_pivot())."""
+    # info keys have no time index nor channel columns
+    if key_name.endswith("_info"):
+        start = end = channels = None
+
+    storer = store.get_storer(key_name)
+    if storer.is_table:
+        if channels is not None:
+            # channels saved in this store only (e.g. new channels are not in older segments)
+            saved_channels = list(storer.non_index_axes[0][1])
+            channels = [channel for channel in channels if channel in saved_channels]
+        return store.select(
+            key_name,
+            where=results.get_time_conditions("index", start, end) or None,
+            columns=channels,
+        )
+
+    # fixed format (saved by older versions): read everything, then select
+    df = store[key_name]
+    if start is not None:
+        df = df[df.index >= results.get_utc_timestamp(start)]
+    if end is not None:
+        df = df[df.index < results.get_utc_timestamp(end)]
+    if channels is not None:
+        df = df[[channel for channel in channels if channel in df.columns]]
+    return df
+
+
+def merge_key(stores: list, key_name: str) -> DataFrame:
+    """Merge all parts of a key saved in the stores of a hdf file and its segments (pivots, info, or levels of aggregated values)."""
+    if aggregates.is_level_key(key_name):
+        return aggregates.merge(segments.read_parts(stores, key_name))
+    return read_key(stores, key_name)
+
+
+def compact_hdf(file_path: str):
+    """Merge the segments of a hdf file into it (see segments.compact()), e.g. when too many segments are registered."""
+    segments.compact(
+        file_path,
+        lambda files, new_file: segments.write_keys(files, new_file, merge_key),
+    )
 
 
 def check_existence_and_overwrite(file: str):
@@ -0,0 +1,259 @@
+import fcntl
+import json
+import os
+from contextlib import ExitStack, contextmanager
+
+from pandas import HDFStore
+
+from . import utils
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# SEGMENTS OF HDF FILES
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Files that are appended to, i.e. '<...>-<subsystem>.hdf' files (see save_data.HDFWriter) and result files
+# '<...>-<subsystem>-monitoring.h5' (see results.py), are not modified: new content goes to a new segment
+# '<file name>-<number>.<extension>', never modified afterwards and registered in the manifest '<file>.json' once complete.
+# Readers merge the file and its registered segments; compact() merges segments into the file, replacing it at once.
+#
+# In '.hdf' files, a key of a segment replaces what was saved before for it, unless it has the attribute 'appended':
+# then its rows follow the saved ones (pivots), or are combined with them (bins of aggregated levels, see aggregates.py).
+# Keys removed by a segment are listed in its attribute 'removed_keys'.
+
+# suffix of the manifest listing segments, after the name of the file
+MANIFEST_SUFFIX = ".json"
+
+
+def get_manifest_file(file_path: str) -> str:
+    """Get the manifest listing segments of a file."""
+    return file_path + MANIFEST_SUFFIX
+
+
+def get_segment_file(file_path: str, number: int) -> str:
+    """Get the segment of a file with a given number."""
+    base, extension = os.path.splitext(file_path)
+    return f"{base}-{number:06d}{extension}"
+
+
+def read_manifest(file_path: str) -> dict:
+    """Read the manifest of a file: {'next': number of the next segment, 'segments': [file names, oldest first]}; empty if not yet written."""
+    manifest_file = get_manifest_file(file_path)
+    if not os.path.exists(manifest_file):
+        return {"next": 0, "segments": []}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def write_manifest(file_path: str, manifest: dict):
+    """Replace the manifest of a file at once (readers see either the old or the new content)."""
+    manifest_file = get_manifest_file(file_path)
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+@contextmanager
+def lock_file(lock_path: str, wait: bool = True):
+    """Lock a file (created if needed); with wait=False, yields False without waiting if it is already locked, True otherwise."""
+    with open(lock_path, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+@contextmanager
+def lock_manifest(file_path: str):
+    """Lock the manifest of a file while updating it, e.g. against a compaction running at the same time."""
+    with lock_file(file_path + ".lock"):
+        yield
+
+
+@contextmanager
+def lock_compaction(file_path: str):
+    """Lock a file while compacting it; yields False (without waiting) if another compaction is running."""
+    with lock_file(file_path + ".compact.lock", wait=False) as locked:
+        yield locked
+
+
+def get_compacted_segments(file_path: str) -> list:
+    """Get segments already merged in a file."""
+    with HDFStore(file_path, mode="r") as store:
+        return list(getattr(store.root._v_attrs, "compacted_segments", []))
+
+
+def get_files(file_path: str, segments: list = None) -> list:
+    """
+    Get the file and its segments not yet merged in it, oldest first (only existing files).
+
+    segments: registered segments to consider (default: all, as listed in the manifest now)
+    """
+    files = []
+    compacted = []
+    if os.path.exists(file_path):
+        files.append(file_path)
+        compacted = get_compacted_segments(file_path)
+    if segments is None:
+        segments = read_manifest(file_path)["segments"]
+    folder = os.path.dirname(file_path)
+    files += [
+        os.path.join(folder, segment)
+        for segment in segments
+        if segment not in compacted
+    ]
+    return files
+
+
+@contextmanager
+def open_files(file_path: str, segments: list = None):
+    """Open the file and its segments (see get_files()) for reading; yields their HDFStores, oldest first."""
+    with open_stores(get_files(file_path, segments)) as stores:
+        yield stores
+
+
+@contextmanager
+def open_stores(files: list):
+    """Open files for reading; yields their HDFStores."""
+    with ExitStack() as stack:
+        yield [stack.enter_context(HDFStore(file, mode="r")) for file in files]
+
+
+# -------------------------------------------------------------------------------
+# keys of '.hdf' files
+# -------------------------------------------------------------------------------
+
+
+def is_appended(store: HDFStore, key_name: str) -> bool:
+    """Check if a key of a segment follows the content saved before it."""
+    return bool(getattr(store.get_storer(key_name).attrs, "appended", False))
+
+
+def get_removed_keys(store: HDFStore) -> list:
+    """Get the keys removed by a segment."""
+    return list(getattr(store.root._v_attrs, "removed_keys", []))
+
+
+def get_key_stores(stores: list, key_name: str) -> list:
+    """Get the stores (oldest first) with visible content of a key: from the last one that replaced it, if not removed afterwards."""
+    key_stores = []
+    for store in reversed(stores):
+        if key_name in store:
+            key_stores.append(store)
+            if not is_appended(store, key_name):
+                break
+        elif key_name.lstrip("/") in get_removed_keys(store):
+            break
+    return key_stores[::-1]
+
+
+def get_keys(stores: list) -> set:
+    """Get the keys (without leading '/') visible in a list of stores (oldest first)."""
+    keys = {key.lstrip("/") for store in stores for key in store.keys()}
+    return {key for key in keys if get_key_stores(stores, key)}
+
+
+def read_parts(stores: list, key_name: str, select=None) -> list:
+    """
+    Read the visible parts of a key from a list of stores, oldest first (see get_key_stores()).
+
+    select: function reading a part, select(store, key_name) (default: the whole key)
+    Raises KeyError if the key is not visible, as HDFStore.
+    """
+    key_stores = get_key_stores(stores, key_name)
+    if not key_stores:
+        raise KeyError(f"No object named {key_name} in the file")
+    if select is None:
+        return [store[key_name] for store in key_stores]
+    return [select(store, key_name) for store in key_stores]
+
+
+# -------------------------------------------------------------------------------
+# writing
+# -------------------------------------------------------------------------------
+
+
+def register(file_path: str, segment_path: str) -> int:
+    """
+    Move a complete segment into place and register it in the manifest of a file; returns the number of registered segments.
+
+    The first segment of a new file becomes the file itself.
+    """
+    with lock_manifest(file_path):
+        manifest = read_manifest(file_path)
+        if not os.path.exists(file_path) and not manifest["segments"]:
+            os.replace(segment_path, file_path)
+            return 0
+        segment = get_segment_file(file_path, manifest["next"])
+        os.replace(segment_path, segment)
+        manifest["next"] += 1
+        manifest["segments"].append(os.path.basename(segment))
+        write_manifest(file_path, manifest)
+        return len(manifest["segments"])
+
+
+def compact(file_path: str, write):
+    """
+    Merge the segments of a file into it, which is then replaced at once.
+
+    write: function writing the merged content of a list of files (the file and its segments, oldest first) in a new file,
+        write(files, new_file)
+    Can run while new segments are registered: only the file and the segments registered when it starts are read,
+    segments registered in the meantime are kept for the next compaction.
+    Nothing is done if another compaction of the same file is running.
+    """
+    with lock_compaction(file_path) as locked:
+        if not locked:
+            return
+        with lock_manifest(file_path):
+            segments = read_manifest(file_path)["segments"]
+        if not segments:
+            return
+
+        utils.logger.info(f"Merging {len(segments)} segment(s) in {file_path}")
+        new_file = file_path + ".compact.tmp"
+        if os.path.exists(new_file):
+            os.remove(new_file)
+        # files as of now, not looking at segments registered later
+        write(get_files(file_path, segments), new_file)
+        # segments listed here are skipped by readers even if still registered (e.g. after a crash below)
+        with HDFStore(new_file, mode="a") as store:
+            store.root._v_attrs.compacted_segments = segments
+        os.replace(new_file, file_path)
+
+        with lock_manifest(file_path):
+            manifest = read_manifest(file_path)
+            manifest["segments"] = [
+                segment for segment in manifest["segments"] if segment not in segments
+            ]
+            write_manifest(file_path, manifest)
+        folder = os.path.dirname(file_path)
+        for segment in segments:
+            os.remove(os.path.join(folder, segment))
+
+
+def write_keys(files: list, new_file: str, merge):
+    """
+    Write the keys visible in a '.hdf' file and its segments (files, oldest first) in a new file, see compact().
+
+    merge: function merging the parts of a key, merge(stores, key_name) -> DataFrame
+    Keys are written in the format and with the compression of their last part.
+    """
+    with open_stores(files) as stores, HDFStore(new_file, mode="w") as store:
+        for key_name in sorted(get_keys(stores)):
+            storer = get_key_stores(stores, key_name)[-1].get_storer(key_name)
+            filters = next(storer.group._f_walknodes("Leaf")).filters
+            options = {"complevel": filters.complevel, "complib": filters.complib}
+            df = merge(stores, key_name)
+            if storer.is_table:
+                store.append(
+                    key_name,
+                    df,
+                    data_columns=storer.data_columns or None,
+                    **options,
+                )
+            else:
+                store.put(key_name, df, **options)
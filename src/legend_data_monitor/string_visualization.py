@@ -11,13 +11,19 @@ import seaborn as sns
 from matplotlib.backends.backend_pdf import PdfPages
 from pandas import DataFrame, Timedelta, concat
 
-from . import plotting, utils
+from . import binning, plotting, utils
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # CHANNELS' STATUS FUNCTION
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-def status_plot(subsystem, data_analysis: DataFrame, plot_info: dict, pdf: PdfPages):
+def status_plot(
+    subsystem,
+    data_analysis: DataFrame,
+    plot_info: dict,
+    pdf: PdfPages,
+    time_bins: dict = None,
+):
     # -------------------------------------------------------------------------
     # plot a map with statuses of channels
     # -------------------------------------------------------------------------
@@ -25,7 +31,12 @@ def status_plot(subsystem, data_analysis: DataFrame, plot_info: dict, pdf: PdfPa
     utils.logger.info("\33[95m~~~ S T A T U S  M A P : %s\33[0m", plot_info["title"])
     utils.logger.info("\33[95m~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\33[0m")
 
-    data_analysis = data_analysis.sort_values(["location", "position"])
+    # data as plotted (binned values are shared with the plots of the same data)
+    data_to_bin = data_analysis
+    # channel map info are joined only here (see utils.add_channel_info())
+    data_analysis = utils.add_channel_info(
+        data_analysis, subsystem.channel_map
+    ).sort_values(["location", "position"])
 
     # get threshold values
     low_thr = plot_info["limits"][0]
@@ -65,6 +76,12 @@ def status_plot(subsystem, data_analysis: DataFrame, plot_info: dict, pdf: PdfPa
         utils.logger.debug("... there are no thresholds to check for. We skip this!")
         return
 
+    # values of all channels binned in the time window, on a common grid (see binning.py)
+    if not plot_info["parameter"] == "event_rate":
+        time_bins = binning.get_bins(
+            data_to_bin, plot_info["time_window"], plot_info["parameter"], time_bins
+        )
+
     new_dataframe = DataFrame()
     # loop over individual channels (otherwise, the problematic timestamps apply to all detectors, even the OK ones) and create a summary dataframe
     for channel in data_analysis["channel"].unique():
@@ -76,12 +93,9 @@ def status_plot(subsystem, data_analysis: DataFrame, plot_info: dict, pdf: PdfPa
         position = (data_per_ch["position"].unique())[0]
         # if not the event rate, study the status looking at the resample values
         if not plot_info["parameter"] == "event_rate":
-            data_per_ch = (
-                data_per_ch.set_index("datetime")
-                .resample(plot_info["time_window"], origin="start")
-                .mean(numeric_only=True)
+            data_per_ch = binning.get_channel_bins(time_bins, channel).rename(
+                columns={"mean": plot_info["parameter"]}
             )
-            data_per_ch = data_per_ch.reset_index()
             data_per_ch["datetime"] = (
                 data_per_ch["datetime"] + Timedelta(plot_info["time_window"]) / 2
             )
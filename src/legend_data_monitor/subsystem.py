@@ -6,10 +6,9 @@ from typing import Union
 
 import numpy as np
 import pandas as pd
-from legendmeta import JsonDB
 from pygama.flow import DataLoader
 
-from . import utils
+from . import cache, direct_loader, jagged, metadata, utils
 
 list_of_str = list[str]
 tuple_of_str = tuple[str]
@@ -30,6 +29,17 @@ class Subsystem:
             - 'path' [str]: path to prod-ref folder (before version)
             - 'version' [str]: version of pygama data processing format vXX.XX
             - 'type' [str]: 'phy' or 'cal'
+            - 'cache' [str or dict] (optional): directory of a local cache of loaded columns, or dict with 'path' and 'max_size' (e.g. '50GB')
+            - 'loader' [str] (optional): 'dataloader' (default) to load data with pygama DataLoader, 'direct' to read LH5 columns directly in parallel
+            - 'processes' [int] (optional): number of processes used by the 'direct' loader (default: number of CPUs)
+            - 'catalog' [str] (optional): path to the sqlite catalog of production files used to resolve runs and timestamps,
+                kept among sessions (default: in-memory catalog, files are listed again in each session)
+            - 'coincidence_tolerance' [float or str] (optional): max time difference for an event to be flagged as pulser/FC baseline/muon event,
+                in seconds or as string with unit (e.g. '1us'); default is 0 (exact match)
+            - 'prefetch' [int or dict] (optional): number of bunches of files loaded in background when inspecting data in bunches (default: 0, disabled),
+                or dict with 'depth' and 'max_memory' (e.g. '8GB')
+            - 'output' [dict] (optional): format of the saved hdf files, with keys 'compression' (e.g. 'blosc:zstd'), 'complevel' (1-9),
+                'expected_rows' (to size chunks) and 'float32' (True, or list of parameters stored in single precision)
             - the following key(s) depending in time selection
                 1. 'start' : <start datetime>, 'end': <end datetime> where <datetime> input is of format 'YYYY-MM-DD hh:mm:ss'
                 2. 'window' [str]: time window in the past from current time point, format: 'Xd Xh Xm' for days, hours, minutes
@@ -85,6 +95,32 @@ class Subsystem:
         self.path = data_info["path"]
         self.version = data_info["version"]
 
+        # optional local cache of loaded columns, either "cache": "<path>" or "cache": {"path": ..., "max_size": ...}
+        self.cache = None
+        if "cache" in data_info:
+            self.cache = (
+                cache.ColumnCache(**data_info["cache"])
+                if isinstance(data_info["cache"], dict)
+                else cache.ColumnCache(data_info["cache"])
+            )
+
+        # backend used to read LH5 files: pygama DataLoader (default) or direct column reader
+        self.loader = data_info.get("loader", "dataloader")
+        if self.loader not in ["dataloader", "direct"]:
+            utils.logger.error(
+                "\033[91mInvalid loader '%s'. Choose between 'dataloader' and 'direct'.\033[0m",
+                self.loader,
+            )
+            sys.exit()
+        # number of processes reading files in parallel with the direct loader (None = number of CPUs)
+        self.processes = data_info.get("processes")
+        # max time difference for two events to be in coincidence when flagging pulser/FC baseline/muon events, in ns
+        self.coincidence_tolerance = utils.get_ns_duration(
+            data_info.get("coincidence_tolerance", 0)
+        )
+        # format options of the hdf files of monitored parameters (compression, chunking, float32)
+        self.output = data_info.get("output", {})
+
         # data stored under these folders have been partitioned!
         if "tmp-auto" != self.path:
             self.partition = True
@@ -117,29 +153,13 @@ class Subsystem:
 
         parameters: single parameter or list of parameters to load.
             If empty, only default parameters will be loaded (channel, timestamp; baseline and wfmax for pulser)
-        """
-        utils.logger.info("... getting data")
 
-        # -------------------------------------------------------------------------
-        # Set up DataLoader config
-        # -------------------------------------------------------------------------
-        utils.logger.info("...... setting up DataLoader")
-
-        # --- construct list of parameters for the data loader
-        # depending on special parameters, k lines etc.
-        params_for_dataloader = self.get_parameters_for_dataloader(parameters)
-
-        # --- set up DataLoader config
-        # needs to know path and version from data_info
-        dlconfig, dbconfig = self.construct_dataloader_configs(params_for_dataloader)
-
-        # --- set up DataLoader
-        dl = DataLoader(dlconfig, dbconfig)
-
-        # -------------------------------------------------------------------------
-        # Set up query
-        # -------------------------------------------------------------------------
+        To load several subsystems reading the files only once, use get_shared_data() instead.
+        """
+        get_shared_data({self.type: self}, {self.type: parameters})
 
+    def get_query(self) -> str:
+        """Build the DataLoader query selecting files in the time range and of the data type of interest."""
         # if querying by run, time word is 'run'; otherwise 'timestamp'; is the key of the timerange dict
         time_word = list(self.timerange.keys())[0]
 
@@ -164,14 +184,44 @@ class Subsystem:
         # )
         query += f" and (type == '{self.datatype}')"
 
-        # !!!! QUICKFIX
-        # p02 keys (missing ch068)
-        query += " and (timestamp != '20230125T222013Z')"
-        query += " and (timestamp != '20230126T015308Z')"
-        query += " and (timestamp != '20230222T231553Z')"
+        # skip faulty files listed in settings/remove-files.json, so that they are never opened
+        query += "".join(
+            f" and (timestamp != '{key}')" for key in utils.get_removed_files()
+        )
+
+        return query
+
+    def load_data(
+        self, params_for_dataloader: list_of_str, channels: list, hit_channels=None
+    ):
+        """
+        Load given parameters for given channels with DataLoader, for the dataset of this subsystem.
+
+        hit_channels: channels to load hit tier parameters for, if not all of them have it (see construct_dataloader_configs)
+
+        Returns the loaded DataFrame and the name of the column containing the channel of each row.
+        """
+        # -------------------------------------------------------------------------
+        # Set up DataLoader config
+        # -------------------------------------------------------------------------
+        utils.logger.info("...... setting up DataLoader")
+
+        # --- set up DataLoader config
+        # needs to know path and version from data_info
+        dlconfig, dbconfig = self.construct_dataloader_configs(
+            params_for_dataloader, channels, hit_channels
+        )
+
+        # --- set up DataLoader
+        dl = DataLoader(dlconfig, dbconfig)
+
+        # -------------------------------------------------------------------------
+        # Set up query
+        # -------------------------------------------------------------------------
+        query = self.get_query()
 
         utils.logger.info(
-            "...... querying DataLoader (includes quickfix-removed faulty files)"
+            "...... querying DataLoader (faulty files in settings/remove-files.json are skipped)"
         )
         utils.logger.info(query)
 
@@ -184,25 +234,39 @@ class Subsystem:
         dl.set_output(fmt="pd.DataFrame", columns=params_for_dataloader)
 
         now = datetime.now()
-        self.data = dl.load()
+        # only columns not yet in the cache (if any) are read from the LH5 files
+        data = (
+            cache.load_with_cache(dl, self.cache, self.read_files)
+            if self.cache
+            else self.read_files(dl)
+        )
         utils.logger.info(f"Total time to load data: {(datetime.now() - now)}")
 
+        # the (only) level of the DataLoader gives the name of the channel column, e.g. 'pht_table'
+        level = list(dlconfig["levels"].keys())[0]
+
+        return data, f"{level}_table"
+
+    def read_files(self, dl: DataLoader) -> pd.DataFrame:
+        """Read data of a DataLoader with files and output already set, with the loader backend of choice."""
+        if self.loader == "direct":
+            return direct_loader.load_direct(dl, self.processes)
+        return dl.load()
+
+    def prime_data(self, data: pd.DataFrame, table_column: str = "channel"):
+        """
+        "Prime" loaded data to be ready for analysis: add datetime, flag events if this is an auxiliary subsystem.
+
+        data: DataFrame with the channel of each row in column table_column, 'timestamp' and the loaded parameters
+        """
         # -------------------------------------------------------------------------
         # polish things up
         # -------------------------------------------------------------------------
 
-        tier = "dsp"
-        if "hit" in dbconfig["columns"]:
-            tier = "hit"
-        if self.partition and "pht" in dbconfig["columns"]:
-            tier = "pht"
-        if self.partition and "psp" in dbconfig["columns"]:
-            tier = "psp"
-        # remove columns we don't need
-        if "{tier}_idx" in list(self.data.columns):
-            self.data = self.data.drop([f"{tier}_idx", "file"], axis=1)
         # rename channel to channel
-        self.data = self.data.rename(columns={f"{tier}_table": "channel"})
+        self.data = data.rename(columns={table_column: "channel"})
+        # list-valued parameters (e.g. SiPM energies) as flat values + offsets, instead of one list per row
+        self.data = jagged.convert_lists(self.data)
 
         # -------------------------------------------------------------------------
         # create datetime column based on initial key and timestamp
@@ -214,24 +278,9 @@ class Subsystem:
         )
         self.data = self.data.drop("timestamp", axis=1)
 
-        # -------------------------------------------------------------------------
-        # add detector name, location and position from map
-        # -------------------------------------------------------------------------
-
-        utils.logger.info("... mapping to name and string/fiber position")
-        self.data = self.data.set_index("channel")
-        # expand channel map index to match that of data with repeating channels
-        ch_map_reindexed = self.channel_map.set_index("channel").reindex(
-            self.data.index
-        )
-        # append the channel map columns to the data
-        self.data = pd.concat([self.data, ch_map_reindexed], axis=1)
-        self.data = self.data.reset_index()
-        # stupid dataframe, why float
-        for col in ["location", "position"]:
-            # ignore string values for fibers ('I/OB-XXX-XXX') and positions ('top/bottom') for SiPMs
-            if isinstance(self.data[col].iloc[0], float):
-                self.data[col] = self.data[col].astype(int)
+        # channel map info (name, location, position, ...) are not added to each row:
+        # data keep only channel, datetime and parameters, and channel map info
+        # are joined from self.channel_map when plotting (see utils.add_channel_info())
 
         # -------------------------------------------------------------------------
         # if this subsystem is pulser, flag pulser timestamps
@@ -244,12 +293,14 @@ class Subsystem:
         if self.type == "muon":
             self.flag_muon_events()
 
-    def include_aux(
-        self, params: Union[str, list], dataset: dict, plot: dict, aux_ch: str
-    ):
-        """Include in a new column data coming from PULS01ANA aux channel, to either compute a ratio or a difference with data coming from the inspected subsystem."""
-        # auxiliary channel of reference (fixed for the moment)
-        aux_channel = "pulser01ana"
+    def include_aux(self, params: Union[str, list], plot: dict, aux_subsys):
+        """
+        Include in a new column data coming from PULS01ANA aux channel, to either compute a ratio or a difference with data coming from the inspected subsystem.
+
+        aux_subsys: Subsystem object of the AUX channel, already containing data for the needed parameters (see utils.get_aux_parameters)
+        """
+        # auxiliary channel of reference (fixed for the moment), used as suffix for new columns
+        aux_ch = "pulser01ana"
         # both options (diff and ratio) are present -> BAD! For this parameter we do not subtract/divide for any AUX entry
         if "AUX_ratio" in plot.keys() and "AUX_diff" in plot.keys():
             utils.logger.error(
@@ -274,11 +325,6 @@ class Subsystem:
         )
 
         def add_aux(param):
-            aux_subsys = Subsystem(aux_channel, dataset=dataset)
-            # get data for these parameters and time range given in the dataset
-            # (if no parameters given to plot, baseline and wfmax will always be loaded to flag pulser events anyway)
-            aux_subsys.get_data(param)
-
             # Merge the dataframes based on the 'datetime' column
             utils.logger.debug(
                 "... merging the PULS01ANA dataframe with the original one"
@@ -322,8 +368,8 @@ class Subsystem:
                     params,
                 )
                 return
-            if f"{param}_{aux_channel}" not in list(self.data.columns):
-                add_aux(params)
+            if f"{param}_{aux_ch}" not in list(self.data.columns):
+                add_aux(param)
 
         # multiple-parameters case
         if isinstance(params, list) and len(params) > 1:
@@ -342,77 +388,58 @@ class Subsystem:
                         param,
                     )
                     continue
-                if f"{param}_{aux_channel}" not in list(self.data.columns):
-                    add_aux(params)
+                if f"{param}_{aux_ch}" not in list(self.data.columns):
+                    add_aux(param)
 
-    def flag_pulser_events(self, pulser=None):
-        """Flag pulser events. If a pulser object was provided, flag pulser events in data based on its flag."""
-        utils.logger.info("... flagging pulser events")
+    def flag_events(self, pulser=None, fc_bsln=None, muon=None):
+        """
+        Flag pulser, FC baseline and muon events in data, in one pass, based on the flags of the provided pulser, FC baseline and muon objects.
 
-        # --- if a pulser object was provided, flag pulser events in data based on its flag
-        if pulser:
-            try:
-                pulser_timestamps = pulser.data[pulser.data["flag_pulser"]][
-                    "datetime"
-                ]  # .set_index('datetime').index
-                self.data["flag_pulser"] = False
-                self.data = self.data.set_index("datetime")
-                self.data.loc[pulser_timestamps, "flag_pulser"] = True
-            except KeyError:
-                utils.logger.warning(
-                    "\033[93mWarning: cannot flag pulser events, timestamps don't match!\n \
-                    If you are you looking at calibration data, it's not possible to flag pulser events in it this way.\n \
-                    Contact the developers if you would like them to focus on advanced flagging methods.\033[0m"
-                )
+        Events are flagged if they are within the coincidence tolerance of a flagged event of the given object (exact match by default).
+        Only the flags of the provided objects are (re)computed.
+        """
+        # int64 nanoseconds, computed once for all flags
+        times = utils.get_ns(self.data["datetime"])
+        for flag, name, aux_subsys in [
+            ("flag_pulser", "pulser", pulser),
+            ("flag_fc_bsln", "FC baseline", fc_bsln),
+            ("flag_muon", "muon", muon),
+        ]:
+            if not aux_subsys:
+                continue
+            utils.logger.info(f"... flagging {name} events")
+            flagged = aux_subsys.data["datetime"][aux_subsys.data[flag]]
+            self.data[flag] = utils.get_coincidences(
+                times, utils.get_ns(flagged), self.coincidence_tolerance
+            )
+            if len(flagged) and not self.data[flag].any():
                 utils.logger.warning(
-                    "\033[93m! Proceeding without pulser flag !\033[0m"
+                    "\033[93mWarning: no %s event was found in coincidence with data! Try to increase 'coincidence_tolerance' in config['dataset'].\033[0m",
+                    name,
                 )
 
+    def flag_pulser_events(self, pulser=None):
+        """Flag pulser events. If a pulser object was provided, flag pulser events in data based on its flag."""
+        # --- if a pulser object was provided, flag pulser events in data based on its flag
+        if pulser:
+            self.flag_events(pulser=pulser)
         else:
+            utils.logger.info("... flagging pulser events")
             # --- if no object was provided, it's understood that this itself is a pulser
-            trapTmax = self.data["trapTmax"]
-            pulser_timestamps = self.data[trapTmax > 200].index
-            # flag them
-            self.data["flag_pulser"] = False
-            self.data.loc[pulser_timestamps, "flag_pulser"] = True
-
-        self.data = self.data.reset_index()
+            self.data["flag_pulser"] = (self.data["trapTmax"] > 200).to_numpy()
 
     def flag_fcbsln_events(self, fc_bsln=None):
         """Flag FC baseline events, keeping the ones that are in correspondence with a pulser event too. If a FC baseline object was provided, flag FC baseline events in data based on its flag."""
-        utils.logger.info("... flagging FC baseline events")
-
         # --- if a FC baseline object was provided, flag FC baseline events in data based on its flag
         if fc_bsln:
-            try:
-                fc_bsln_timestamps = fc_bsln.data[fc_bsln.data["flag_fc_bsln"]][
-                    "datetime"
-                ]  # .set_index('datetime').index
-                self.data["flag_fc_bsln"] = False
-                self.data = self.data.set_index("datetime")
-                self.data.loc[fc_bsln_timestamps, "flag_fc_bsln"] = True
-            except KeyError:
-                utils.logger.warning(
-                    "\033[93mWarning: cannot flag FC baseline events, timestamps don't match!\n \
-                    If you are you looking at calibration data, it's not possible to flag FC baseline events in it this way.\n \
-                    Contact the developers if you would like them to focus on advanced flagging methods.\033[0m"
-                )
-                utils.logger.warning(
-                    "\033[93m! Proceeding without FC baseline flag !\033[0m"
-                )
-
+            self.flag_events(fc_bsln=fc_bsln)
         else:
+            utils.logger.info("... flagging FC baseline events")
             # --- if no object was provided, it's understood that this itself is a FC baseline
             # find timestamps over threshold
             high_thr = 3000
-            self.data = self.data.set_index("datetime")
             wf_max_rel = self.data["wf_max"] - self.data["baseline"]
-            fc_bsln_timestamps = self.data[wf_max_rel > high_thr].index
-            # flag them
-            self.data["flag_fc_bsln"] = False
-            self.data.loc[fc_bsln_timestamps, "flag_fc_bsln"] = True
-
-        self.data = self.data.reset_index()
+            self.data["flag_fc_bsln"] = (wf_max_rel > high_thr).to_numpy()
 
     def flag_fcbsln_only_events(self, fc_bsln=None):
         """Flag FC baseline events. If a FC baseline object was provided, flag FC baseline events in data based on its flag."""
@@ -433,37 +460,16 @@ class Subsystem:
 
     def flag_muon_events(self, muon=None):
         """Flag muon events. If a muon object was provided, flag muon events in data based on its flag."""
-        utils.logger.info("... flagging muon events")
-
         # --- if a muon object was provided, flag muon events in data based on its flag
         if muon:
-            try:
-                muon_timestamps = muon.data[muon.data["flag_muon"]][
-                    "datetime"
-                ]  # .set_index('datetime').index
-                self.data["flag_muon"] = False
-                self.data = self.data.set_index("datetime")
-                self.data.loc[muon_timestamps, "flag_muon"] = True
-            except KeyError:
-                utils.logger.warning(
-                    "\033[93mWarning: cannot flag muon events, timestamps don't match!\n \
-                    If you are you looking at calibration data, it's not possible to flag muon events in it this way.\n \
-                    Contact the developers if you would like them to focus on advanced flagging methods.\033[0m"
-                )
-                utils.logger.warning("\033[93m! Proceeding without muon flag !\033[0m")
-
+            self.flag_events(muon=muon)
         else:
+            utils.logger.info("... flagging muon events")
             # --- if no object was provided, it's understood that this itself is a muon
             # find timestamps over threshold
             high_thr = 500
-            self.data = self.data.set_index("datetime")
             wf_max_rel = self.data["wf_max"] - self.data["baseline"]
-            muon_timestamps = self.data[wf_max_rel > high_thr].index
-            # flag them
-            self.data["flag_muon"] = False
-            self.data.loc[muon_timestamps, "flag_muon"] = True
-
-        self.data = self.data.reset_index()
+            self.data["flag_muon"] = (wf_max_rel > high_thr).to_numpy()
 
     def get_channel_map(self):
         """
@@ -484,13 +490,11 @@ class Subsystem:
         map_file = os.path.join(
             self.path, self.version, "inputs/hardware/configuration/channelmaps"
         )
-        full_channel_map = JsonDB(map_file).on(timestamp=self.first_timestamp)
-
-        df_map = pd.DataFrame(columns=utils.COLUMNS_TO_LOAD)
-        df_map = df_map.set_index("channel")
+        # one row per channel map entry, parsed once and shared by all subsystems
+        channel_table = metadata.get_channel_table(map_file, self.first_timestamp)
 
         # -------------------------------------------------------------------------
-        # helper function to determine which channel map entry belongs to this subsystem
+        # helper function to determine which channel map entries belong to this subsystem
         # -------------------------------------------------------------------------
 
         # for L60-p01 and L200-p02, keep using 'fcid' as channel
@@ -500,22 +504,22 @@ class Subsystem:
         if int(self.period.split("p")[-1]) >= 3:
             ch_flag = "rawid"
 
-        # dct_key is the subdict corresponding to one chmap entry
-        def is_subsystem(entry):
+        # table is the channel map table, returns a mask of its entries
+        def is_subsystem(table):
             # special case for pulser
             if self.type == "pulser":
                 if self.experiment == "L60":
-                    return entry["system"] == "auxs" and entry["daq"]["fcid"] == 0
+                    return (table["system"] == "auxs") & (table["fcid"] == 0)
                 if self.experiment == "L200":
                     # we get PULS01
                     if self.below_period_3_excluded():
-                        return entry["system"] == "puls" and entry["daq"][ch_flag] == 1
+                        return (table["system"] == "puls") & (table[ch_flag] == 1)
                     # we get PULS01ANA
                     if self.above_period_3_included():
                         return (
-                            entry["system"] == "puls"
-                            # and entry["daq"][ch_flag] == 1027203
-                            and entry["daq"][ch_flag] == 1027201
+                            (table["system"] == "puls")
+                            # & (table[ch_flag] == 1027203)
+                            & (table[ch_flag] == 1027201)
                         )
             # special case for pulser AUX
             if self.type == "pulser01ana":
@@ -526,38 +530,35 @@ class Subsystem:
                     exit()
                 if self.experiment == "L200":
                     if self.below_period_3_excluded():
-                        return entry["system"] == "puls" and entry["daq"][ch_flag] == 3
+                        return (table["system"] == "puls") & (table[ch_flag] == 3)
                     if self.above_period_3_included():
-                        return (
-                            entry["system"] == "puls"
-                            and entry["daq"][ch_flag] == 1027203
+                        return (table["system"] == "puls") & (
+                            table[ch_flag] == 1027203
                         )
             # special case for baseline
             if self.type == "FCbsln":
                 if self.experiment == "L60":
-                    return entry["system"] == "auxs" and entry["daq"]["fcid"] == 0
+                    return (table["system"] == "auxs") & (table["fcid"] == 0)
                 if self.experiment == "L200":
                     if self.below_period_3_excluded():
-                        return entry["system"] == "bsln" and entry["daq"][ch_flag] == 0
+                        return (table["system"] == "bsln") & (table[ch_flag] == 0)
                     if self.above_period_3_included():
-                        return (
-                            entry["system"] == "bsln"
-                            and entry["daq"][ch_flag] == 1027200
+                        return (table["system"] == "bsln") & (
+                            table[ch_flag] == 1027200
                         )
             # special case for muon channel
             if self.type == "muon":
                 if self.experiment == "L60":
-                    return entry["system"] == "auxs" and entry["daq"]["fcid"] == 1
+                    return (table["system"] == "auxs") & (table["fcid"] == 1)
                 if self.experiment == "L200":
                     if self.below_period_3_excluded():
-                        return entry["system"] == "auxs" and entry["daq"][ch_flag] == 2
+                        return (table["system"] == "auxs") & (table[ch_flag] == 2)
                     if self.above_period_3_included():
-                        return (
-                            entry["system"] == "auxs"
-                            and entry["daq"][ch_flag] == 1027202
+                        return (table["system"] == "auxs") & (
+                            table[ch_flag] == 1027202
                         )
             # for geds or spms
-            return entry["system"] == self.type
+            return table["system"] == self.type
 
         # name of location in the channel map
         loc_code = {"geds": "string", "spms": "fiber"}
@@ -569,67 +570,43 @@ class Subsystem:
         special_systems = utils.SPECIAL_SYSTEMS
 
         # -------------------------------------------------------------------------
-        # loop over entries and find out subsystem
+        # slice entries of this subsystem
         # -------------------------------------------------------------------------
 
-        # config.channel_map is already a dict read from the channel map json
-        for entry in full_channel_map:
-            # skip dummy channels
-            if "BF" in entry or "DUMMY" in entry:
-                continue
-
-            entry_info = full_channel_map[entry]
-
-            # skip if this is not our system
-            if not is_subsystem(entry_info):
-                continue
+        # skip dummy channels
+        is_dummy = channel_table.index.str.contains("BF|DUMMY")
+        entries = channel_table[~is_dummy & is_subsystem(channel_table).to_numpy()]
 
-            # --- add info for this channel - Raw/FlashCam ID, unique for geds/spms/pulser/pulser01ana/FCbsln/muon
-            ch = entry_info["daq"][ch_flag]
-
-            df_map.at[ch, "name"] = entry_info["name"]
-            # number/name of string/fiber for geds/spms, dummy for pulser/pulser01ana/FCbsln/muon
-            df_map.at[ch, "location"] = (
-                special_systems[self.type]
-                if self.type in special_systems
-                else entry_info["location"][loc_code[self.type]]
-            )
-            # position in string/fiber for geds/spms, dummy for pulser/pulser01ana/FCbsln/muon
-            df_map.at[ch, "position"] = (
-                special_systems[self.type]
-                if self.type in special_systems
-                else entry_info["location"]["position"]
-            )
-            # CC4 information - will be None for L60 (set to 'null') or spms (there, but no CC4s)
-            df_map.at[ch, "cc4_id"] = (
-                entry_info["electronics"]["cc4"]["id"] if self.type == "geds" else None
-            )
-            df_map.at[ch, "cc4_channel"] = (
-                entry_info["electronics"]["cc4"]["channel"]
-                if self.type == "geds"
-                else None
-            )
-            # DAQ information - present even in L60 and spms
-            df_map.at[ch, "daq_crate"] = entry_info["daq"]["crate"]
-            df_map.at[ch, "daq_card"] = entry_info["daq"]["card"]["id"]
-            # voltage = not for pulser/spms (just daq and electronics)
-            df_map.at[ch, "HV_card"] = (
-                entry_info["voltage"]["card"]["id"] if self.type == "geds" else None
-            )
-            df_map.at[ch, "HV_channel"] = (
-                entry_info["voltage"]["channel"] if self.type == "geds" else None
-            )
-            # detector type for geds (based on channel's name)
-            if self.type == "geds":
-                df_map.at[ch, "det_type"] = (
-                    type_code[entry_info["name"][0]]
-                    if entry_info["name"][0] in type_code.keys()
-                    else None
-                )
-            else:
-                df_map.at[ch, "det_type"] = None
-
-        df_map = df_map.reset_index()
+        # --- add info for these channels - Raw/FlashCam ID, unique for geds/spms/pulser/pulser01ana/FCbsln/muon
+        df_map = pd.DataFrame(
+            {"channel": list(entries[ch_flag]), "name": list(entries["name"])},
+            columns=["channel"]
+            + [col for col in utils.COLUMNS_TO_LOAD if col != "channel"],
+            dtype=object,
+        )
+        df_map["channel"] = df_map["channel"].astype(int)
+        if self.type in special_systems:
+            # dummy location/position for pulser/pulser01ana/FCbsln/muon
+            df_map["location"] = special_systems[self.type]
+            df_map["position"] = special_systems[self.type]
+        else:
+            # number/name of string/fiber and position in string/fiber for geds/spms
+            df_map["location"] = list(entries[loc_code[self.type]])
+            df_map["position"] = list(entries["position"])
+        # CC4 information and voltage - not for L60 (set to 'null'), pulser or spms
+        for col in ["cc4_id", "cc4_channel", "HV_card", "HV_channel"]:
+            df_map[col] = list(entries[col]) if self.type == "geds" else None
+        # DAQ information - present even in L60 and spms
+        df_map["daq_crate"] = list(entries["daq_crate"])
+        df_map["daq_card"] = list(entries["daq_card"])
+        # detector type for geds (based on channel's name)
+        df_map["det_type"] = [
+            (type_code.get(name[0]) if self.type == "geds" else None)
+            for name in entries["name"]
+        ]
+        df_map = df_map.astype(
+            {col: object for col in utils.COLUMNS_TO_LOAD if col != "channel"}
+        )
 
         # -------------------------------------------------------------------------
         # stupid dataframe, can use dtype somehow to fix it?
@@ -665,8 +642,8 @@ class Subsystem:
         # -------------------------------------------------------------------------
 
         map_file = os.path.join(self.path, self.version, "inputs/dataprod/config")
-        full_status_map = JsonDB(map_file).on(
-            timestamp=self.first_timestamp, system=self.datatype
+        full_status_map = metadata.get_on(
+            map_file, self.first_timestamp, system=self.datatype
         )["analysis"]
 
         # AUX channels are not in status map, so at least for pulser/pulser01ana/FCbsln/muon need default on
@@ -674,9 +651,9 @@ class Subsystem:
 
         self.channel_map = self.channel_map.set_index("name")
         # 'channel_name' has the format 'DNNXXXS' (= "name" column)
-        for channel_name in full_status_map:
-            # status map contains all channels, check if this channel is in our subsystem
-            if channel_name in self.channel_map.index:
+        # status map contains all channels, only look up the ones of our subsystem
+        for channel_name in self.channel_map.index:
+            if channel_name in full_status_map:
                 self.channel_map.at[channel_name, "status"] = full_status_map[
                     channel_name
                 ]["usability"]
@@ -727,11 +704,35 @@ class Subsystem:
         # some parameters might be repeated twice - remove
         return list(np.unique(params))
 
-    def construct_dataloader_configs(self, params: list_of_str):
+    def get_channels_to_load(self) -> list:
+        """Get list of channels to load, i.e. the ones with status on or ac."""
+        # only load channels that are on or ac
+        chlist = list(
+            self.channel_map[
+                (self.channel_map["status"] == "on")
+                | (self.channel_map["status"] == "ac")
+            ]["channel"]
+        )
+        # remove off channels
+        removed_chs = list(
+            self.channel_map[self.channel_map["status"] == "off"]["name"]
+        )
+        utils.logger.info(
+            f"...... {self.type}: not loading channels with status off: {removed_chs}"
+        )
+
+        return chlist
+
+    def construct_dataloader_configs(
+        self, params: list_of_str, channels=None, hit_channels=None
+    ):
         """
         Construct DL and DB configs for DataLoader based on parameters and which tiers they belong to.
 
         params: list of parameters to load
+        channels: list of channels to load; if None, channels of this subsystem with status on or ac
+        hit_channels: list of channels to load from the hit tier, if different from channels
+            (AUX channels, for instance, have no hit tier)
         """
         # -------------------------------------------------------------------------
         # which parameters belong to which tiers
@@ -773,18 +774,8 @@ class Subsystem:
         # set up tiers depending on what parameters we need
         # -------------------------------------------------------------------------
 
-        # only load channels that are on or ac
-        chlist = list(
-            self.channel_map[
-                (self.channel_map["status"] == "on")
-                | (self.channel_map["status"] == "ac")
-            ]["channel"]
-        )
-        # remove off channels
-        removed_chs = list(
-            self.channel_map[self.channel_map["status"] == "off"]["name"]
-        )
-        utils.logger.info(f"...... not loading channels with status off: {removed_chs}")
+        chlist = self.get_channels_to_load() if channels is None else channels
+        hit_chlist = chlist if hit_channels is None else hit_channels
 
         # for L60-p01 and L200-p02, keep using 3 digits
         if int(self.period.split("p")[-1]) < 3:
@@ -814,7 +805,9 @@ class Subsystem:
             else:
                 dict_dbconfig["table_format"][tier] += tier
 
-            dict_dbconfig["tables"][tier] = chlist
+            dict_dbconfig["tables"][tier] = (
+                hit_chlist if tier in ["hit", "pht"] else chlist
+            )
 
             dict_dbconfig["columns"][tier] = list(tier_params["param"])
 
@@ -837,43 +830,40 @@ class Subsystem:
             "tier"
         ].iloc[0]
         # format {"hit": {"tiers": ["dsp", "hit"]}}
+        # lowest tier first: DataLoader takes the list of tables from it, and channels without hit tier (e.g. AUX) only have dsp
         dict_dlconfig["levels"][max_tier] = {
-            "tiers": list(param_tiers["tier"].unique())
+            "tiers": list(param_tiers.sort_values("order")["tier"].unique())
         }
 
         return dict_dlconfig, dict_dbconfig
 
-    def remove_timestamps(self, remove_keys: dict):
+    def remove_timestamps(self, remove_intervals: dict = None):
         """Remove timestamps from the dataframes for a given channel.
 
-        The time interval in which to remove the channel is provided through an external json file.
+        The time interval in which to remove the channel is provided through an external json file (settings/remove-keys.json).
+
+        remove_intervals: intervals to remove for each detector, as compiled by utils.get_remove_intervals() (default: the ones of the json file)
         """
+        if remove_intervals is None:
+            remove_intervals = utils.get_remove_intervals()
+
         # all timestamps we are considering are expressed in UTC0
         utils.logger.debug("... removing timestamps from the following detectors:")
 
-        # loop over channels for which we want to remove timestamps
-        for detector in remove_keys:
-            if detector in self.data["name"].unique():
-                utils.logger.debug(f".... {detector}")
-                # remove timestamps from self.data that are within time_from and time_to, for a given channel
-                for chunk in remove_keys[detector]:
-                    utils.logger.debug(f"from {chunk['from']} to {chunk['to']}")
-                    # times are in format YYYYMMDDTHHMMSSZ, convert them into a UTC0 timestamp
-                    for point in ["from", "to"]:
-                        # convert UTC timestamp to datetime (unix epoch time)
-                        chunk[point] = pd.to_datetime(
-                            chunk[point], utc=True, format="%Y%m%dT%H%M%SZ"
-                        )
-
-                    # entries to drop for this chunk
-                    rows_to_drop = self.data[
-                        (self.data["name"] == detector)
-                        & (self.data["datetime"] >= chunk["from"])
-                        & (self.data["datetime"] <= chunk["to"])
-                    ]
-                    self.data = self.data.drop(rows_to_drop.index)
+        # one mask for all detectors, applied at once
+        to_remove = np.zeros(len(self.data), dtype=bool)
+        times = utils.get_ns(self.data["datetime"])
+        names = self.channel_map.set_index("channel")["name"]
+        for channel, rows in self.data.groupby("channel", sort=False).indices.items():
+            detector = names.get(channel)
+            if detector not in remove_intervals:
+                continue
+            utils.logger.debug(f".... {detector}")
+            to_remove[rows] = utils.is_in_intervals(
+                times[rows], remove_intervals[detector]
+            )
 
-        self.data = self.data.reset_index()
+        self.data = self.data[~to_remove].reset_index()
 
     def below_period_3_excluded(self) -> bool:
         if int(self.period.split("p")[-1]) < 3:
@@ -886,3 +876,66 @@ class Subsystem:
             return True
         else:
             return False
+
+
+# -------------------------------------------------------------------------------
+# shared data loading
+# -------------------------------------------------------------------------------
+
+
+def get_shared_data(subsystems: dict, parameters: dict):
+    """
+    Load data of several subsystems at once, reading each LH5 file a single time.
+
+    subsystems: dict of Subsystem objects with the same dataset, keyed by subsystem name
+    parameters: dict of parameters (single or list) to load for each subsystem, keyed by subsystem name;
+        subsystems without entry get only default parameters
+
+    All columns needed by any subsystem are loaded for all their channels in one DataLoader call;
+    rows are then split by channel, and each subsystem keeps (and primes) only its own columns.
+    """
+    utils.logger.info("... getting data for " + ", ".join(subsystems.keys()))
+
+    # parameters and channels needed by each subsystem
+    params_per_subsystem = {}
+    channels_per_subsystem = {}
+    for name, subsys in subsystems.items():
+        params_per_subsystem[name] = subsys.get_parameters_for_dataloader(
+            parameters.get(name, ())
+        )
+        channels_per_subsystem[name] = subsys.get_channels_to_load()
+
+    # union of all of them - some parameters/channels might be shared among subsystems
+    all_params = sorted(set(sum(params_per_subsystem.values(), [])))
+    all_channels = sorted(set(sum(channels_per_subsystem.values(), [])))
+    # only channels of subsystems asking for hit parameters are looked for in the hit tier
+    hit_channels = sorted(
+        set(
+            sum(
+                [
+                    channels_per_subsystem[name]
+                    for name, params in params_per_subsystem.items()
+                    if any(utils.PARAMETER_TIERS.get(par) == "hit" for par in params)
+                ],
+                [],
+            )
+        )
+    )
+
+    # all subsystems look at the same dataset, any of them can load it
+    data, table_column = list(subsystems.values())[0].load_data(
+        all_params, all_channels, hit_channels
+    )
+
+    # -------------------------------------------------------------------------
+    # split rows by subsystem
+    # -------------------------------------------------------------------------
+    for name, subsys in subsystems.items():
+        columns = [table_column] + [
+            param for param in params_per_subsystem[name] if param in data.columns
+        ]
+        subsys_data = data.loc[
+            data[table_column].isin(channels_per_subsystem[name]), columns
+        ].reset_index(drop=True)
+        utils.logger.info(f"... priming data for {name}")
+        subsys.prime_data(subsys_data, table_column)
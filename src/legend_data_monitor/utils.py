@@ -1,4 +1,3 @@
-import glob
 import importlib.resources
 import json
 import logging
@@ -9,10 +8,11 @@ import sys
 # for getting DataLoader time range
 from datetime import datetime, timedelta
 
+import numpy as np
 from lgdo import lh5
-from pandas import DataFrame
+from pandas import DataFrame, Timedelta, to_datetime
 
-from . import subsystem
+from . import catalog, subsystem
 
 # -------------------------------------------------------------------------
 
@@ -55,7 +55,7 @@ for param in SPECIAL_PARAMETERS:
 with open(pkg / "settings" / "SC-params.json") as f:
     SC_PARAMETERS = json.load(f)
 
-# load list of columns to load for a dataframe
+# channel map columns (kept in a per-channel table, joined to data only when needed, see add_channel_info())
 COLUMNS_TO_LOAD = [
     "name",
     "location",
@@ -81,15 +81,37 @@ with open(pkg / "settings" / "map-channels.json") as f:
 with open(pkg / "settings" / "remove-keys.json") as f:
     REMOVE_KEYS = json.load(f)
 
+# time intervals of REMOVE_KEYS, compiled once by get_remove_intervals()
+REMOVE_INTERVALS = None
+
 # dictionary with detectors to remove
 with open(pkg / "settings" / "remove-dets.json") as f:
     REMOVE_DETS = json.load(f)
 
+# keys of faulty files (e.g. missing channels) to skip, by period
+with open(pkg / "settings" / "remove-files.json") as f:
+    REMOVE_FILES = json.load(f)
+
 # -------------------------------------------------------------------------
 # Subsystem related functions (for getting channel map & status)
 # -------------------------------------------------------------------------
 
 
+def get_tier_dir(dataset: dict) -> str:
+    """Get the folder of the tier (dsp or psp, depending on the production version) used to look for files and timestamps."""
+    return os.path.join(
+        dataset["path"],
+        dataset["version"],
+        "generated",
+        "tier",
+        (
+            "dsp"
+            if dataset["version"] in ["tmp-auto"] or "ref-v1" in dataset["version"]
+            else "psp"
+        ),
+    )
+
+
 def get_query_times(**kwargs):
     """
     Get time ranges for DataLoader query from user input, as well as first/last timestamp for channel map / status / SC query.
@@ -143,77 +165,35 @@ def get_query_times(**kwargs):
         first_run = min(timerange["run"])
         last_run = max(timerange["run"])
 
-        # --- get dsp filelist of this run
+        # --- get dsp files of these runs from the catalog
         # if setup= keyword was used, get dict; otherwise kwargs is already the dict we need
         path_info = kwargs["dataset"] if "dataset" in kwargs else kwargs
+        file_catalog = catalog.get_catalog(path_info)
+        tier_dir = get_tier_dir(path_info)
 
-        first_glob_path = os.path.join(
-            path_info["path"],
-            path_info["version"],
-            "generated",
-            "tier",
-            (
-                "dsp"
-                if path_info["version"] in ["tmp-auto"]
-                or "ref-v1" in path_info["version"]
-                else "psp"
-            ),
-            path_info["type"],
-            path_info["period"],
-            first_run,
-        )
-        last_glob_path = os.path.join(
-            path_info["path"],
-            path_info["version"],
-            "generated",
-            "tier",
-            (
-                "dsp"
-                if path_info["version"] in ["tmp-auto"]
-                or "ref-v1" in path_info["version"]
-                else "psp"
-            ),
-            path_info["type"],
-            path_info["period"],
-            last_run,
-        )
-
-        if not os.path.exists(first_glob_path):
-            logger.warning(
-                "\033[93mThe path '%s' does not exist, check config['dataset'] and try again.\033[0m",
-                first_glob_path,
-            )
-            exit()
-        if not os.path.exists(last_glob_path):
-            logger.warning(
-                "\033[93mThe path '%s' does not exist, check config['dataset'] and try again.\033[0m",
-                last_glob_path,
-            )
-            exit()
-
-        # format to search /path_to_prod-ref[/vXX.XX]/generated/tier/dsp/phy/pXX/rXXX (version 'vXX.XX' might not be there).
         # NOTICE that we fixed the tier, otherwise it picks the last one it finds (eg tcm).
         # NOTICE that this is PERIOD SPECIFIC (unlikely we're gonna inspect two periods together, so we fix it)
-        first_glob_path = os.path.join(
-            first_glob_path,
-            "*.lh5",
-        )
-        last_glob_path = os.path.join(
-            last_glob_path,
-            "*.lh5",
-        )
-        first_dsp_files = glob.glob(first_glob_path)
-        last_dsp_files = glob.glob(last_glob_path)
-        # find earliest
-        first_dsp_files.sort()
-        first_file = first_dsp_files[0]
-        # find latest
-        last_dsp_files.sort()
-        last_file = last_dsp_files[-1]
-        # extract timestamps
-        first_timestamp = get_key(first_file)
+        files = {}
+        for run in [first_run, last_run]:
+            files[run] = file_catalog.get_files(
+                tier_dir,
+                path_info["type"],
+                path_info["period"],
+                runs=[run],
+                exclude=get_removed_files(),
+            )
+            if not files[run]:
+                logger.warning(
+                    "\033[93mNo files found for run '%s' in '%s', check config['dataset'] and try again.\033[0m",
+                    run,
+                    os.path.join(tier_dir, str(path_info["type"]), path_info["period"]),
+                )
+                exit()
+
+        # extract timestamps: key of the earliest file
+        first_timestamp = files[first_run][0][1]
         # last timestamp is not the key of last file: it's the last timestamp saved in the last file
-        last_timestamp = get_last_timestamp(last_file)
+        last_timestamp = file_catalog.get_last_timestamp(files[last_run][-1][2])
 
     return timerange, first_timestamp, last_timestamp
 
@@ -617,11 +597,6 @@ def get_timestamp(filename):
 
 def get_run_name(config, user_time_range: dict) -> str:
     """Get the run ID given start/end timestamps."""
-    # this is the root directory to search in the timestamps
-    main_folder = os.path.join(
-        config["dataset"]["path"], config["dataset"]["version"], "generated/tier"
-    )
-
     # start/end timestamps of the selected time range of interest
     # if range was given, will have keywords "start" and "end"
     if "start" in user_time_range["timestamp"]:
@@ -632,36 +607,18 @@ def get_run_name(config, user_time_range: dict) -> str:
         start_timestamp = min(user_time_range["timestamp"])
         end_timestamp = max(user_time_range["timestamp"])
 
-    run_list = []  # this will be updated with the run ID
-
-    # start to look for timestamps inside subfolders
-    def search_for_timestamp(folder):
-        run_id = ""
-        for subfolder in os.listdir(folder):
-            subfolder_path = os.path.join(folder, subfolder)
-            if os.path.isdir(subfolder_path):
-                files = sorted(glob.glob(os.path.join(subfolder_path, "*")))
-                for i, file in enumerate(files):
-                    if (
-                        get_timestamp(files[i - 1])
-                        <= start_timestamp
-                        <= get_timestamp(file)
-                    ) or (
-                        get_timestamp(files[i - 1])
-                        <= end_timestamp
-                        <= get_timestamp(file)
-                    ):
-                        run_id = file.split("/")[-2]
-                        run_list.append(run_id)
-                        break
-
-                if len(run_list) == 0:
-                    search_for_timestamp(subfolder_path)
-                else:
-                    break
-        return
-
-    search_for_timestamp(main_folder)
+    # look for the runs containing the timestamps in the file catalog
+    file_catalog = catalog.get_catalog(config["dataset"])
+    run_list = []
+    for timestamp in [start_timestamp, end_timestamp]:
+        run_id = file_catalog.find_run(
+            get_tier_dir(config["dataset"]),
+            config["dataset"]["type"],
+            config["dataset"]["period"],
+            timestamp,
+        )
+        if run_id and run_id not in run_list:
+            run_list.append(run_id)
 
     if len(run_list) == 0:
         logger.error(
@@ -705,6 +662,23 @@ def get_all_plot_parameters(subsystem: str, config: dict):
     return all_parameters
 
 
+def get_aux_parameters(config: dict):
+    """Get list of all parameters needed from the AUX (PULS01ANA) channel, i.e. plotted parameters of any subsystem that are neither special nor from hit tier."""
+    aux_parameters = []
+    for subsystem in config["subsystems"]:
+        for plot in config["subsystems"][subsystem]:
+            parameters = config["subsystems"][subsystem][plot]["parameters"]
+            if isinstance(parameters, str):
+                parameters = [parameters]
+            for param in parameters:
+                if param in SPECIAL_PARAMETERS or PARAMETER_TIERS.get(param) == "hit":
+                    continue
+                if param not in aux_parameters:
+                    aux_parameters.append(param)
+
+    return aux_parameters
+
+
 def get_key(dsp_fname: str) -> str:
     """Extract key from lh5 filename."""
     return re.search(r"-\d{8}T\d{6}Z", dsp_fname).group(0)[1:]
@@ -738,72 +712,36 @@ def bunch_dataset(config: dict, n_files=None):
 
     It works for "start+end", "runs" and "timestamps" in "dataset" present in the config file.
     """
-    # --- get dsp filelist of this run
     path_info = config["dataset"]
     user_time_range = get_query_timerange(dataset=config["dataset"])
 
-    run = (
-        get_run_name(config, user_time_range)
-        if "timestamp" in user_time_range.keys()
-        else get_time_name(user_time_range)
-    )
-    # format to search /path_to_prod-ref[/vXX.XX]/generated/tier/dsp/phy/pXX/rXXX (version 'vXX.XX' might not be there).
-    # NOTICE that we fixed the tier, otherwise it picks the last one it finds (eg tcm).
-    # NOTICE that this is PERIOD SPECIFIC (unlikely we're gonna inspect two periods together, so we fix it)
-    path_to_files = os.path.join(
-        path_info["path"],
-        path_info["version"],
-        "generated",
-        "tier",
-        (
-            "dsp"
-            if path_info["version"] in ["tmp-auto"] or "ref-v1" in path_info["version"]
-            else "psp"
-        ),
-        path_info["type"],
-        path_info["period"],
-        run,
-        "*.lh5",
-    )
-    # get all dsp files
-    dsp_files = glob.glob(path_to_files)
-    dsp_files.sort()
-
     if "timestamp" in user_time_range.keys():
         if isinstance(user_time_range["timestamp"], list):
             # sort in crescent order
             user_time_range["timestamp"].sort()
-            start_time = datetime.strptime(
-                user_time_range["timestamp"][0], "%Y%m%dT%H%M%SZ"
-            )
-            end_time = datetime.strptime(
-                user_time_range["timestamp"][-1], "%Y%m%dT%H%M%SZ"
-            )
-
+            start_time = user_time_range["timestamp"][0]
+            end_time = user_time_range["timestamp"][-1]
         else:
-            start_time = datetime.strptime(
-                user_time_range["timestamp"]["start"], "%Y%m%dT%H%M%SZ"
-            )
-            end_time = datetime.strptime(
-                user_time_range["timestamp"]["end"], "%Y%m%dT%H%M%SZ"
-            )
+            start_time = user_time_range["timestamp"]["start"]
+            end_time = user_time_range["timestamp"]["end"]
+        runs = None
+    else:
+        start_time = end_time = None
+        runs = user_time_range["run"]
 
-    if "run" in user_time_range.keys():
-        timerange, start_tmstmp, end_tmstmp = get_query_times(dataset=config["dataset"])
-        start_time = datetime.strptime(start_tmstmp, "%Y%m%dT%H%M%SZ")
-        end_time = datetime.strptime(end_tmstmp, "%Y%m%dT%H%M%SZ")
-
-    # filter files and keep the ones within the time range of interest
-    filtered_files = []
-    for dsp_file in dsp_files:
-        # Extract the timestamp from the file name
-        timestamp_str = dsp_file.split("-")[-2]
-        file_timestamp = datetime.strptime(timestamp_str, "%Y%m%dT%H%M%SZ")
-        # Check if the file timestamp is within the specified range
-        if start_time <= file_timestamp <= end_time:
-            filtered_files.append(dsp_file)
-
-    filtered_files = [filtered_file.split("-")[-2] for filtered_file in filtered_files]
+    # get keys of dsp files within the time range of interest
+    # NOTICE that we fixed the tier, otherwise it picks the last one it finds (eg tcm).
+    # NOTICE that this is PERIOD SPECIFIC (unlikely we're gonna inspect two periods together, so we fix it)
+    files = catalog.get_catalog(path_info).get_files(
+        get_tier_dir(path_info),
+        path_info["type"],
+        path_info["period"],
+        runs=runs,
+        start=start_time,
+        end=end_time,
+        exclude=get_removed_files(),
+    )
+    filtered_files = [key for _, key, _ in files]
     filtered_files = [
         filtered_files[i : i + int(n_files)]
         for i in range(0, len(filtered_files), int(n_files))
@@ -966,6 +904,118 @@ def get_livetime(tot_livetime: float):
     return tot_livetime, unit
 
 
+def get_coincidences(times: np.ndarray, ref_times: np.ndarray, tolerance=0):
+    """
+    Flag times that are in coincidence with any of the reference times, i.e. |time - ref_time| <= tolerance.
+
+    times, ref_times: int64 timestamps (e.g. nanoseconds since epoch), no need to be sorted
+    tolerance: coincidence window, in the same units as the timestamps
+    Returns a boolean mask with the same length as times.
+    """
+    ref_times = np.unique(ref_times)
+    if len(ref_times) == 0:
+        return np.zeros(len(times), dtype=bool)
+    # first reference time not earlier than time - tolerance: it is a coincidence if it is not later than time + tolerance
+    idx = np.searchsorted(ref_times, times - tolerance, side="left")
+    in_range = idx < len(ref_times)
+    mask = np.zeros(len(times), dtype=bool)
+    mask[in_range] = ref_times[idx[in_range]] <= times[in_range] + tolerance
+    return mask
+
+
+def get_ns(datetimes) -> np.ndarray:
+    """Convert a datetime Series to int64 nanoseconds since epoch (UTC)."""
+    return np.asarray(datetimes.values, dtype="datetime64[ns]").view("int64")
+
+
+def get_ns_duration(duration) -> int:
+    """Convert a duration given in seconds, or as string with unit (e.g. '1us', '10 ms'), to int nanoseconds."""
+    try:
+        return int(
+            Timedelta(duration, unit="s").value
+            if isinstance(duration, (int, float))
+            else Timedelta(duration).value
+        )
+    except ValueError:
+        logger.error(
+            "\033[91mInvalid time duration '%s'. Use seconds or something like '1us'.\033[0m",
+            duration,
+        )
+        sys.exit()
+
+
+def get_remove_intervals(remove_keys: dict = None) -> dict:
+    """
+    Compile time intervals to remove for given detectors into sorted arrays, to be used with is_in_intervals().
+
+    remove_keys: dict {detector: [{'from': 'YYYYMMDDThhmmssZ', 'to': 'YYYYMMDDThhmmssZ'}, ...]};
+        default is the content of settings/remove-keys.json, compiled only the first time
+    Returns {detector: (interval starts, running max of interval ends)} as int64 nanoseconds, sorted by start.
+    """
+    global REMOVE_INTERVALS
+    if remove_keys is None:
+        if REMOVE_INTERVALS is None:
+            REMOVE_INTERVALS = get_remove_intervals(REMOVE_KEYS)
+        return REMOVE_INTERVALS
+
+    intervals = {}
+    for detector, chunks in remove_keys.items():
+        if not chunks:
+            continue
+        starts = get_ns(
+            to_datetime(
+                [chunk["from"] for chunk in chunks], utc=True, format="%Y%m%dT%H%M%SZ"
+            )
+        )
+        ends = get_ns(
+            to_datetime(
+                [chunk["to"] for chunk in chunks], utc=True, format="%Y%m%dT%H%M%SZ"
+            )
+        )
+        order = np.argsort(starts, kind="stable")
+        # with the running max, the last interval starting before a time tells if the time is within any interval
+        intervals[detector] = (starts[order], np.maximum.accumulate(ends[order]))
+
+    return intervals
+
+
+def is_in_intervals(times: np.ndarray, intervals: tuple) -> np.ndarray:
+    """Flag int64 times that are within any of the (starts, running max of ends) intervals compiled by get_remove_intervals(), extremes included."""
+    starts, ends = intervals
+    idx = np.searchsorted(starts, times, side="right") - 1
+    mask = idx >= 0
+    mask[mask] = times[mask] <= ends[idx[mask]]
+    return mask
+
+
+def get_removed_files() -> list:
+    """Get the keys of all faulty files to skip, listed in settings/remove-files.json."""
+    return [key for keys in REMOVE_FILES.values() for key in keys]
+
+
+def add_channel_info(data: DataFrame, channel_map: DataFrame) -> DataFrame:
+    """
+    Join channel map info (name, location, position, cc4, DAQ, HV, detector type, status) to data, by channel.
+
+    data: DataFrame with channel in column (or index) 'channel'
+    channel_map: DataFrame with one row per channel (e.g. Subsystem.channel_map)
+    Only columns not already in data are added; data is returned as it is if none is missing.
+    """
+    columns = [
+        col for col in channel_map.columns if col != "channel" and col not in data
+    ]
+    if not columns:
+        return data
+    info = channel_map.drop_duplicates("channel").set_index("channel")[columns]
+    data = data.join(info, on="channel" if "channel" in data.columns else None)
+    # channels missing in the map make integer columns float
+    for col in ["location", "position"]:
+        # ignore string values for fibers ('I/OB-XXX-XXX') and positions ('top/bottom') for SiPMs
+        if col in columns and data[col].dtype == float and data[col].notna().all():
+            data[col] = data[col].astype(int)
+    return data
+
+
 def is_empty(df: DataFrame):
     """Check if a dataframe is empty."""
     if df.empty:
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from legend_data_monitor import aggregates, save_data
+
+TIMES = pd.to_datetime(
+    ["2023-01-01 00:00:10", "2023-01-01 00:00:50", "2023-01-01 00:01:10"], utc=True
+)
+# datetimes vs channels, as saved in hdf files
+PIVOT = pd.DataFrame(
+    {1: [1.0, 3.0, 5.0], 2: [2.0, np.nan, 4.0]},
+    index=pd.Index(TIMES, name="datetime"),
+)
+
+
+def test_get_levels():
+    levels = aggregates.get_levels(aggregates.get_rows(PIVOT))
+
+    assert list(levels) == ["1min", "10min", "1h", "1d"]
+    df = levels["1min"]
+    assert df["channel"].tolist() == [1, 1, 2, 2]
+    assert df["datetime"].dt.minute.tolist() == [0, 1, 0, 1]
+    assert df["count"].tolist() == [2, 1, 1, 1]
+    assert df["mean"].tolist() == [2, 5, 2, 4]
+    assert df["m2"].tolist() == [2, 0, 0, 0]
+    assert df["min"].tolist() == [1, 5, 2, 4]
+    assert df["max"].tolist() == [3, 5, 2, 4]
+    # built from the 1min bins, as from all values
+    df = levels["1d"]
+    assert df["count"].tolist() == [3, 2]
+    assert df["mean"].tolist() == [3, 3]
+    assert df["m2"].tolist() == [8, 2]
+
+
+def test_combine():
+    # a bin split between two bunches
+    parts = [
+        aggregates.aggregate(aggregates.get_rows(PIVOT.iloc[rows]), "10min")
+        for rows in [[0, 1], [2]]
+    ]
+
+    df = aggregates.combine(pd.concat(parts, ignore_index=True))
+    assert df["count"].tolist() == [3, 2]
+    assert df["mean"].tolist() == [3, 3]
+    assert df["m2"].tolist() == [8, 2]
+    assert df["min"].tolist() == [1, 2]
+    assert df["max"].tolist() == [5, 4]
+
+
+@pytest.mark.parametrize(
+    "n_points, level", [(10000, "1min"), (200, "10min"), (40, "1h"), (2, "1d")]
+)
+def test_select_level(n_points, level):
+    assert aggregates.select_level("2023-01-01", "2023-01-03", n_points) == level
+
+
+def test_read_aggregates(tmp_path):
+    file_path = str(tmp_path / "l200-p03-r000-phy-geds.hdf")
+    # saved in two bunches, splitting the bins
+    df = PIVOT.rename_axis(columns="channel").melt(
+        ignore_index=False, value_name="baseline"
+    )
+    df = df.reset_index().dropna()
+    for saving, times in [("overwrite", TIMES[:2]), ("append", TIMES[2:])]:
+        save_data.get_pivot(
+            df[df["datetime"].isin(times)],
+            "baseline",
+            "IsPulser_Baseline",
+            file_path,
+            saving,
+        )
+
+    df = aggregates.read_aggregates(file_path, "IsPulser_Baseline", level="10min")
+    assert df["channel"].tolist() == [1, 2]
+    assert df["mean"].tolist() == [3, 3]
+    assert df["std"].tolist() == [2, np.sqrt(2)]
+    # coarsest level with 2 bins in 2 minutes, only the selected channel
+    df = aggregates.read_aggregates(
+        file_path,
+        "IsPulser_Baseline",
+        start="2023-01-01 00:00:30",
+        end="2023-01-01 00:02",
+        channels=[2],
+        n_points=2,
+    )
+    assert df["datetime"].dt.minute.tolist() == [0, 1]
+    assert df["mean"].tolist() == [2, 4]
+    assert df["std"].isna().all()
+    assert aggregates.read_aggregates(file_path, "IsPulser_Missing") is None
+
+
+def test_no_levels_for_saved_non_numeric_values(tmp_path):
+    file_path = str(tmp_path / "l200-p03-r000-phy-geds.hdf")
+    # saved by an older version, without levels
+    with pd.HDFStore(file_path, mode="w") as store:
+        store.put("IsPulser_Baseline", pd.DataFrame({1: ["a"]}, index=TIMES[:1]))
+    df = pd.DataFrame({"channel": [1], "datetime": TIMES[1:2], "baseline": [1.0]})
+
+    save_data.get_pivot(df, "baseline", "IsPulser_Baseline", file_path, "append")
+
+    assert save_data.read_pivot(file_path, "IsPulser_Baseline")[1].tolist() == ["a", 1]
+    assert aggregates.read_aggregates(file_path, "IsPulser_Baseline") is None
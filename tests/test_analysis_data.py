@@ -0,0 +1,150 @@
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from legend_data_monitor import analysis_data, metadata, results
+
+
+@pytest.fixture
+def fake_metadata(monkeypatch):
+    diodes = {
+        "V01": {"production": {"mass_in_g": 2000}},
+        "V02": {"production": {"mass_in_g": 1000}},
+    }
+    lmeta = types.SimpleNamespace(
+        hardware=types.SimpleNamespace(
+            detectors=types.SimpleNamespace(
+                germanium=types.SimpleNamespace(diodes=diodes)
+            )
+        )
+    )
+    monkeypatch.setattr(metadata, "LEGEND_METADATA", [lmeta])
+    monkeypatch.setattr(
+        metadata, "get_legend_on", lambda folder, timestamp, system="all": {"PULS01": {}}
+    )
+
+
+CHANNEL_MAP = pd.DataFrame(
+    {"channel": [1, 2], "name": ["V01", "V02"], "location": 1, "position": [1, 2]}
+)
+
+
+def test_exposure(fake_metadata):
+    # 3 pulser events of V01 and 2 of V02
+    data = pd.DataFrame(
+        {
+            "channel": [1, 1, 1, 1, 2, 2, 2],
+            "datetime": pd.date_range("2023-01-01", periods=7, freq="20s", tz="UTC"),
+            "flag_pulser": [True, True, False, True, True, False, True],
+        }
+    )
+    analysis = analysis_data.AnalysisData(
+        data,
+        selection={"parameters": "exposure", "event_type": "all"},
+        channel_map=CHANNEL_MAP,
+    )
+    result = analysis.data.groupby("channel")[["livetime_in_s", "exposure"]].first()
+
+    # pulser events at 0.05 Hz
+    assert result["livetime_in_s"].tolist() == [60, 40]
+    year = 60 * 60 * 24 * 365.25
+    np.testing.assert_allclose(result["exposure"], [2 * 60 / year, 1 * 40 / year])
+
+
+# -------------------------------------------------------------------------------
+# cache of analysed data
+# -------------------------------------------------------------------------------
+
+
+def test_get_selection_key():
+    selection = {"parameters": ["baseline"], "event_type": "pulser", "cuts": []}
+
+    # the plot style does not change the analysed data
+    key = analysis_data.get_selection_key(selection)
+    assert key == analysis_data.get_selection_key(
+        dict(selection, plot_style="histogram")
+    )
+    assert key != analysis_data.get_selection_key(dict(selection, event_type="phy"))
+
+
+def test_get_analysis_data(monkeypatch):
+    built = []
+
+    class CountedAnalysisData(analysis_data.AnalysisData):
+        def __init__(self, *args, **kwargs):
+            built.append(kwargs["selection"]["event_type"])
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(analysis_data, "AnalysisData", CountedAnalysisData)
+    monkeypatch.setattr(analysis_data, "ANALYSES", {})
+    data = pd.DataFrame(
+        {
+            "channel": [1, 2, 1, 2],
+            "datetime": pd.date_range("2023-01-01", periods=4, freq="20s", tz="UTC"),
+            "baseline": [10.0, 20.0, 12.0, 22.0],
+            "flag_pulser": True,
+            "flag_fc_bsln": False,
+            "flag_muon": False,
+        }
+    )
+    selection = {"parameters": "baseline", "event_type": "pulser", "variation": False}
+
+    first = analysis_data.get_analysis_data(data, selection, channel_map=CHANNEL_MAP)
+    first.data["baseline"] = 0.0
+    second = analysis_data.get_analysis_data(
+        data, dict(selection), channel_map=CHANNEL_MAP
+    )
+    # reused, and not changed through the first copy
+    assert built == ["pulser"]
+    assert second.data["baseline"].tolist() == [10, 12, 20, 22]
+
+    all_events = dict(selection, event_type="all")
+    analysis_data.get_analysis_data(data, all_events, channel_map=CHANNEL_MAP)
+    assert built == ["pulser", "all"]
+    analysis_data.clear_analysis_cache()
+    analysis_data.get_analysis_data(data, selection, channel_map=CHANNEL_MAP)
+    assert built == ["pulser", "all", "pulser"]
+
+
+# -------------------------------------------------------------------------------
+# reference mean values when appending
+# -------------------------------------------------------------------------------
+
+
+def test_get_saved_df(tmp_path, monkeypatch):
+    plt_path = str(tmp_path / "l200-p03-r000-phy")
+    # one row every 30 s from 00:00 to 00:25, values 0, 1, 2, ... (x10 for channel 2)
+    times = pd.date_range("2023-01-01", "2023-01-01 00:25", freq="30s", tz="UTC")
+    values = np.arange(len(times), dtype=float)
+    rows = pd.concat(
+        [
+            pd.DataFrame(
+                {"channel": channel, "datetime": times, "baseline": scale * values}
+            )
+            for channel, scale in [(1, 1), (2, 10)]
+        ],
+        ignore_index=True,
+    )
+    # saved before 00:05, new rows afterwards
+    saved = rows["datetime"] < pd.Timestamp("2023-01-01 00:05", tz="UTC")
+    results.write_parameter(plt_path + "-geds", "pulser", "baseline", rows[saved], {})
+    analysis = types.SimpleNamespace(plt_path=plt_path, data=rows[~saved])
+
+    read = []
+    read_parameter = results.read_parameter
+
+    def read_and_count(*args, **kwargs):
+        df = read_parameter(*args, **kwargs)
+        read.append(len(df))
+        return df
+
+    monkeypatch.setattr(results, "read_parameter", read_and_count)
+    channel_mean = analysis_data.get_saved_df(analysis, "geds", "baseline", "pulser")
+
+    # rows before 00:02:30 (10% of the time range): values 0 to 4
+    assert channel_mean.index.tolist() == [1, 2]
+    assert channel_mean["baseline"].tolist() == [2, 20]
+    # saved rows of the 00:02 bucket only, others are summarised
+    assert read == [2]
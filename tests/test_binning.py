@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from legend_data_monitor import binning, jagged
+
+
+def get_data(tz="UTC"):
+    """Two channels with random timestamps over one hour, some NaN values and a gap."""
+    rng = np.random.default_rng(1)
+    start = pd.Timestamp("2023-01-01 00:00:17", tz=tz)
+    data = []
+    for channel, n_rows in [(1, 300), (2, 200)]:
+        seconds = np.sort(rng.uniform(0, 3600, n_rows))
+        # no events of channel 2 in its first 20 minutes
+        if channel == 2:
+            seconds = seconds[seconds > 1200]
+        values = rng.normal(10, 2, len(seconds))
+        values[::17] = np.nan
+        data.append(
+            pd.DataFrame(
+                {
+                    "channel": channel,
+                    "datetime": start + pd.to_timedelta(seconds, unit="s"),
+                    "baseline": values,
+                }
+            )
+        )
+    return pd.concat(data, ignore_index=True)
+
+
+@pytest.mark.parametrize("tz", ["UTC", None])
+def test_bin_data_vs_resample(tz):
+    data = get_data(tz)
+    bins = binning.bin_data(data, "10min", "baseline")
+
+    start = data["datetime"].min()
+    for channel, data_channel in data.groupby("channel"):
+        resampled = (
+            data_channel.set_index("datetime")["baseline"]
+            .resample("10min", origin=start)
+            .agg(["size", "count", "sum", "mean", "std", "min", "max"])
+        )
+        channel_bins = binning.get_channel_bins(bins, channel)
+
+        assert (channel_bins["datetime"] == resampled.index).all()
+        np.testing.assert_array_equal(channel_bins["entries"], resampled["size"])
+        np.testing.assert_array_equal(channel_bins["count"], resampled["count"])
+        for column in ["sum", "mean", "std", "min", "max"]:
+            np.testing.assert_allclose(channel_bins[column], resampled[column])
+
+
+def test_bin_data_jagged():
+    data = pd.DataFrame(
+        {
+            "channel": [1, 1, 1],
+            "datetime": pd.to_datetime(
+                ["2023-01-01 00:00", "2023-01-01 00:05", "2023-01-01 00:12"], utc=True
+            ),
+            "energies": [[1.0, 2.0], [], [4.0]],
+        }
+    )
+    data = jagged.convert_lists(data)
+    bins = binning.get_channel_bins(binning.bin_data(data, "10min", "energies"), 1)
+
+    # all values of a row in the bin of the row
+    assert bins["entries"].tolist() == [2, 1]
+    assert bins["count"].tolist() == [2, 1]
+    assert bins["mean"].tolist() == [1.5, 4.0]
+
+
+def test_get_bins():
+    data = get_data()
+    time_bins = {}
+
+    bins = binning.get_bins(data, "10min", "baseline", time_bins)
+    assert binning.get_bins(data, "10min", "baseline", time_bins) is bins
+    assert list(time_bins) == [("10min", "baseline")]
+    # not cached without a dict of binned values
+    assert binning.get_bins(data, "10min", "baseline") is not bins
+    pd.testing.assert_frame_equal(binning.get_bins(data, "10min", "baseline"), bins)
+
+
+def test_bin_data_large_offset():
+    data = pd.DataFrame(
+        {
+            "channel": 1,
+            "datetime": pd.Timestamp("2023-01-01", tz="UTC")
+            + pd.to_timedelta(np.arange(4), unit="min"),
+            "timestamp": 1.7e9 + np.array([0.1, 0.2, 0.3, 0.4]),
+        }
+    )
+    bins = binning.get_channel_bins(binning.bin_data(data, "10min", "timestamp"), 1)
+
+    assert bins["std"].tolist() == pytest.approx(
+        [np.std(data["timestamp"], ddof=1)], rel=1e-6
+    )
+
+
+def test_bin_data_empty():
+    data = get_data().iloc[:0]
+
+    bins = binning.bin_data(data, "10min", "baseline")
+
+    assert bins.empty
+    assert bins["datetime"].dt.tz is not None
+    assert binning.get_channel_bins(bins, 1).empty
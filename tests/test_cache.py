@@ -0,0 +1,155 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from legend_data_monitor import cache
+
+KEYS = ["20230101T000000Z", "20230101T010000Z"]
+
+# rows of each (file, channel) in the dsp tier; no channel 2 in the second file
+ROWS = {
+    (0, 1): {"energy": [0.0, 1.0, 2.0], "vov": [[1, 2], [], [3]]},
+    (0, 2): {"energy": [10.0, 11.0], "vov": [[4], [5, 6]]},
+    (1, 1): {"energy": [20.0, 21.0], "vov": [[7], []]},
+}
+
+
+class FakeLoader:
+    """DataLoader with one 'hit' level and a 'dsp' tier; records the columns of each load."""
+
+    def __init__(self, data_dir, columns):
+        self.data_dir = str(data_dir)
+        self.levels = ["hit"]
+        self.tiers = {"hit": ["dsp"]}
+        self.filedb = SimpleNamespace(
+            config={"tables": {"dsp": [1, 2]}, "columns": {"dsp": columns}},
+            # the first key also in a calibration run, not selected
+            df=pd.DataFrame(
+                {
+                    "timestamp": KEYS + KEYS[:1],
+                    "type": ["phy", "phy", "cal"],
+                    "dsp_file": [f"{key}.lh5" for key in KEYS] + ["cal.lh5"],
+                }
+            ),
+            tier_dirs={"dsp": "dsp"},
+            sortby="timestamp",
+        )
+        os.makedirs(os.path.join(self.data_dir, "dsp"), exist_ok=True)
+        for file in self.filedb.df["dsp_file"]:
+            with open(os.path.join(self.data_dir, "dsp", file), "w") as f:
+                f.write(file)
+        self.file_list = [0, 1]
+        self.loaded = []
+
+    def reset(self):
+        self.file_list = []
+
+    def set_files(self, query):
+        # lists of keys are converted to queries by the DataLoader
+        if isinstance(query, list):
+            query = " or ".join(f"timestamp == '{key}'" for key in query)
+        self.file_list = list(self.filedb.df.query(query, engine="python").index)
+
+    def set_output(self, fmt, columns):
+        self.columns = columns
+
+    def load(self):
+        assert 2 not in self.file_list
+        self.loaded.append(sorted(self.columns))
+        rows = []
+        for (file, channel), values in ROWS.items():
+            if file in self.file_list:
+                # columns not in the files are missing from the output
+                df = pd.DataFrame(
+                    {
+                        column: pd.Series(values[column])
+                        for column in self.columns
+                        if column in values
+                    }
+                )
+                rows.append(df.assign(hit_table=channel, hit_idx=df.index, file=file))
+        return pd.concat(rows, ignore_index=True)
+
+
+def test_load_with_cache(tmp_path):
+    column_cache = cache.ColumnCache(str(tmp_path / "cache"))
+    dl = FakeLoader(tmp_path / "data", ["energy"])
+
+    df = cache.load_with_cache(dl, column_cache)
+    assert dl.loaded == [["energy"]]
+    assert df["hit_table"].tolist() == [1, 1, 1, 2, 2, 1, 1]
+    assert df["hit_idx"].tolist() == [0, 1, 2, 0, 1, 0, 1]
+    assert df["file"].tolist() == [0, 0, 0, 0, 0, 1, 1]
+    assert df["energy"].tolist() == [0, 1, 2, 10, 11, 20, 21]
+
+    # new parameter: only its column is loaded, the other one comes from the cache
+    dl.filedb.config["columns"]["dsp"] = ["energy", "vov"]
+    df = cache.load_with_cache(dl, column_cache)
+    assert dl.loaded == [["energy"], ["vov"]]
+    assert df["energy"].tolist() == [0, 1, 2, 10, 11, 20, 21]
+    assert [list(row) for row in df["vov"]] == [[1, 2], [], [3], [4], [5, 6], [7], []]
+
+    # everything cached
+    cache.load_with_cache(dl, column_cache)
+    assert len(dl.loaded) == 2
+
+
+def test_load_missing_column(tmp_path):
+    column_cache = cache.ColumnCache(str(tmp_path / "cache"))
+    dl = FakeLoader(tmp_path / "data", ["energy", "missing"])
+
+    # NaN values, as with the DataLoader, also once cached
+    for _ in range(2):
+        df = cache.load_with_cache(dl, column_cache)
+        assert df["energy"].tolist() == [0, 1, 2, 10, 11, 20, 21]
+        assert df["missing"].isna().all() and len(df) == 7
+    assert dl.loaded == [["energy", "missing"]]
+
+
+def test_invalidation(tmp_path):
+    column_cache = cache.ColumnCache(str(tmp_path / "cache"))
+    lh5_file = str(tmp_path / "file.lh5")
+    with open(lh5_file, "w") as f:
+        f.write("data")
+    vov = np.empty(2, dtype=object)
+    vov[:] = [np.array([1, 2]), np.array([])]
+    column_cache.put(lh5_file, KEYS[0], "dsp", {1: {"energy": [1.0, 2.0], "vov": vov}})
+
+    cached = column_cache.get(lh5_file, KEYS[0], "dsp", {1: ["energy", "vov", "x"]})
+    assert sorted(cached[1]) == ["energy", "vov"]
+    assert cached[1]["energy"].tolist() == [1.0, 2.0]
+    assert [list(row) for row in cached[1]["vov"]] == [[1, 2], []]
+
+    # the LH5 file was reprocessed: cache file dropped
+    with open(lh5_file, "w") as f:
+        f.write("new data")
+    assert column_cache.get(lh5_file, KEYS[0], "dsp", {1: ["energy"]}) == {1: {}}
+    assert not os.listdir(column_cache.path)
+
+
+def test_evict(tmp_path):
+    column_cache = cache.ColumnCache(str(tmp_path / "cache"), max_size=250)
+    for i in range(3):
+        cache_file = os.path.join(column_cache.path, f"{i}.h5")
+        with open(cache_file, "wb") as f:
+            f.write(b"0" * 100)
+        # least recently used first
+        os.utime(cache_file, (1000 + i, 1000 + i))
+
+    column_cache.evict()
+    assert sorted(os.listdir(column_cache.path)) == ["1.h5", "2.h5"]
+
+
+@pytest.mark.parametrize(
+    "size, expected", [(100, 100), ("50GB", 5e10), ("500 mb", 5e8), ("2KB", 2e3)]
+)
+def test_get_size_in_bytes(size, expected):
+    assert cache.get_size_in_bytes(size) == expected
+
+
+def test_get_size_in_bytes_invalid():
+    with pytest.raises(SystemExit):
+        cache.get_size_in_bytes("a lot")
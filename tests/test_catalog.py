@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+from legend_data_monitor import catalog, utils
+
+
+@pytest.fixture(autouse=True)
+def fake_timestamps(monkeypatch):
+    """Files contain their last timestamp as text; count how many times they are read."""
+    reads = []
+
+    def get_last_timestamp(path):
+        reads.append(path)
+        with open(path) as f:
+            return f.read().strip()
+
+    monkeypatch.setattr(utils, "get_last_timestamp", get_last_timestamp)
+    monkeypatch.setattr(catalog, "CATALOGS", {})
+    return reads
+
+
+def write_file(tier_dir, run, key, last_timestamp):
+    run_dir = tier_dir / "phy" / "p03" / run
+    run_dir.mkdir(parents=True, exist_ok=True)
+    path = run_dir / f"l200-p03-{run}-phy-{key}-tier_dsp.lh5"
+    path.write_text(last_timestamp)
+    return str(path)
+
+
+def test_get_files(tmp_path):
+    tier_dir = tmp_path / "dsp"
+    write_file(tier_dir, "r000", "20230101T000000Z", "20230101T005959Z")
+    write_file(tier_dir, "r001", "20230102T010000Z", "20230102T015959Z")
+    write_file(tier_dir, "r000", "20230101T010000Z", "20230101T015959Z")
+    db = str(tmp_path / "catalog.sqlite")
+
+    files = catalog.DatasetCatalog(db).get_files(str(tier_dir), "phy", "p03")
+    assert [(run, key) for run, key, _ in files] == [
+        ("r000", "20230101T000000Z"),
+        ("r000", "20230101T010000Z"),
+        ("r001", "20230102T010000Z"),
+    ]
+    file_catalog = catalog.DatasetCatalog(db)
+    assert file_catalog.get_files(
+        str(tier_dir), ["phy"], "p03", runs=["r000"], start="20230101T003000Z"
+    ) == [files[1]]
+    # within the last file of r000, or after it
+    find_run = file_catalog.find_run
+    assert find_run(str(tier_dir), "phy", "p03", "20230101T015000Z") == "r000"
+    assert find_run(str(tier_dir), "phy", "p03", "20230101T020000Z") is None
+
+
+def test_get_files_exclude(tmp_path):
+    tier_dir = tmp_path / "dsp"
+    for key in ["20230101T000000Z", "20230101T010000Z", "20230101T020000Z"]:
+        write_file(tier_dir, "r000", key, key)
+    file_catalog = catalog.DatasetCatalog(str(tmp_path / "catalog.sqlite"))
+
+    # faulty files are skipped
+    files = file_catalog.get_files(
+        str(tier_dir), "phy", "p03", exclude=["20230101T010000Z"]
+    )
+    assert [key for _, key, _ in files] == ["20230101T000000Z", "20230101T020000Z"]
+
+
+def test_invalidation(tmp_path, fake_timestamps):
+    tier_dir = tmp_path / "dsp"
+    path = write_file(tier_dir, "r000", "20230101T000000Z", "20230101T005959Z")
+    removed = write_file(tier_dir, "r001", "20230102T000000Z", "20230102T005959Z")
+    db = str(tmp_path / "catalog.sqlite")
+
+    file_catalog = catalog.DatasetCatalog(db)
+    file_catalog.get_files(str(tier_dir), "phy", "p03")
+    assert file_catalog.get_last_timestamp(path) == "20230101T005959Z"
+    assert file_catalog.get_last_timestamp(path) == "20230101T005959Z"
+    assert fake_timestamps == [path]
+
+    # new session, nothing changed: last timestamp not read again
+    file_catalog = catalog.DatasetCatalog(db)
+    file_catalog.get_files(str(tier_dir), "phy", "p03")
+    assert file_catalog.get_last_timestamp(path) == "20230101T005959Z"
+    assert fake_timestamps == [path]
+
+    # file rewritten in place (run folder unchanged), another run removed
+    run_dir = os.path.dirname(path)
+    run_mtime = os.stat(run_dir).st_mtime
+    with open(path, "w") as f:
+        f.write("20230101T015959Z")
+    os.utime(path, (run_mtime + 10, run_mtime + 10))
+    os.utime(run_dir, (run_mtime, run_mtime))
+    os.remove(removed)
+    os.rmdir(os.path.dirname(removed))
+
+    file_catalog = catalog.DatasetCatalog(db)
+    files = file_catalog.get_files(str(tier_dir), "phy", "p03")
+    assert files == [("r000", "20230101T000000Z", path)]
+    assert file_catalog.get_last_timestamp(path) == "20230101T015959Z"
+    assert fake_timestamps == [path, path]
+
+
+def test_get_catalog(tmp_path):
+    # in-memory catalog by default, nothing written
+    file_catalog = catalog.get_catalog({"path": str(tmp_path)})
+    assert file_catalog.path is None
+    assert catalog.get_catalog({}) is file_catalog
+
+    db = str(tmp_path / "catalog.sqlite")
+    assert catalog.get_catalog({"catalog": db}).path == db
+    assert os.path.isfile(db)
@@ -1,5 +1,25 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
 import legend_data_monitor  # noqa: F401
+from legend_data_monitor import core
 
 
 def test_import():
     pass
+
+
+def test_get_prefetch_settings():
+    # opt-in
+    assert core.get_prefetch_settings({}) == (0, None)
+    assert core.get_prefetch_settings({"prefetch": 2}) == (2, None)
+    assert core.get_prefetch_settings({"prefetch": {"max_memory": "1KB"}}) == (1, 1e3)
+
+
+def test_get_memory_usage():
+    data = pd.DataFrame({"name": ["a" * 1000, "b" * 1000]})
+    subsystems = {"geds": SimpleNamespace(data=data), "spms": SimpleNamespace(data=None)}
+
+    # contents of object columns are counted
+    assert core.get_memory_usage(subsystems) > 2000
@@ -0,0 +1,116 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from lgdo import (
+    Array,
+    ArrayOfEqualSizedArrays,
+    Table,
+    VectorOfVectors,
+    WaveformTable,
+    lh5,
+)
+
+from legend_data_monitor import direct_loader
+
+N_ROWS = 5
+
+
+def write_file(path):
+    """dsp-like table whose first columns are a waveform table and a 2D array."""
+    table = Table(
+        col_dict={
+            "a_wf": WaveformTable(
+                t0=np.zeros(N_ROWS), dt=np.ones(N_ROWS), values=np.zeros((N_ROWS, 8))
+            ),
+            "b_2d": ArrayOfEqualSizedArrays(nda=np.zeros((N_ROWS, 3))),
+            "energy": Array(np.arange(N_ROWS, dtype=float)),
+            "vov": VectorOfVectors(
+                flattened_data=np.array([1, 2, 3, 4, 5]),
+                cumulative_length=np.array([1, 3, 3, 4, 5]),
+            ),
+        }
+    )
+    lh5.LH5Store().write(table, "dsp", str(path), group="ch1", wo_mode="of")
+    return str(path)
+
+
+def test_read_file(tmp_path):
+    file = write_file(tmp_path / "dsp.lh5")
+    task = [(file, {1: "ch1/dsp", 2: "ch2/dsp"}, ["energy", "vov", "missing"])]
+
+    (result,) = direct_loader.read_file(task)
+
+    # missing channel skipped
+    assert list(result) == [1]
+    n_rows, values = result[1]
+    assert n_rows == N_ROWS == lh5.LH5Store().read_n_rows("ch1/dsp", file)
+    assert sorted(values) == ["energy", "vov"]
+    np.testing.assert_array_equal(values["energy"], np.arange(N_ROWS))
+    np.testing.assert_array_equal(values["vov"][0], [1, 2, 3, 4, 5])
+    np.testing.assert_array_equal(values["vov"][1], [1, 3, 3, 4, 5])
+
+
+def test_read_file_no_columns(tmp_path):
+    file = write_file(tmp_path / "dsp.lh5")
+
+    (result,) = direct_loader.read_file([(file, {1: "ch1/dsp"}, [])])
+
+    # number of rows even without columns to read
+    assert result[1] == (N_ROWS, {})
+
+
+def make_loader(tmp_path, hit_rows=N_ROWS, files=(0,)):
+    """DataLoader with a 'dsp' and a 'hit' tier with one file each, for channel 1."""
+    write_file(tmp_path / "dsp" / "key.lh5")
+    table = Table(col_dict={"cuspEmax_ctc_cal": Array(np.arange(hit_rows) * 2.0)})
+    lh5.LH5Store().write(
+        table, "hit", str(tmp_path / "hit" / "key.lh5"), group="ch1", wo_mode="of"
+    )
+    filedb = SimpleNamespace(
+        config={
+            "tables": {"dsp": [1], "hit": [1]},
+            "columns": {"dsp": ["energy", "vov"], "hit": ["cuspEmax_ctc_cal"]},
+        },
+        df=pd.DataFrame(
+            {"timestamp": ["key"], "dsp_file": ["key.lh5"], "hit_file": ["key.lh5"]}
+        ),
+        tier_dirs={"dsp": "dsp", "hit": "hit"},
+        get_table_name=lambda tier, channel: f"ch{channel}/{tier}",
+    )
+    return SimpleNamespace(
+        data_dir=str(tmp_path),
+        filedb=filedb,
+        levels=["hit"],
+        tiers={"hit": ["dsp", "hit"]},
+        file_list=list(files),
+        output_columns=["energy", "cuspEmax_ctc_cal"],
+    )
+
+
+def test_load_direct(tmp_path):
+    df = direct_loader.load_direct(make_loader(tmp_path), processes=1)
+
+    assert df["hit_table"].tolist() == [1] * N_ROWS
+    assert df["hit_idx"].tolist() == list(range(N_ROWS))
+    assert df["energy"].tolist() == [0, 1, 2, 3, 4]
+    assert df["cuspEmax_ctc_cal"].tolist() == [0, 2, 4, 6, 8]
+
+
+def test_load_direct_no_files(tmp_path):
+    df = direct_loader.load_direct(make_loader(tmp_path, files=()))
+
+    assert df.empty
+    assert sorted(df.columns) == [
+        "cuspEmax_ctc_cal",
+        "energy",
+        "file",
+        "hit_idx",
+        "hit_table",
+    ]
+
+
+def test_load_direct_misaligned_tiers(tmp_path):
+    with pytest.raises(SystemExit):
+        direct_loader.load_direct(make_loader(tmp_path, hit_rows=4), processes=1)
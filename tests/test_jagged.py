@@ -0,0 +1,212 @@
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+
+from legend_data_monitor import jagged, plot_styles  # noqa: E402
+
+LISTS = [[1.0, 2.0], [], np.nan, [3.0], [4.0, np.nan, 6.0]]
+
+
+def get_array():
+    return jagged.JaggedArray.from_lists(LISTS)
+
+
+def assert_rows(array, lists):
+    assert len(array) == len(lists)
+    for row, expected in zip(array, lists):
+        if isinstance(expected, float):
+            assert isinstance(row, float) and np.isnan(row)
+        else:
+            np.testing.assert_array_equal(row, expected)
+
+
+def test_from_lists():
+    array = get_array()
+
+    np.testing.assert_array_equal(array.offsets, [0, 2, 2, 2, 3, 6])
+    np.testing.assert_array_equal(array.isna(), [False, False, True, False, False])
+    assert_rows(array, LISTS)
+
+
+def test_take():
+    array = get_array()
+
+    assert_rows(array.take([4, 0, 0, -1]), [LISTS[4], LISTS[0], LISTS[0], LISTS[4]])
+    assert_rows(array.take([3, -1, 1], allow_fill=True), [LISTS[3], np.nan, []])
+    mask = np.array([True, False, False, True, True])
+    assert_rows(array[mask], [LISTS[0], LISTS[3], LISTS[4]])
+    assert_rows(array[1:4], LISTS[1:4])
+    with pytest.raises(IndexError):
+        array.take([5])
+
+
+def test_concat():
+    array = get_array()
+
+    joined = jagged.JaggedArray._concat_same_type(
+        [array[:2], jagged.JaggedArray.empty(2), array[2:]]
+    )
+    assert_rows(joined, LISTS[:2] + [[], []] + LISTS[2:])
+    data = pd.DataFrame({"channel": range(5), "energies": array})
+    both = pd.concat([data, data], ignore_index=True)
+    assert jagged.is_jagged(both["energies"])
+    assert_rows(both["energies"].array, LISTS + LISTS)
+
+
+def test_reductions():
+    array = get_array()
+
+    np.testing.assert_array_equal(array.multiplicity(), [2, 0, 0, 1, 2])
+    np.testing.assert_array_equal(array.event_sum(), [3, 0, np.nan, 3, 10])
+    np.testing.assert_array_equal(array.event_max(), [2, np.nan, np.nan, 3, 6])
+
+
+def test_dataframe_ops():
+    data = pd.DataFrame(
+        {"channel": [2, 1, 2, 1, 2], "name": list("BABAB"), "energies": get_array()}
+    )
+
+    # sorting and filtering keep the values of each row
+    sorted_data = data.sort_values("channel", kind="stable")
+    assert_rows(sorted_data["energies"].array, [LISTS[i] for i in [1, 3, 0, 2, 4]])
+    assert_rows(data[data["channel"] == 1]["energies"].array, [LISTS[1], LISTS[3]])
+    # groupby aggregations on other columns only
+    labels = data.groupby("channel")[["name"]].first()
+    assert labels["name"].tolist() == ["A", "B"]
+
+    # mean of all values of each channel, as of exploded lists
+    exploded = jagged.to_object(data).explode("energies")
+    expected = (
+        exploded["energies"].astype("float64").groupby(exploded["channel"]).mean()
+    )
+    pd.testing.assert_series_equal(
+        jagged.mean_by(data["energies"], data["channel"]), expected, check_names=False
+    )
+
+
+def test_convert():
+    data = pd.DataFrame(
+        {"channel": range(5), "energies": pd.Series(LISTS, dtype=object)}
+    )
+
+    converted = jagged.convert_lists(data.copy())
+    assert jagged.is_jagged(converted["energies"])
+    assert_rows(converted["energies"].array, LISTS)
+    back = jagged.to_object(converted)
+    assert back["energies"].dtype == object
+    assert_rows(back["energies"], LISTS)
+
+
+# -------------------------------------------------------------------------------
+# plot styles with list-valued parameters
+# -------------------------------------------------------------------------------
+
+
+def get_data():
+    return pd.DataFrame(
+        {
+            "channel": 1,
+            "location": 1,
+            "position": 1,
+            "datetime": pd.date_range("2023-01-01", periods=5, freq="10s", tz="UTC"),
+            "energies": get_array(),
+            "baseline": np.arange(5.0),
+        }
+    )
+
+
+PLOT_INFO = {
+    "parameter": "energies",
+    "parameters": ["energies"],
+    "label": "Energy",
+    "unit": "PE",
+    "unit_label": "PE",
+    "range": [None, None],
+    "resampled": "no",
+    "time_window": "20s",
+    "std": False,
+    "event_type": "phy",
+}
+
+
+@pytest.fixture
+def axes():
+    fig, ax = plt.subplots()
+    yield fig, ax
+    plt.close(fig)
+
+
+def test_flat_values():
+    data = get_data()
+    times, values = plot_styles.get_values_vs_time(data, "energies")
+
+    # each value at the time of its row
+    rows = [0, 0, 3, 4, 4, 4]
+    assert list(times) == [data["datetime"][row].to_pydatetime() for row in rows]
+    np.testing.assert_array_equal(values, [1, 2, 3, 4, np.nan, 6])
+    np.testing.assert_array_equal(
+        plot_styles.get_values(data, "energies"), get_array().values
+    )
+    np.testing.assert_array_equal(
+        plot_styles.get_values(data, "baseline"), np.arange(5.0)
+    )
+
+
+def test_plot_vs_time(axes):
+    plot_styles.plot_vs_time(get_data(), *axes, dict(PLOT_INFO))
+
+    (line,) = axes[1].get_lines()
+    np.testing.assert_array_equal(line.get_ydata(), get_array().values)
+
+
+@pytest.mark.filterwarnings("ignore:The behavior of DatetimeProperties.to_pydatetime")
+def test_plot_vs_time_resampled(axes):
+    plot_info = dict(PLOT_INFO, resampled="also")
+    plot_styles.plot_vs_time(get_data(), *axes, plot_info)
+
+    # all values, and their mean in 20 s bins
+    _, resampled = axes[1].get_lines()
+    np.testing.assert_allclose(resampled.get_ydata(), [1.5, 3, 5])
+
+
+def test_plot_histo_and_scatter(axes):
+    plot_styles.plot_histo(get_data(), *axes, dict(PLOT_INFO))
+    assert len(axes[1].patches) == 1
+    plot_styles.plot_scatter(get_data(), *axes, dict(PLOT_INFO))
+    (points,) = axes[1].collections
+    assert len(points.get_offsets()) == 6
+
+
+def test_par_vs_ch(axes):
+    data = get_data()
+    plot_styles.par_vs_ch(data.iloc[[3]], *axes, dict(PLOT_INFO))
+    (points,) = axes[1].collections
+    np.testing.assert_array_equal(points.get_offsets(), [[0, 3]])
+
+    # more than one value: not plotted
+    plot_styles.par_vs_ch(data, *axes, dict(PLOT_INFO))
+    assert len(axes[1].collections) == 1
+
+
+def test_par_vs_par(axes):
+    plot_info = dict(
+        PLOT_INFO,
+        parameters=["baseline", "energies"],
+        label={"baseline": "Baseline", "energies": "Energy"},
+        unit={"baseline": "ADC", "energies": "PE"},
+        unit_label={"baseline": "ADC", "energies": "PE"},
+        range={"baseline": [None, None], "energies": [None, None]},
+    )
+    plot_styles.plot_par_vs_par(get_data(), *axes, plot_info)
+
+    # baseline of each row repeated for each of its energies
+    (points,) = axes[1].collections
+    np.testing.assert_array_equal(
+        points.get_offsets().data,
+        np.column_stack([[0, 0, 3, 4, 4, 4], get_array().values]),
+    )
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from legend_data_monitor import metadata
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    for cache in [
+        metadata.DBS,
+        metadata.VALIDITIES,
+        metadata.VALID_ENTRIES,
+        metadata.CHANNEL_TABLES,
+    ]:
+        cache.clear()
+
+
+def write_db(path, validity_name, validity_text):
+    path.mkdir()
+    (path / "a.json").write_text(json.dumps({"x": 1, "y": 1}))
+    (path / "b.json").write_text(json.dumps({"y": 2}))
+    (path / validity_name).write_text(validity_text)
+    return str(path)
+
+
+JSONL = "\n".join(
+    json.dumps(entry)
+    for entry in [
+        {"valid_from": "20230101T000000Z", "apply": ["a.json"]},
+        {"valid_from": "20230201T000000Z", "apply": ["a.json", "b.json"]},
+    ]
+)
+
+YAML = """
+- valid_from: 20230101T000000Z
+  category: all
+  apply:
+    - a.json
+- valid_from: 20230201T000000Z
+  category: all
+  mode: append
+  apply:
+    - b.json
+"""
+
+
+@pytest.mark.parametrize(
+    "validity_name, validity_text",
+    [("validity.jsonl", JSONL), ("validity.yaml", YAML)],
+)
+def test_get_on(tmp_path, validity_name, validity_text):
+    path = write_db(tmp_path / "db", validity_name, validity_text)
+
+    assert metadata.get_validity(path, "20230115T000000Z") == ("a.json",)
+    assert metadata.get_validity(path, "20230215T000000Z") == ("a.json", "b.json")
+
+    first = metadata.get_on(path, "20230115T000000Z")
+    assert first["y"] == 1
+    assert metadata.get_on(path, "20230215T000000Z")["y"] == 2
+    # same valid files, same (cached) object
+    assert metadata.get_on(path, "20230120T000000Z") is first
+    assert metadata.get_on(path, "20230115T000000Z") == metadata.get_db(path).on(
+        "20230115T000000Z"
+    )
+
+
+def test_get_on_without_validity(tmp_path):
+    path = tmp_path / "db"
+    path.mkdir()
+    (path / "a.json").write_text(json.dumps({"x": 1}))
+
+    assert metadata.get_validity(str(path), "20230115T000000Z") is None
+    # same behaviour as TextDB.on(), nothing cached
+    with pytest.raises(RuntimeError):
+        metadata.get_db(str(path)).on("20230115T000000Z")
+    with pytest.raises(RuntimeError):
+        metadata.get_on(str(path), "20230115T000000Z")
+    assert not metadata.VALID_ENTRIES
@@ -0,0 +1,224 @@
+import os
+
+import pandas as pd
+import pytest
+
+from legend_data_monitor import results, segments
+
+TIMES = pd.date_range("2023-01-01", periods=3, freq="1min", tz="UTC")
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "l200-p03-r000-phy-geds")
+
+
+def test_write_and_read(path):
+    # rows in any order, with the mean of each channel and an extra column
+    df = pd.DataFrame(
+        {
+            "channel": [2, 1, 2, 1],
+            "datetime": TIMES[[1, 0, 0, 1]],
+            "baseline": [22.0, 9.0, 18.0, 11.0],
+            "baseline_mean": [20.0, 10.0, 20.0, 10.0],
+            "location": [12, 11, 12, 11],
+        }
+    )
+    results.write_parameter(path, "pulser", "baseline", df, {"unit": "ADC"})
+
+    df = results.read_parameter(path, "pulser", "baseline")
+    assert df["channel"].tolist() == [1, 1, 2, 2]
+    assert df["datetime"].tolist() == list(TIMES[[0, 1, 0, 1]])
+    assert df["baseline"].tolist() == [9, 11, 18, 22]
+    assert df["location"].tolist() == [11, 11, 12, 12]
+    assert df["baseline_mean"].tolist() == [10, 10, 20, 20]
+    assert df["baseline_var"].tolist() == pytest.approx([-10, 10, -10, 10])
+    assert results.read_plot_info(path, "pulser", "baseline") == {"unit": "ADC"}
+
+    df = results.read_parameter(
+        path, "pulser", "baseline", channels=[2], columns=["datetime", "baseline"]
+    )
+    assert list(df.columns) == ["datetime", "baseline"]
+    assert df["baseline"].tolist() == [18, 22]
+
+
+def test_append(path):
+    df = pd.DataFrame(
+        {
+            "channel": [1, 2],
+            "datetime": TIMES[[0, 0]],
+            "baseline": [9.0, 18.0],
+            "baseline_mean": [10.0, 20.0],
+        }
+    )
+    results.append_parameter(path, "pulser", "baseline", df, {})
+    # new mean value of channel 1 only
+    new_df = pd.DataFrame(
+        {
+            "channel": [1],
+            "datetime": TIMES[[1]],
+            "baseline": [12.0],
+            "baseline_mean": [8.0],
+        }
+    )
+    results.append_parameter(path, "pulser", "baseline", new_df, {})
+    assert len(results.get_files(path)) == 2
+
+    df = results.read_parameter(path, "pulser", "baseline")
+    assert df["baseline"].tolist() == [9, 12, 18]
+    assert df["baseline_mean"].tolist() == [8, 8, 20]
+    assert df["baseline_var"].tolist() == pytest.approx([12.5, 50, -10])
+    assert results.get_parameters(path) == {"pulser": ["baseline"]}
+    assert results.read_parameter(path, "pulser", "energy") is None
+
+    results.remove(path)
+    assert not results.exists(path)
+
+
+# list-valued columns are pickled in fixed format
+@pytest.mark.filterwarnings("ignore::pandas.errors.PerformanceWarning")
+def test_list_values(path):
+    df = pd.DataFrame(
+        {
+            "channel": [1, 1, 2],
+            "datetime": TIMES,
+            "energies": pd.Series([[1.0, 2.0], [], [3.0]], dtype=object),
+        }
+    )
+    results.write_parameter(path, "pulser", "energies", df, {})
+
+    df = results.read_parameter(path, "pulser", "energies")
+    assert [list(row) for row in df["energies"]] == [[1.0, 2.0], [], [3.0]]
+    assert df["energies_var"].isna().all()
+    assert results.read_summary(path, "pulser", "energies") is None
+
+
+def test_read_time_range(path):
+    df = pd.DataFrame({"channel": 1, "datetime": TIMES, "baseline": [1.0, 2.0, 3.0]})
+    results.write_parameter(path, "pulser", "baseline", df, {})
+
+    # [start, end), times without timezone are UTC
+    df = results.read_parameter(
+        path, "pulser", "baseline", start="2023-01-01 00:01", end=TIMES[2]
+    )
+    assert df["baseline"].tolist() == [2]
+
+
+def test_summary(path):
+    df = pd.DataFrame(
+        {
+            "channel": [1, 1, 1, 2],
+            "datetime": pd.Timestamp("2023-01-01", tz="UTC")
+            + pd.to_timedelta([10, 50, 70, 20], unit="s"),
+            "baseline": [1.0, 3.0, 5.0, 2.0],
+        }
+    )
+    results.write_parameter(path, "pulser", "baseline", df.iloc[:2], {})
+    results.append_parameter(path, "pulser", "baseline", df.iloc[2:], {})
+
+    # count and sum in 1 minute buckets, merged over appended data
+    summary = results.read_summary(path, "pulser", "baseline")
+    assert summary["channel"].tolist() == [1, 1, 2]
+    assert summary["count"].tolist() == [2, 1, 1]
+    assert summary["sum"].tolist() == [4, 5, 2]
+    assert summary["first"].tolist() == list(df["datetime"][[0, 2, 3]])
+    assert summary["last"].tolist() == list(df["datetime"][[1, 2, 3]])
+    pd.testing.assert_frame_equal(summary, results.get_summary(df, "baseline"))
+    # files saved without summary are summarised from their rows
+    with pd.HDFStore(results.get_results_file(path), mode="a") as store:
+        store.remove("/pulser/baseline/summary")
+    pd.testing.assert_frame_equal(
+        results.read_summary(path, "pulser", "baseline"), summary
+    )
+
+
+# -------------------------------------------------------------------------------
+# segments and compaction
+# -------------------------------------------------------------------------------
+
+
+def get_segments(path):
+    return segments.read_manifest(results.get_results_file(path))["segments"]
+
+
+def append(path, minute, parameter="baseline"):
+    """Append the value of channel 1 at a given minute (equal to the minute)."""
+    df = pd.DataFrame(
+        {
+            "channel": [1],
+            "datetime": [TIMES[0] + pd.Timedelta(minutes=minute)],
+            parameter: [float(minute)],
+        }
+    )
+    results.append_parameter(path, "pulser", parameter, df, {"parameter": parameter})
+
+
+def test_compact(path):
+    for minute in range(3):
+        append(path, minute)
+    append(path, 0, "energy")
+    # the first append creates the result file, then one segment per append
+    assert len(results.get_files(path)) == 4
+
+    results.compact(path)
+
+    assert results.get_files(path) == [results.get_results_file(path)]
+    assert get_segments(path) == []
+    assert not [file for file in os.listdir(os.path.dirname(path)) if "-0000" in file]
+    df = results.read_parameter(path, "pulser", "baseline")
+    assert df["baseline"].tolist() == [0, 1, 2]
+    assert results.read_plot_info(path, "pulser", "energy") == {"parameter": "energy"}
+
+
+def test_compact_while_appending(path, monkeypatch):
+    append(path, 0)
+    append(path, 0, "energy")
+    to_append = ["baseline", "energy"]
+
+    # new segments are registered while the result file is being written
+    write_file = results.write_file
+
+    def write_and_append(file, *args):
+        write_file(file, *args)
+        if file == results.get_results_file(path) + ".compact.tmp":
+            while to_append:
+                append(path, 1, to_append.pop())
+
+    monkeypatch.setattr(results, "write_file", write_and_append)
+    results.compact(path)
+    monkeypatch.undo()
+
+    # new segments are kept, and their rows are read only once
+    assert len(get_segments(path)) == 2
+    for parameter in ["baseline", "energy"]:
+        df = results.read_parameter(path, "pulser", parameter)
+        assert df[parameter].tolist() == [0, 1]
+
+
+def test_automatic_compaction(path, monkeypatch):
+    monkeypatch.setattr(results, "MAX_SEGMENTS", 3)
+
+    for minute in range(3):
+        append(path, minute)
+    assert len(get_segments(path)) == 2
+    append(path, 3)
+    assert get_segments(path) == []
+    append(path, 4)
+
+    assert len(results.get_files(path)) == 2
+    df = results.read_parameter(path, "pulser", "baseline")
+    assert df["baseline"].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_compaction_lock(path):
+    append(path, 0)
+    append(path, 1)
+
+    # another compaction running: nothing done
+    with segments.lock_compaction(results.get_results_file(path)) as locked:
+        assert locked
+        results.compact(path)
+    assert len(get_segments(path)) == 1
+
+    results.compact(path)
+    assert get_segments(path) == []
@@ -0,0 +1,172 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from legend_data_monitor import aggregates, results, save_data, segments
+
+TIMES = pd.date_range("2023-01-01 00:00", periods=3, freq="10min", tz="UTC")
+KEY = "IsPulser_Baseline"
+
+
+@pytest.fixture
+def file_path(tmp_path):
+    return str(tmp_path / "l200-p03-r000-phy-geds.hdf")
+
+
+def save(file_path, df, saving="overwrite"):
+    """Save absolute and mean values of a parameter, as save_hdf()."""
+    writer = save_data.HDFWriter()
+    for parameter, key_name in [("baseline", KEY), ("baseline_mean", KEY + "_mean")]:
+        save_data.get_pivot(df, parameter, key_name, file_path, saving, writer)
+    save_data.remove_var_key(file_path, KEY, writer)
+    writer.close()
+
+
+BASELINES = pd.DataFrame(
+    {
+        "channel": [1, 2] * 3,
+        "datetime": TIMES.repeat(2),
+        "baseline": [9.0, 18.0, 11.0, 22.0, 12.0, 20.0],
+        "baseline_mean": [10.0, 20.0] * 3,
+    }
+)
+
+
+def test_read_pivot(file_path):
+    save(file_path, BASELINES)
+
+    df = save_data.read_pivot(file_path, KEY)
+    assert df.index.tolist() == list(TIMES)
+    assert df[1].tolist() == [9, 11, 12]
+    assert df[2].tolist() == [18, 22, 20]
+    # % variations derived from absolute and mean values
+    df = save_data.read_pivot(file_path, KEY + "_var")
+    assert df[1].tolist() == pytest.approx([-10, 10, 20])
+    assert df[2].tolist() == pytest.approx([-10, 10, 0])
+
+    # time range [start, end) and channels, with the same mean values
+    df = save_data.read_pivot(
+        file_path, KEY + "_var", start="2023-01-01 00:10", end=TIMES[2], channels=[2]
+    )
+    assert df.index.tolist() == [TIMES[1]]
+    assert list(df.columns) == [2]
+    assert df[2].tolist() == pytest.approx([10])
+
+
+def test_read_pivot_saved_by_older_versions(file_path):
+    # fixed format, with saved % variations
+    with pd.HDFStore(file_path, mode="w") as store:
+        store.put(
+            KEY, BASELINES.pivot(index="datetime", columns="channel", values="baseline")
+        )
+        store.put(KEY + "_var", pd.DataFrame({1: [1.0, 2.0, 3.0]}, index=TIMES))
+
+    df = save_data.read_pivot(file_path, KEY + "_var", start=TIMES[1])
+    assert df[1].tolist() == [2, 3]
+    df = save_data.read_pivot(file_path, KEY, end=TIMES[1], channels=[2])
+    assert df[2].tolist() == [18]
+
+
+# -------------------------------------------------------------------------------
+# segments
+# -------------------------------------------------------------------------------
+
+
+def test_append(file_path):
+    # one bunch per time, a new channel in the last one
+    bunches = [BASELINES[BASELINES["datetime"] == time] for time in TIMES]
+    bunches[2] = pd.concat(
+        [
+            bunches[2],
+            pd.DataFrame(
+                {
+                    "channel": [3],
+                    "datetime": TIMES[[2]],
+                    "baseline": [33.0],
+                    "baseline_mean": [30.0],
+                }
+            ),
+        ],
+        ignore_index=True,
+    )
+    save(file_path, bunches[0])
+    for bunch in bunches[1:]:
+        save(file_path, bunch, "append")
+
+    # the file is never rewritten: one segment per appended bunch
+    assert len(segments.get_files(file_path)) == 3
+    assert not os.path.exists(file_path + ".tmp")
+    df = save_data.read_pivot(file_path, KEY)
+    assert df.index.tolist() == list(TIMES)
+    assert df[1].tolist() == [9, 11, 12]
+    assert df[3].tolist() == pytest.approx([np.nan, np.nan, 33], nan_ok=True)
+    df = save_data.read_pivot(file_path, KEY + "_var", start=TIMES[1], channels=[3, 1])
+    assert list(df.columns) == [3, 1]
+    assert df[1].tolist() == pytest.approx([10, 20])
+    # bins split among segments are combined
+    df = aggregates.read_aggregates(file_path, KEY, level="1h")
+    assert df["count"].tolist() == [3, 3, 1]
+    assert df["mean"].tolist() == pytest.approx([32 / 3, 20, 33])
+
+
+def test_compaction(file_path, monkeypatch):
+    monkeypatch.setattr(results, "MAX_SEGMENTS", 2)
+    bunches = [BASELINES[BASELINES["datetime"] == time] for time in TIMES]
+
+    save(file_path, bunches[0])
+    save(file_path, bunches[1], "append")
+    assert len(segments.get_files(file_path)) == 2
+    # second segment: merged into the file
+    save(file_path, bunches[2], "append")
+    assert segments.get_files(file_path) == [file_path]
+    folder = os.path.dirname(file_path)
+    assert not [file for file in os.listdir(folder) if "-0000" in file]
+    assert save_data.read_pivot(file_path, KEY)[1].tolist() == [9, 11, 12]
+    df = aggregates.read_aggregates(file_path, KEY, level="1h")
+    assert df["count"].tolist() == [3, 3]
+
+    # explicitly, e.g. with 'legend-data-monitor compact'
+    later = bunches[0].assign(datetime=TIMES[2] + pd.Timedelta("1min"))
+    save(file_path, later, "append")
+    save_data.compact_hdf(file_path)
+    assert segments.get_files(file_path) == [file_path]
+    assert save_data.read_pivot(file_path, KEY)[1].tolist() == [9, 11, 12, 9]
+
+
+def test_replace_and_remove(file_path):
+    save(file_path, BASELINES)
+    # % variations saved by older versions
+    writer = save_data.HDFWriter()
+    writer.put(file_path, KEY + "_var", pd.DataFrame({1: [1.0]}))
+    writer.close()
+    assert save_data.read_pivot(file_path, KEY + "_var")[1].tolist() == [1]
+
+    # removed when saving again, then derived from absolute and mean values
+    save(file_path, BASELINES, "append")
+    with segments.open_files(file_path) as stores:
+        assert KEY + "_var" not in segments.get_keys(stores)
+    assert len(save_data.read_pivot(file_path, KEY + "_var")) == 6
+    # overwritten keys replace all the saved rows
+    save(file_path, BASELINES)
+    assert len(save_data.read_pivot(file_path, KEY)) == 3
+
+
+def test_write_var_keys(file_path):
+    save(file_path, BASELINES[BASELINES["datetime"] < TIMES[2]])
+    save(file_path, BASELINES[BASELINES["datetime"] == TIMES[2]], "append")
+
+    # for readers of '_var' keys with pandas, in the file itself
+    save_data.write_var_keys(file_path)
+    assert segments.get_files(file_path) == [file_path]
+    df = pd.read_hdf(file_path, KEY + "_var")
+    assert df[1].tolist() == pytest.approx([-10, 10, 20])
+    assert df[2].tolist() == pytest.approx([-10, 10, 0])
+
+    # removed when saving again, as they would not be updated
+    later = BASELINES.assign(datetime=BASELINES["datetime"] + pd.Timedelta("1h"))
+    save(file_path, later, "append")
+    with segments.open_files(file_path) as stores:
+        assert KEY + "_var" not in segments.get_keys(stores)
+    assert len(save_data.read_pivot(file_path, KEY + "_var")) == 6
@@ -0,0 +1,76 @@
+import pandas as pd
+
+from legend_data_monitor import subsystem, utils
+
+TIMES = pd.date_range("2023-01-01", periods=4, freq="1s", tz="UTC")
+
+
+def get_subsystem(data, tolerance=0):
+    """Subsystem with some data, without loading anything."""
+    sub = object.__new__(subsystem.Subsystem)
+    sub.data = data
+    sub.coincidence_tolerance = tolerance
+    return sub
+
+
+def test_flag_events():
+    aux = get_subsystem(
+        pd.DataFrame(
+            {
+                "datetime": TIMES,
+                "flag_pulser": [True, False, False, True],
+                "flag_muon": [False, True, False, False],
+            }
+        )
+    )
+    # two channels per event, in any order
+    geds = get_subsystem(
+        pd.DataFrame({"channel": [1, 2, 2, 1], "datetime": TIMES[[0, 0, 2, 3]]})
+    )
+
+    geds.flag_events(pulser=aux, muon=aux)
+
+    assert geds.data["flag_pulser"].tolist() == [True, True, False, True]
+    assert not geds.data["flag_muon"].any()
+    assert "flag_fc_bsln" not in geds.data
+    assert geds.data["datetime"].tolist() == list(TIMES[[0, 0, 2, 3]])
+
+
+def test_flag_events_tolerance():
+    # pulser timestamps 5 ns off (e.g. cal data): nothing flagged without tolerance
+    aux = get_subsystem(
+        pd.DataFrame(
+            {"datetime": TIMES + pd.Timedelta(5), "flag_pulser": [True, False] * 2}
+        )
+    )
+    geds = get_subsystem(pd.DataFrame({"channel": 1, "datetime": TIMES}))
+
+    geds.flag_pulser_events(aux)
+    assert not geds.data["flag_pulser"].any()
+
+    geds.coincidence_tolerance = 10
+    geds.flag_pulser_events(aux)
+    assert geds.data["flag_pulser"].tolist() == [True, False, True, False]
+
+
+def test_remove_timestamps():
+    times = pd.date_range("2023-01-01 00:00", periods=6, freq="10min", tz="UTC")
+    sub = get_subsystem(
+        pd.DataFrame(
+            {"channel": [1, 2] * 6, "datetime": times.repeat(2), "baseline": range(12)}
+        )
+    )
+    # detector names are in the channel map only
+    sub.channel_map = pd.DataFrame({"channel": [1, 2], "name": ["V01", "V02"]})
+    remove_intervals = utils.get_remove_intervals(
+        {
+            "V01": [{"from": "20230101T001000Z", "to": "20230101T002000Z"}],
+            "V02": [{"from": "20230101T004000Z", "to": "20230101T010000Z"}],
+            "V99": [{"from": "20230101T000000Z", "to": "20230101T010000Z"}],
+        }
+    )
+
+    sub.remove_timestamps(remove_intervals)
+
+    # V01 at 00:10 and 00:20, V02 at 00:40 and 00:50
+    assert sub.data["baseline"].tolist() == [0, 1, 3, 5, 6, 7, 8, 10]
@@ -0,0 +1,91 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from legend_data_monitor import utils
+
+
+@pytest.mark.parametrize(
+    "tolerance, expected",
+    [
+        (0, [False, True, False, False, False]),
+        (1, [False, True, False, True, False]),
+        (5, [True, True, True, True, True]),
+    ],
+)
+def test_get_coincidences(tolerance, expected):
+    # reference times not sorted, with duplicates
+    ref_times = np.array([15, 5, 5])
+
+    mask = utils.get_coincidences(np.array([0, 5, 10, 14, 20]), ref_times, tolerance)
+    assert mask.tolist() == expected
+
+
+def test_get_coincidences_no_reference():
+    mask = utils.get_coincidences(np.arange(5), np.array([], dtype="int64"), 10)
+    assert not mask.any() and len(mask) == 5
+
+
+def test_get_ns():
+    datetimes = pd.Series(
+        [pd.Timestamp(10**9, tz="UTC"), pd.Timestamp("2023-01-01", tz="UTC")]
+    )
+    assert utils.get_ns(datetimes).tolist() == [10**9, 1672531200 * 10**9]
+
+
+@pytest.mark.parametrize(
+    "duration, expected",
+    [(0, 0), (1.5, 1_500_000_000), ("1us", 1000), ("10 ms", 10**7)],
+)
+def test_get_ns_duration(duration, expected):
+    assert utils.get_ns_duration(duration) == expected
+
+
+# -------------------------------------------------------------------------------
+# exclusions
+# -------------------------------------------------------------------------------
+
+
+def test_is_in_intervals():
+    # overlapping and nested intervals, not sorted
+    intervals = utils.get_remove_intervals(
+        {
+            "V01": [
+                {"from": "20230101T020000Z", "to": "20230101T030000Z"},
+                {"from": "20230101T000000Z", "to": "20230101T010000Z"},
+                {"from": "20230101T002000Z", "to": "20230101T003000Z"},
+                {"from": "20230101T005000Z", "to": "20230101T012000Z"},
+            ],
+            "V02": [],
+        }
+    )
+    assert list(intervals) == ["V01"]
+
+    times = pd.Series(
+        pd.to_datetime(
+            ["2022-12-31 23:59", "2023-01-01 00:00", "2023-01-01 00:40"]
+            + ["2023-01-01 01:20", "2023-01-01 01:21", "2023-01-01 03:00"]
+            + ["2023-01-01 03:01"],
+            utc=True,
+        )
+    )
+    mask = utils.is_in_intervals(utils.get_ns(times), intervals["V01"])
+    # extremes included, inside the nested interval too
+    assert mask.tolist() == [False, True, True, True, False, True, False]
+
+
+def test_get_remove_intervals_default():
+    remove_keys = copy.deepcopy(utils.REMOVE_KEYS)
+
+    assert utils.get_remove_intervals() is utils.get_remove_intervals()
+    # the settings are not converted in place
+    assert utils.REMOVE_KEYS == remove_keys
+
+
+def test_get_removed_files():
+    # faulty p02 files, skipped by the DataLoader query before as a quick fix
+    assert {"20230125T222013Z", "20230126T015308Z", "20230222T231553Z"} <= set(
+        utils.get_removed_files()
+    )